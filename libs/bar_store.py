@@ -0,0 +1,152 @@
+import os
+import time
+import sqlite3
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAGetTrendbarsRes
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOATrendbar, ProtoOATrendbarPeriod
+from twisted.internet import defer
+
+from libs.trendbars import PERIOD_MINUTES
+from libs.errors import unwrapFirstError
+
+BUSY_TIMEOUT = 5  # seconds to wait for another process's write to the same file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trendbar (
+    symbolId INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    volume INTEGER NOT NULL,
+    low INTEGER NOT NULL,
+    deltaOpen INTEGER NOT NULL,
+    deltaHigh INTEGER NOT NULL,
+    deltaClose INTEGER NOT NULL,
+    PRIMARY KEY (symbolId, period, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    symbolId INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    fromTs INTEGER NOT NULL,
+    toTs INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_key ON coverage (symbolId, period, fromTs);
+"""
+
+
+class BarStore:
+    """On-disk trendbar store that records which time ranges it holds.
+
+    Bars are keyed by symbolId + period, independent of the account. Only closed
+    bars are stored; the range covering the still-forming bar is always fetched
+    from cTrader. Timestamps are in milliseconds, coverage ranges are inclusive.
+    """
+
+    def __init__(self, path, maxBars):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")  # HTTP workers share the file and write to it concurrently
+        self.db.executescript(SCHEMA)
+        self.maxBars = maxBars
+        self.hits = 0
+        self.fetches = 0
+
+    def missingRanges(self, symbolId, period, fromTs, toTs):
+        """Return the (from, to) sub-ranges of [fromTs, toTs] not yet held in the store."""
+        rows = self.db.execute(
+            "SELECT fromTs, toTs FROM coverage WHERE symbolId = ? AND period = ? AND toTs >= ? AND fromTs <= ? ORDER BY fromTs",
+            (symbolId, period, fromTs, toTs),
+        ).fetchall()
+        gaps = []
+        cursor = fromTs
+        for start, end in rows:
+            if start > cursor:
+                gaps.append((cursor, start - 1))
+            cursor = max(cursor, end + 1)
+        if cursor <= toTs:
+            gaps.append((cursor, toTs))
+        return gaps
+
+    def load(self, symbolId, period, fromTs, toTs):
+        """Return the stored ProtoOATrendbar messages whose open time lies in [fromTs, toTs]."""
+        rows = self.db.execute(
+            "SELECT ts, volume, low, deltaOpen, deltaHigh, deltaClose FROM trendbar "
+            "WHERE symbolId = ? AND period = ? AND ts >= ? AND ts <= ? ORDER BY ts",
+            (symbolId, period, -(-fromTs // 60000), toTs // 60000),
+        )
+        return [
+            ProtoOATrendbar(utcTimestampInMinutes=ts, volume=volume, low=low, deltaOpen=deltaOpen,
+                            deltaHigh=deltaHigh, deltaClose=deltaClose)
+            for ts, volume, low, deltaOpen, deltaHigh, deltaClose in rows
+        ]
+
+    def save(self, symbolId, period, fromTs, toTs, trendbars):
+        """Store the closed bars of one upstream response and mark the range they cover."""
+        periodName = ProtoOATrendbarPeriod.Name(period)
+        closedUntil = int(time.time() * 1000) - PERIOD_MINUTES[periodName] * 60000
+        if len(trendbars) >= self.maxBars:
+            # The response was capped, so only the span actually returned is known to be complete
+            stamps = [bar.utcTimestampInMinutes * 60000 for bar in trendbars]
+            fromTs, toTs = min(stamps), max(stamps)
+        toTs = min(toTs, closedUntil)
+        if toTs < fromTs:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO trendbar VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (symbolId, period, bar.utcTimestampInMinutes, bar.volume, bar.low,
+                     bar.deltaOpen, bar.deltaHigh, bar.deltaClose)
+                    for bar in trendbars if bar.utcTimestampInMinutes * 60000 <= toTs
+                ],
+            )
+            rows = self.db.execute(
+                "SELECT rowid, fromTs, toTs FROM coverage WHERE symbolId = ? AND period = ? AND toTs >= ? AND fromTs <= ?",
+                (symbolId, period, fromTs - 1, toTs + 1),
+            ).fetchall()
+            for rowid, start, end in rows:
+                fromTs, toTs = min(fromTs, start), max(toTs, end)
+                self.db.execute("DELETE FROM coverage WHERE rowid = ?", (rowid,))
+            self.db.execute("INSERT INTO coverage VALUES (?, ?, ?, ?)", (symbolId, period, fromTs, toTs))
+
+    def fetch(self, fromTs, toTs, period, symbolId, accountId, loader):
+        """Serve [fromTs, toTs] from the store, asking loader only for the missing ranges.
+
+        loader(fromTs, toTs) must return a Deferred firing with a ProtoMessage, like
+        sendProtoOAGetTrendbarsReq. The result is a ProtoMessage wrapping one merged
+        ProtoOAGetTrendbarsRes, or the first upstream error unchanged.
+        """
+        fromTs, toTs, symbolId = int(fromTs), int(toTs), int(symbolId)
+        period = ProtoOATrendbarPeriod.Value(period)
+        gaps = self.missingRanges(symbolId, period, fromTs, toTs)
+        if not gaps:
+            self.hits += 1
+        self.fetches += len(gaps)
+        deferreds = [loader(start, end) for start, end in gaps]
+        result = defer.gatherResults(deferreds, consumeErrors=True)
+        result.addCallbacks(self._merge, unwrapFirstError, callbackArgs=(gaps, fromTs, toTs, period, symbolId, accountId))
+        return result
+
+    def _merge(self, responses, gaps, fromTs, toTs, period, symbolId, accountId):
+        fresh = {}
+        first, last = -(-fromTs // 60000), toTs // 60000  # the minutes load() bounds the stored bars to
+        for (start, end), response in zip(gaps, responses):
+            if response is None or response.payloadType != ProtoOAGetTrendbarsRes().payloadType:
+                return response
+            pb = Protobuf.extract(response)
+            self.save(symbolId, period, start, end, pb.trendbar)
+            for bar in pb.trendbar:
+                if first <= bar.utcTimestampInMinutes <= last:
+                    fresh[bar.utcTimestampInMinutes] = bar
+        bars = {bar.utcTimestampInMinutes: bar for bar in self.load(symbolId, period, fromTs, toTs)}
+        bars.update(fresh)
+        res = ProtoOAGetTrendbarsRes(ctidTraderAccountId=accountId or 0, period=period, symbolId=symbolId,
+                                     timestamp=int(time.time() * 1000))
+        res.trendbar.extend(bars[ts] for ts in sorted(bars))
+        return ProtoMessage(payloadType=res.payloadType, payload=res.SerializeToString())
+
+    def stats(self):
+        return {"hits": self.hits, "upstreamFetches": self.fetches}
@@ -0,0 +1,85 @@
+import time
+from collections import deque
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Fails requests fast while the recent upstream failure rate is too high.
+
+    Outcomes of the last window seconds are kept. Once at least minRequests are
+    recorded and the share of failures reaches threshold, the breaker opens for
+    cooldown seconds. After that a single probe request is let through: success
+    closes the breaker again, failure reopens it.
+    """
+
+    def __init__(self, threshold, minRequests, window, cooldown):
+        self.threshold = threshold
+        self.minRequests = minRequests
+        self.window = window
+        self.cooldown = cooldown
+        self.state = STATE_CLOSED
+        self.outcomes = deque()  # (monotonic time, ok)
+        self.failures = 0
+        self.openedAt = None
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Return True if a request may be sent now; in half-open state only one probe is allowed at a time."""
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.openedAt < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = STATE_HALF_OPEN
+        if self.state == STATE_HALF_OPEN:
+            if self.probing:
+                self.rejected += 1
+                return False
+            self.probing = True
+        return True
+
+    def retryAfter(self):
+        """Seconds until the breaker lets a request through again."""
+        if self.state == STATE_OPEN:
+            return max(0.0, self.cooldown - (time.monotonic() - self.openedAt))
+        return 1.0
+
+    def record(self, ok):
+        """Record an outcome: True for an answer, False for an error or timeout, None for no verdict (e.g. cancelled)."""
+        if self.state == STATE_HALF_OPEN:
+            self.probing = False
+            if ok:
+                self.reset()
+            elif ok is not None:
+                self._trip()
+            return
+        if ok is None or self.state == STATE_OPEN:
+            return
+        now = time.monotonic()
+        self.outcomes.append((now, ok))
+        self.failures += not ok
+        while self.outcomes[0][0] < now - self.window:
+            self.failures -= not self.outcomes.popleft()[1]
+        if len(self.outcomes) >= self.minRequests and self.failures >= self.threshold * len(self.outcomes):
+            self._trip()
+
+    def _trip(self):
+        self.state = STATE_OPEN
+        self.openedAt = time.monotonic()
+        self.trips += 1
+        self.outcomes.clear()
+        self.failures = 0
+
+    def reset(self):
+        self.state = STATE_CLOSED
+        self.probing = False
+        self.outcomes.clear()
+        self.failures = 0
+
+    def stats(self):
+        return {"state": self.state, "trips": self.trips, "rejected": self.rejected,
+                "recent": len(self.outcomes), "recentFailures": self.failures}
@@ -0,0 +1,333 @@
+import itertools
+import socket
+
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAErrorRes
+from twisted.application.internet import ClientService, backoffPolicy
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.protocol import Factory, ProcessProtocol
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python.failure import Failure
+
+from libs.deadlines import requestTimeout
+from libs.errors import ProxyError, BrokerError
+
+# errorCode prefix of a ProtoOAErrorRes that carries a proxy error from the broker, followed by its HTTP status
+PROXY_ERROR_PREFIX = "PROXY_"
+
+MAX_FRAME = 15000000  # as the cTrader protocol
+
+# payloadType of a worker frame cancelling its request with the frame's clientMsgId; no cTrader message uses 0
+CANCEL = 0
+# payloadType of a worker frame asking for the body of one of the broker's own HTTP routes, named by the
+# payload; the reply carries the body as its payload. No cTrader message uses 1
+ADMIN = 1
+# a worker appends "@<seconds>" to a request's clientMsgId: the deadline it waits for the answer
+DEADLINE_SEPARATOR = "@"
+# the broker sends a worker's request upstream as "<worker number>/<clientMsgId>"
+UPSTREAM_SEPARATOR = "/"
+
+
+def protoMessage(pb):
+    """Wrap a payload the broker answers itself in a ProtoMessage, as if cTrader had sent it."""
+    return ProtoMessage(payloadType=pb.payloadType, payload=pb.SerializeToString())
+
+
+def errorMessage(status, description):
+    return protoMessage(ProtoOAErrorRes(errorCode=f"{PROXY_ERROR_PREFIX}{status}", description=description))
+
+
+def splitDeadline(clientMsgId):
+    """Split a request's wire clientMsgId into the worker's own clientMsgId and its deadline in seconds, if any."""
+    bare, separator, timeout = clientMsgId.rpartition(DEADLINE_SEPARATOR)
+    if not separator:
+        return clientMsgId, None
+    try:
+        return bare, float(timeout)
+    except ValueError:
+        return clientMsgId, None
+
+
+class BrokerConnection(Int32StringReceiver):
+    """The broker's end of one worker connection.
+
+    Frames are serialized ProtoMessages in both directions, length-prefixed like
+    cTrader's own protocol. Each request is answered with one frame carrying the
+    request's clientMsgId. A request is handled with the deadline the worker sent
+    along with it, and a CANCEL frame, or the worker going away, cancels it.
+    """
+    MAX_LENGTH = MAX_FRAME
+
+    def connectionMade(self):
+        self.number = next(self.factory.numbers)
+        self.subscriptions = set()  # (accountId, symbolId) spot subscriptions held for this worker
+        self.inFlight = {}  # clientMsgId → Deferred of a request not answered yet
+        self.factory.workers.add(self)
+
+    def upstreamId(self, clientMsgId):
+        """The clientMsgId to send a request of this worker upstream with, so broadcast() can tell its answer apart."""
+        return f"{self.number}{UPSTREAM_SEPARATOR}{clientMsgId}"
+
+    def connectionLost(self, reason):
+        self.factory.workers.discard(self)
+        inFlight, self.inFlight = self.inFlight, {}
+        for deferred in inFlight.values():
+            deferred.cancel()
+        if self.factory.onLost is not None:
+            self.factory.onLost(self)
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        if message.payloadType == CANCEL:
+            deferred = self.inFlight.pop(message.clientMsgId, None)
+            if deferred is not None:
+                deferred.cancel()
+            return
+        clientMsgId, timeout = splitDeadline(message.clientMsgId)
+        message.clientMsgId = clientMsgId
+        token = requestTimeout.set(timeout)
+        try:
+            deferred = defer.maybeDeferred(self.factory.handle, self, message)
+        finally:
+            requestTimeout.reset(token)
+        self.inFlight[clientMsgId] = deferred
+        deferred.addBoth(self._reply, clientMsgId)
+
+    def _reply(self, result, clientMsgId):
+        if self.inFlight.pop(clientMsgId, None) is None:
+            return  # cancelled by the worker, which no longer waits for it
+        if isinstance(result, Failure):
+            status = result.value.status if isinstance(result.value, ProxyError) else 502
+            result = errorMessage(status, result.getErrorMessage())
+        elif not isinstance(result, ProtoMessage):
+            result = errorMessage(502, str(result) if result is not None else "no response from cTrader")
+        if not self.connected:
+            return
+        reply = ProtoMessage()
+        reply.CopyFrom(result)  # responses may be shared between coalesced callers
+        reply.clientMsgId = clientMsgId
+        self.sendString(reply.SerializeToString())
+
+
+class BrokerServer(Factory):
+    """Serves the broker's upstream sessions to HTTP worker processes.
+
+    handle(connection, message) answers one forwarded request and returns a
+    ProtoMessage or a Deferred firing with one; failures and non-messages are sent
+    back as ProtoOAErrorRes with a PROXY_<status> errorCode. broadcast() pushes an
+    upstream event to every worker, except the one whose request it answers, which
+    gets it as the reply. onLost(connection) is called when a worker goes away, to
+    release what it held.
+    """
+    protocol = BrokerConnection
+
+    def __init__(self, handle, onLost=None):
+        self.handle = handle
+        self.onLost = onLost
+        self.workers = set()
+        self.numbers = itertools.count()
+
+    def broadcast(self, message):
+        data = message.SerializeToString()
+        requester = self.requesterOf(message)
+        for worker in self.workers:
+            if worker is not requester:
+                worker.sendString(data)
+
+    def requesterOf(self, message):
+        """The worker with an in-flight request this upstream message answers, if any (see upstreamId)."""
+        if not message.HasField("clientMsgId"):
+            return None
+        number, separator, clientMsgId = message.clientMsgId.partition(UPSTREAM_SEPARATOR)
+        if not separator:
+            return None
+        return next((worker for worker in self.workers
+                     if str(worker.number) == number and clientMsgId in worker.inFlight), None)
+
+
+class BrokerClientProtocol(Int32StringReceiver):
+    MAX_LENGTH = MAX_FRAME
+
+    def connectionMade(self):
+        self.factory.client._connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.client._disconnected(reason)
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        self.factory.client._received(message)
+
+
+class BrokerClient(ClientService):
+    """Stands in for ctrader_open_api.Client in an HTTP worker: requests go to the broker over a Unix socket.
+
+    Takes the same callbacks as Client. The message callback sees every frame the
+    broker sends (responses and broadcast events) except proxy errors, which fail
+    the request with BrokerError instead. Requests pending when the connection
+    drops fail with BrokerError 503. responseTimeoutInSeconds is passed on as the
+    request's deadline in the broker, and cancelling a request cancels it there too.
+    """
+
+    def __init__(self, path, clock=reactor):
+        factory = Factory.forProtocol(BrokerClientProtocol)
+        factory.client = self
+        super().__init__(UNIXClientEndpoint(clock, path), factory,
+                         retryPolicy=backoffPolicy(initialDelay=0.1, maxDelay=5), clock=clock)
+        self.isConnected = False
+        self._protocol = None
+        self._pending = {}
+        self._ids = itertools.count()
+
+    def setConnectedCallback(self, callback):
+        self._connectedCallback = callback
+
+    def setDisconnectedCallback(self, callback):
+        self._disconnectedCallback = callback
+
+    def setMessageReceivedCallback(self, callback):
+        self._messageReceivedCallback = callback
+
+    def send(self, request, clientMsgId=None, responseTimeoutInSeconds=None, **params):
+        if not self.isConnected:
+            return defer.fail(BrokerError(503, "not connected to the broker"))
+        clientMsgId = clientMsgId or f"w{next(self._ids)}"
+        deferred = defer.Deferred(lambda _: self._cancel(clientMsgId))
+        self._pending[clientMsgId] = deferred
+        wireId = f"{clientMsgId}{DEADLINE_SEPARATOR}{responseTimeoutInSeconds:g}" if responseTimeoutInSeconds else clientMsgId
+        message = ProtoMessage(payloadType=request.payloadType, payload=request.SerializeToString(), clientMsgId=wireId)
+        self._protocol.sendString(message.SerializeToString())
+        return deferred
+
+    def fetch(self, path):
+        """Ask the broker for the body it serves on an observability route; fires with the ADMIN reply."""
+        if not self.isConnected:
+            return defer.fail(BrokerError(503, "not connected to the broker"))
+        clientMsgId = f"w{next(self._ids)}"
+        deferred = defer.Deferred(lambda _: self._pending.pop(clientMsgId, None))
+        self._pending[clientMsgId] = deferred
+        self._protocol.sendString(ProtoMessage(payloadType=ADMIN, payload=path.encode("utf-8"), clientMsgId=clientMsgId).SerializeToString())
+        return deferred
+
+    def _cancel(self, clientMsgId):
+        if self._pending.pop(clientMsgId, None) is not None and self._protocol is not None:
+            self._protocol.sendString(ProtoMessage(payloadType=CANCEL, clientMsgId=clientMsgId).SerializeToString())
+
+    def _connected(self, protocol):
+        self._protocol = protocol
+        self.isConnected = True
+        self._connectedCallback(self)
+
+    def _disconnected(self, reason):
+        self.isConnected = False
+        self._protocol = None
+        pending, self._pending = self._pending, {}
+        for deferred in pending.values():
+            deferred.errback(BrokerError(503, "connection to the broker lost"))
+        self._disconnectedCallback(self, reason)
+
+    def _received(self, message):
+        deferred = self._pending.pop(message.clientMsgId, None) if message.HasField("clientMsgId") else None
+        if message.payloadType == ADMIN:
+            if deferred is not None:
+                deferred.callback(message)
+            return
+        if message.payloadType == ProtoOAErrorRes().payloadType:
+            error = ProtoOAErrorRes.FromString(message.payload)
+            if error.errorCode.startswith(PROXY_ERROR_PREFIX):
+                if deferred is not None:
+                    deferred.errback(BrokerError(int(error.errorCode[len(PROXY_ERROR_PREFIX):]), error.description))
+                return
+        self._messageReceivedCallback(self, message)
+        if deferred is not None:
+            deferred.callback(message)
+
+
+class WorkerProcess(ProcessProtocol):
+    def __init__(self, workers, index):
+        self.workers = workers
+        self.index = index
+
+    def processEnded(self, reason):
+        self.workers._ended(self, reason)
+
+
+class Workers:
+    """Keeps `count` copies of a command running as child processes, restarting any that exits until stop().
+
+    env(index) gives the environment of worker `index`; onExit(index, reason) is
+    told about every exit.
+    """
+
+    def __init__(self, count, argv, env, onExit=None, restartDelay=1, killTimeout=5, clock=reactor):
+        self.count = count
+        self.argv = argv
+        self.env = env
+        self.onExit = onExit
+        self.restartDelay = restartDelay
+        self.killTimeout = killTimeout
+        self.clock = clock
+        self.processes = {}
+        self.stopping = None
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        if self.stopping is not None:
+            return
+        process = WorkerProcess(self, index)
+        # stdin is a pipe so a worker is not left reading the broker's terminal; logs go to the broker's stdout/stderr
+        self.clock.spawnProcess(process, self.argv[0], self.argv, env=self.env(index), childFDs={0: "w", 1: 1, 2: 2})
+        self.processes[index] = process
+
+    def _ended(self, process, reason):
+        if self.processes.get(process.index) is process:
+            del self.processes[process.index]
+        if self.onExit is not None:
+            self.onExit(process.index, reason)
+        if self.stopping is None:
+            self.clock.callLater(self.restartDelay, self._spawn, process.index)
+        elif not self.processes and not self.stopping.called:
+            if self._kill.active():
+                self._kill.cancel()
+            self.stopping.callback(None)
+
+    def stop(self):
+        """Send every worker SIGTERM (SIGKILL after killTimeout); the Deferred fires once all have exited."""
+        if self.stopping is None:
+            self.stopping = defer.Deferred()
+            self._kill = self.clock.callLater(self.killTimeout, self._signal, "KILL")
+            self._signal("TERM")
+            if not self.processes:
+                self._kill.cancel()
+                self.stopping.callback(None)
+        return self.stopping
+
+    def _signal(self, signum):
+        for process in list(self.processes.values()):
+            try:
+                process.transport.signalProcess(signum)
+            except ProcessExitedAlready:
+                pass
+
+
+def listenShared(port, interface, factory, clock=reactor):
+    """Listen on a TCP port with SO_REUSEPORT, so several processes can serve it and the kernel spreads connections."""
+    family, _, _, _, address = socket.getaddrinfo(interface, port, socket.AF_UNSPEC, socket.SOCK_STREAM,
+                                                  flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    try:
+        return clock.adoptStreamPort(sock.fileno(), family, factory)
+    finally:
+        sock.close()  # adoptStreamPort keeps its own duplicate of the descriptor
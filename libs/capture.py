@@ -0,0 +1,150 @@
+import os
+import struct
+import time
+from collections import deque
+
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+    ProtoOAAccountAuthReq, ProtoOAApplicationAuthReq, ProtoOAGetAccountListByAccessTokenReq,
+    ProtoOAGetAccountListByAccessTokenRes, ProtoOAGetCtidProfileByTokenReq, ProtoOARefreshTokenReq, ProtoOARefreshTokenRes,
+)
+
+MAGIC = b"CTCAP1\n"
+# monotonic timestamp (ns), direction, channel, length of the framed ProtoMessage that follows
+RECORD = struct.Struct(">qBBI")
+
+INBOUND = 0   # cTrader → proxy
+OUTBOUND = 1  # proxy → cTrader
+
+REDACTED = "redacted"
+# payloadType → (message class, credential fields blanked before a frame is recorded)
+CREDENTIALS = {cls().payloadType: (cls, fields) for cls, fields in (
+    (ProtoOAApplicationAuthReq, ("clientSecret",)),
+    (ProtoOAAccountAuthReq, ("accessToken",)),
+    (ProtoOARefreshTokenReq, ("refreshToken",)),
+    (ProtoOARefreshTokenRes, ("accessToken", "refreshToken")),
+    (ProtoOAGetAccountListByAccessTokenReq, ("accessToken",)),
+    (ProtoOAGetAccountListByAccessTokenRes, ("accessToken",)),
+    (ProtoOAGetCtidProfileByTokenReq, ("accessToken",)),
+)}
+
+
+def payloadTypeOf(data):
+    """Read a framed ProtoMessage's payloadType without decoding the rest of it."""
+    if data[:1] == b"\x08":  # field 1, varint: serialized first
+        value = shift = 0
+        for byte in data[1:6]:
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+    message = ProtoMessage()
+    message.ParseFromString(data)
+    return message.payloadType
+
+
+def redact(data):
+    """Return a frame with its secret and token fields replaced, or the frame itself if it carries none."""
+    credentials = CREDENTIALS.get(payloadTypeOf(data))
+    if credentials is None:
+        return data
+    cls, fields = credentials
+    message = ProtoMessage()
+    message.ParseFromString(data)
+    payload = cls()
+    payload.ParseFromString(message.payload)
+    for field in fields:
+        if payload.HasField(field):
+            setattr(payload, field, REDACTED)
+    message.payload = payload.SerializeToString()
+    return message.SerializeToString()
+
+
+class Capture:
+    """Records raw framed ProtoMessage bytes with monotonic timestamps.
+
+    The latest ringBytes of traffic are always kept in memory and dump() returns
+    them as a capture file. With a path, every record is also appended to that
+    file, which is rotated to path.1 … path.<backups> once it reaches fileBytes.
+    Each upstream connection gets a channel number in register() order.
+    Application secrets and access/refresh tokens are redacted before a frame
+    is recorded.
+    """
+
+    def __init__(self, ringBytes, path=None, fileBytes=64 * 1024 * 1024, backups=3):
+        self.ringBytes = ringBytes
+        self.path = path
+        self.fileBytes = fileBytes
+        self.backups = backups
+        self.ring = deque()
+        self.ringSize = 0
+        self.channels = {}
+        self.records = 0
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._open()
+
+    def register(self, client):
+        """Give a connection's client the next channel number."""
+        return self.channels.setdefault(id(client), len(self.channels))
+
+    def record(self, direction, client, data):
+        data = redact(data)
+        header = RECORD.pack(time.monotonic_ns(), direction, self.channels.get(id(client), 0), len(data))
+        self.records += 1
+        if self.ringBytes:
+            self.ring.append((header, data))
+            self.ringSize += len(header) + len(data)
+            while self.ringSize > self.ringBytes:
+                oldHeader, oldData = self.ring.popleft()
+                self.ringSize -= len(oldHeader) + len(oldData)
+        if self.file is not None:
+            self.file.write(header)
+            self.file.write(data)
+            if self.file.tell() >= self.fileBytes:
+                self._rotate()
+
+    def dump(self):
+        """The in-memory ring as a capture file."""
+        return MAGIC + b"".join(header + data for header, data in self.ring)
+
+    def _open(self):
+        self.file = open(self.path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {"records": self.records, "ringRecords": len(self.ring), "ringBytes": self.ringSize,
+                "file": self.path or None}
+
+
+def readCapture(stream):
+    """Yield (timestampNs, direction, channel, data) from a capture file opened in binary mode."""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a capture file")
+    while True:
+        header = stream.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        timestamp, direction, channel, length = RECORD.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            return  # truncated by a crash mid-write
+        yield timestamp, direction, channel, data
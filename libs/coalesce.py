@@ -0,0 +1,55 @@
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls: later callers with the same key wait on the first call's result.
+
+    Every caller gets its own Deferred, so one caller cancelling (e.g. an HTTP client
+    disconnecting) does not cancel the shared upstream request for the others; it
+    is cancelled only once every caller has gone.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._calls = {}
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, key, fn, *args):
+        """Call fn(*args) unless a call with the same key is already pending, and return a Deferred for its result."""
+        waiter = defer.Deferred(lambda d: self._cancel(key, d))
+        waiters = self._waiters.get(key)
+        if waiters is not None:
+            self.hits += 1
+            waiters.append(waiter)
+            return waiter
+        self.misses += 1
+        waiters = self._waiters[key] = [waiter]
+        try:
+            result = fn(*args)
+        except Exception:
+            del self._waiters[key]
+            raise
+        self._calls[key] = result
+        result.addBoth(self._fanOut, key)
+        return waiter
+
+    def _cancel(self, key, waiter):
+        waiters = self._waiters.get(key)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            self._calls[key].cancel()
+
+    def _fanOut(self, value, key):
+        del self._calls[key]
+        for waiter in self._waiters.pop(key):
+            if isinstance(value, Failure):
+                waiter.errback(value)
+            else:
+                waiter.callback(value)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "inFlight": len(self._waiters)}
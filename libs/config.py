@@ -8,6 +8,41 @@ CTRADER_REFRESH_TOKEN = os.getenv('CTRADER_REFRESH_TOKEN', '')
 CTRADER_CLIENT_ID     = os.getenv('CTRADER_CLIENT_ID', '')
 CTRADER_CLIENT_SECRET = os.getenv('CTRADER_CLIENT_SECRET', '')
 CTRADER_ACCOUNTID     = os.getenv('CTRADER_ACCOUNTID', '')
-CTRADER_HOST          = os.getenv('CTRADER_HOST', 'demo')  # "demo" or "live"
+CTRADER_ACCOUNTIDS    = [a.strip() for a in CTRADER_ACCOUNTID.split(',') if a.strip()]  # all authorized at startup; the first is the default
+CTRADER_HOST          = os.getenv('CTRADER_HOST', 'demo')  # "demo", "live", or host:port of a stand-in server (tools/fake_ctrader.py)
+CTRADER_TOKEN_EXPIRES_AT = int(os.getenv('CTRADER_TOKEN_EXPIRES_AT') or 0)  # epoch seconds; written to .env on each refresh, 0 if unknown
 
 CONSOLE_LOG_LEVEL = os.getenv('CONSOLE_LOG_LEVEL', 'INFO')
+
+CATALOGUE_CACHE_TTL   = int(os.getenv('CATALOGUE_CACHE_TTL', '3600'))    # seconds to keep symbol/asset lists
+BAR_STORE_PATH        = os.getenv('BAR_STORE_PATH', 'data/trendbars.db')  # empty disables the local trendbar store
+HISTORY_STORE_PATH    = os.getenv('HISTORY_STORE_PATH', 'data/history.db')  # empty disables the local deal/order history
+HISTORY_BACKFILL_DAYS = int(os.getenv('HISTORY_BACKFILL_DAYS', '90'))    # days of history downloaded on an account's first sync
+HISTORY_SYNC_INTERVAL = int(os.getenv('HISTORY_SYNC_INTERVAL', '3600'))  # seconds between incremental history syncs
+TRENDBAR_MAX_BARS     = int(os.getenv('TRENDBAR_MAX_BARS', '5000'))      # bars cTrader returns per request at most
+TRENDBAR_CONCURRENCY  = int(os.getenv('TRENDBAR_CONCURRENCY', '5'))      # trendbar chunk requests in flight at once
+RECONCILE_INTERVAL    = int(os.getenv('RECONCILE_INTERVAL', '300'))      # seconds between position/order drift checks
+RATE_LIMIT_GENERAL    = int(os.getenv('RATE_LIMIT_GENERAL', '45'))       # upstream requests per second, all lanes
+RATE_LIMIT_HISTORICAL = int(os.getenv('RATE_LIMIT_HISTORICAL', '4'))     # trendbar / tick data requests per second
+SCHEDULER_QUEUE_LIMIT = int(os.getenv('SCHEDULER_QUEUE_LIMIT', '100'))   # queued requests per lane before answering 429
+UPSTREAM_SESSIONS     = int(os.getenv('UPSTREAM_SESSIONS', '1'))         # cTrader connections for trading/account traffic
+UPSTREAM_HISTORICAL_SESSIONS = int(os.getenv('UPSTREAM_HISTORICAL_SESSIONS', '0'))  # extra connections only for trendbar/tick data; 0 shares the above
+SESSION_HOLD_LIMIT    = int(os.getenv('SESSION_HOLD_LIMIT', '200'))      # requests held per session while it reconnects
+SESSION_HOLD_TIMEOUT  = int(os.getenv('SESSION_HOLD_TIMEOUT', '10'))     # seconds a held request waits before answering 503
+REQUEST_TIMEOUT       = float(os.getenv('REQUEST_TIMEOUT', '10'))        # seconds an upstream request may take before answering 504
+HISTORICAL_REQUEST_TIMEOUT = float(os.getenv('HISTORICAL_REQUEST_TIMEOUT', '30'))  # the same for trendbar / tick data requests
+REQUEST_TIMEOUTS      = {name.strip(): float(seconds) for name, seconds in (item.split('=') for item in os.getenv('REQUEST_TIMEOUTS', '').split(',') if item.strip())}  # per-command overrides, e.g. ProtoOANewOrderReq=5
+REQUEST_TIMEOUT_MAX   = float(os.getenv('REQUEST_TIMEOUT_MAX', '120'))   # upper bound for the X-Request-Timeout header
+BREAKER_FAILURE_RATE  = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))  # share of failed / timed-out requests that opens a session's circuit
+BREAKER_MIN_REQUESTS  = int(os.getenv('BREAKER_MIN_REQUESTS', '10'))     # requests in the window before the failure rate counts
+BREAKER_WINDOW        = int(os.getenv('BREAKER_WINDOW', '30'))           # seconds of request outcomes the failure rate covers
+BREAKER_COOLDOWN      = int(os.getenv('BREAKER_COOLDOWN', '15'))         # seconds an open circuit fails fast before letting a probe through
+CAPTURE_RING_BYTES    = int(os.getenv('CAPTURE_RING_BYTES', '0'))        # bytes of raw upstream traffic kept in memory for GET /api/capture; 0 disables
+CAPTURE_HTTP          = os.getenv('CAPTURE_HTTP', '') == '1'             # serve the ring on GET /api/capture, to loopback clients only
+CAPTURE_PATH          = os.getenv('CAPTURE_PATH', '')                    # also append all upstream traffic to this rotating file; empty disables
+CAPTURE_FILE_BYTES    = int(os.getenv('CAPTURE_FILE_BYTES', str(64 * 1024 * 1024)))  # size at which the capture file is rotated
+CAPTURE_BACKUPS       = int(os.getenv('CAPTURE_BACKUPS', '3'))           # rotated capture files kept
+TOKEN_REFRESH_MARGIN  = int(os.getenv('TOKEN_REFRESH_MARGIN', '86400'))  # refresh the access token this many seconds before it expires
+HTTP_WORKERS          = int(os.getenv('HTTP_WORKERS', '0'))              # HTTP processes sharing the port in front of one upstream broker; 0 serves HTTP in this process
+BROKER_SOCKET         = os.getenv('BROKER_SOCKET', 'data/broker.sock')   # Unix socket between the broker and its HTTP workers
+PROXY_WORKER          = os.getenv('PROXY_WORKER', '')                    # set by the broker in the HTTP workers it starts; not for .env
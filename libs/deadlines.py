@@ -0,0 +1,78 @@
+import contextvars
+import json
+
+from twisted.web.server import Request
+
+from libs.scheduler import laneFor, LANE_HISTORICAL
+
+DEADLINE_HEADER = b"x-request-timeout"
+
+# Seconds from the X-Request-Timeout header of the HTTP request being rendered, if any
+requestTimeout = contextvars.ContextVar("requestTimeout", default=None)
+
+
+def carryDeadline(fn):
+    """Wrap fn to run with the requestTimeout in effect now, for callbacks that send upstream requests later.
+
+    The variable is only set while DeadlineRequest.process() runs, so requests sent
+    from a Deferred callback — after a semaphore, a symbol lookup or a previous page —
+    would otherwise fall back to the configured timeouts.
+    """
+    timeout = requestTimeout.get()
+
+    def run(*args, **kwargs):
+        token = requestTimeout.set(timeout)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            requestTimeout.reset(token)
+    return run
+
+
+class Deadlines:
+    """How long an upstream request may take: a default, a longer one for historical
+    data, per-command overrides, and the caller's X-Request-Timeout header above all.
+    """
+
+    def __init__(self, default, historical, overrides, maximum):
+        self.default = default
+        self.historical = historical
+        self.overrides = overrides
+        self.maximum = maximum
+
+    def forRequest(self, request):
+        """Seconds to wait for the answer to a protobuf request message."""
+        override = requestTimeout.get()
+        if override is not None:
+            return min(override, self.maximum)
+        name = type(request).__name__
+        if name in self.overrides:
+            return self.overrides[name]
+        return self.historical if laneFor(request) == LANE_HISTORICAL else self.default
+
+
+class DeadlineRequest(Request):
+    """Site request that applies its X-Request-Timeout header to the upstream requests its route sends.
+
+    Routes run synchronously inside process(), so every sendProtoOA* call they make
+    sees the header through the requestTimeout context variable; callbacks that send
+    later are wrapped with carryDeadline().
+    """
+
+    def process(self):
+        value = self.getHeader(DEADLINE_HEADER)
+        try:
+            timeout = float(value) if value is not None else None
+            if timeout is not None and not timeout > 0:
+                raise ValueError(value)
+        except ValueError:
+            self.setResponseCode(400)
+            self.setHeader(b"content-type", b"application/json")
+            self.write(json.dumps({"error": "X-Request-Timeout must be a positive number of seconds"}).encode("utf-8"))
+            self.finish()
+            return
+        token = requestTimeout.set(timeout)
+        try:
+            super().process()
+        finally:
+            requestTimeout.reset(token)
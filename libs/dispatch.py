@@ -0,0 +1,58 @@
+from twisted.python.failure import Failure
+
+
+class Dispatcher:
+    """Routes upstream messages to the handlers registered for their payloadType.
+
+    Handlers are registered per message class and called as
+    handler(session, payload, message). payload is the decoded message, parsed at
+    most once per message and shared by every handler of its type; handlers
+    registered with decode=False get None and cost no parsing. Types registered
+    with ignore() are dropped, and every other unregistered type goes to the
+    otherwise() handlers.
+
+    A handler that raises is reported to onError and does not stop the others.
+    """
+
+    def __init__(self, onError=None):
+        self.onError = onError
+        self.table = {}  # payloadType → (message class, [(handler, decode)])
+        self.fallback = []
+
+    def on(self, messageClass, handler=None, decode=True):
+        """Register handler for messageClass; without a handler, returns a decorator."""
+        if handler is None:
+            return lambda fn: self.on(messageClass, fn, decode)
+        self.table.setdefault(messageClass().payloadType, (messageClass, []))[1].append((handler, decode))
+        return handler
+
+    def ignore(self, messageClass):
+        """Drop messageClass without calling any handler."""
+        self.table.setdefault(messageClass().payloadType, (messageClass, []))
+
+    def otherwise(self, handler):
+        """Register handler(session, None, message) for message types nothing else handles."""
+        self.fallback.append(handler)
+        return handler
+
+    def dispatch(self, session, message):
+        entry = self.table.get(message.payloadType)
+        if entry is None:
+            for handler in self.fallback:
+                self._call(handler, session, None, message)
+            return
+        messageClass, handlers = entry
+        payload = None
+        for handler, decode in handlers:
+            if decode and payload is None:
+                payload = messageClass.FromString(message.payload)
+            self._call(handler, session, payload, message)
+
+    def _call(self, handler, session, payload, message):
+        try:
+            handler(session, payload, message)
+        except Exception:
+            if self.onError is None:
+                raise
+            self.onError(Failure())
+
@@ -0,0 +1,113 @@
+import math
+
+from twisted.internet import defer
+
+
+class ProxyError(Exception):
+    """An error raised by the proxy itself, mapped to an HTTP status instead of being swallowed by onError."""
+    status = 500
+
+    def headers(self):
+        return {}
+
+
+class RateLimited(ProxyError):
+    """A scheduler lane's queue is full; the caller should retry after retryAfter seconds."""
+    status = 429
+
+    def __init__(self, lane, retryAfter):
+        super().__init__(f"Too many queued {lane} requests — retry after {retryAfter:.1f}s")
+        self.lane = lane
+        self.retryAfter = retryAfter
+
+    def headers(self):
+        return {"Retry-After": str(max(1, math.ceil(self.retryAfter)))}
+
+
+class SessionUnavailable(ProxyError):
+    """A request was held while its upstream session reconnected and the session did not recover in time."""
+    status = 503
+
+    def __init__(self, session, reason):
+        super().__init__(f"Upstream session {session} unavailable — {reason}")
+        self.session = session
+
+    def headers(self):
+        return {"Retry-After": "1"}
+
+
+class DeadlineExceeded(ProxyError):
+    """An upstream request got no answer within its deadline and was cancelled."""
+    status = 504
+
+    def __init__(self, command, timeout):
+        super().__init__(f"{command} got no answer from cTrader within {timeout:g}s")
+        self.command = command
+        self.timeout = timeout
+
+
+class CircuitOpen(ProxyError):
+    """Too many recent requests on an upstream session failed or timed out; requests fail fast until it cools down."""
+    status = 503
+
+    def __init__(self, session, retryAfter):
+        super().__init__(f"Upstream session {session} is failing — retry after {retryAfter:.1f}s")
+        self.session = session
+        self.retryAfter = retryAfter
+
+    def headers(self):
+        return {"Retry-After": str(max(1, math.ceil(self.retryAfter)))}
+
+
+class AccountNotAuthorized(ProxyError):
+    """A request named an account that is not authorized on the upstream session."""
+    status = 403
+
+    def __init__(self, accountId):
+        super().__init__(f"Account {accountId} is not authorized — add it to CTRADER_ACCOUNTID or call /api/set-account")
+        self.accountId = accountId
+
+
+class AccountRequired(ProxyError):
+    """A request named no account and no default account is set."""
+    status = 400
+
+    def __init__(self):
+        super().__init__("accountId required — pass accountId or set a default with CTRADER_ACCOUNTID or /api/set-account")
+
+
+class InvalidOrder(ProxyError):
+    """An order or amendment breaks the symbol's specification and was rejected without going upstream."""
+    status = 400
+
+    def __init__(self, symbolId, reason):
+        super().__init__(f"Symbol {symbolId}: {reason}")
+        self.symbolId = symbolId
+        self.reason = reason
+
+
+class NotAcceptable(ProxyError):
+    """The Accept header only names a response format this install cannot produce."""
+    status = 406
+
+    def __init__(self, contentType, hint):
+        super().__init__(f"{contentType} is not available — {hint}")
+        self.contentType = contentType
+
+
+class BrokerError(ProxyError):
+    """A worker's request failed in the broker process, or the broker could not be reached."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def headers(self):
+        return {"Retry-After": "1"} if self.status in (429, 503) else {}
+
+
+def unwrapFirstError(failure):
+    """Return the original failure from inside (possibly nested) gatherResults FirstErrors."""
+    while failure.check(defer.FirstError):
+        failure = failure.value.subFailure
+    return failure
@@ -0,0 +1,133 @@
+import time
+
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAReconcileRes
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import (
+    ProtoOAPositionStatus, ProtoOAOrderStatus, ProtoOAOrderType, ProtoOATradeSide,
+)
+
+from libs.serializer import toDict
+
+# Order types that rest in the pending orders list, as ProtoOAReconcileRes reports it.
+PENDING_ORDER_TYPES = frozenset((ProtoOAOrderType.LIMIT, ProtoOAOrderType.STOP, ProtoOAOrderType.STOP_LIMIT))
+
+
+class AccountState:
+    """Open positions and pending orders of one account, with their JSON forms cached."""
+
+    def __init__(self):
+        self.positions = {}
+        self.orders = {}
+        self.json = {}
+        self.seededAt = None
+        self.events = 0
+
+
+class ExecutionState:
+    """Positions/orders table seeded from ProtoOAReconcileRes and kept current from ProtoOAExecutionEvent."""
+
+    def __init__(self):
+        self.accounts = {}
+        self.drifts = 0
+
+    def isSeeded(self, accountId):
+        state = self.accounts.get(accountId)
+        return state is not None and state.seededAt is not None
+
+    def seed(self, pb):
+        """Replace an account's state with the contents of a ProtoOAReconcileRes."""
+        state = AccountState()
+        state.seededAt = time.time()
+        for position in pb.position:
+            self._putPosition(state, position)
+        for order in pb.order:
+            self._putOrder(state, order)
+        self.accounts[pb.ctidTraderAccountId] = state
+
+    def onExecution(self, pb):
+        """Apply one ProtoOAExecutionEvent to the account it belongs to."""
+        state = self.accounts.get(pb.ctidTraderAccountId)
+        if state is None or state.seededAt is None:
+            return
+        state.events += 1
+        if pb.HasField("position"):
+            if pb.position.positionStatus == ProtoOAPositionStatus.POSITION_STATUS_OPEN:
+                self._putPosition(state, pb.position)
+            else:
+                self._drop(state, state.positions, ("position", pb.position.positionId))
+        if pb.HasField("order"):
+            if pb.order.orderType not in PENDING_ORDER_TYPES:
+                pass  # market orders fill into positions and protection orders live on the position
+            elif pb.order.orderStatus == ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED:
+                self._putOrder(state, pb.order)
+            else:
+                self._drop(state, state.orders, ("order", pb.order.orderId))
+
+    def _putPosition(self, state, position):
+        key = ("position", position.positionId)
+        state.positions[key] = position
+        state.json[key] = toDict(position)
+
+    def _putOrder(self, state, order):
+        key = ("order", order.orderId)
+        state.orders[key] = order
+        state.json[key] = toDict(order)
+
+    def _drop(self, state, table, key):
+        table.pop(key, None)
+        state.json.pop(key, None)
+
+    def query(self, accountId, kind, symbolId=None, tradeSide=None):
+        """Return the cached JSON objects of positions or orders, optionally filtered by symbol and side."""
+        state = self.accounts[accountId]
+        table = state.positions if kind == "position" else state.orders
+        side = ProtoOATradeSide.Value(tradeSide.upper()) if tradeSide else None
+        return [
+            state.json[key] for key, item in table.items()
+            if (symbolId is None or item.tradeData.symbolId == symbolId)
+            and (side is None or item.tradeData.tradeSide == side)
+        ]
+
+    def find(self, accountId, kind, itemId):
+        """Return one cached position or order, or None if the account is not seeded or does not hold it."""
+        state = self.accounts.get(accountId)
+        if state is None or state.seededAt is None:
+            return None
+        table = state.positions if kind == "position" else state.orders
+        return table.get((kind, int(itemId)))
+
+    def snapshot(self, accountId):
+        """Rebuild a ProtoOAReconcileRes ProtoMessage from the local state."""
+        state = self.accounts[accountId]
+        res = ProtoOAReconcileRes(ctidTraderAccountId=accountId)
+        res.position.extend(state.positions.values())
+        res.order.extend(state.orders.values())
+        return ProtoMessage(payloadType=res.payloadType, payload=res.SerializeToString())
+
+    def diff(self, pb):
+        """Compare local state with a fresh ProtoOAReconcileRes, reseed from it, and return the differences."""
+        state = self.accounts.get(pb.ctidTraderAccountId)
+        local = {}
+        if state is not None:
+            local.update({key: p.tradeData.volume for key, p in state.positions.items()})
+            local.update({key: o.tradeData.volume for key, o in state.orders.items()})
+        remote = {("position", p.positionId): p.tradeData.volume for p in pb.position}
+        remote.update({("order", o.orderId): o.tradeData.volume for o in pb.order})
+        drift = {
+            "missing": sorted(f"{kind}:{id}" for kind, id in remote.keys() - local.keys()),
+            "stale": sorted(f"{kind}:{id}" for kind, id in local.keys() - remote.keys()),
+            "volume": sorted(f"{kind}:{id}" for kind, id in local.keys() & remote.keys() if local[(kind, id)] != remote[(kind, id)]),
+        }
+        if any(drift.values()):
+            self.drifts += 1
+        self.seed(pb)
+        return drift
+
+    def stats(self):
+        return {
+            "accounts": {
+                str(accountId): {"positions": len(state.positions), "orders": len(state.orders), "events": state.events}
+                for accountId, state in self.accounts.items()
+            },
+            "drifts": self.drifts,
+        }
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import time
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOADealListRes, ProtoOAOrderListRes
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOADeal, ProtoOAOrder
+from twisted.internet import defer
+
+WINDOW_MS = 7 * 24 * 3600 * 1000  # widest from/to window cTrader accepts for deal and order lists
+OVERLAP_MS = 3600 * 1000  # each sync re-reads the last hour, as recent deals and orders may still change
+BUSY_TIMEOUT = 5  # seconds to wait for another process's write to the same file
+
+DEALS = "deals"
+ORDERS = "orders"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deals (
+    accountId INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    positionId INTEGER NOT NULL,
+    symbolId INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (accountId, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS deals_time ON deals (accountId, ts);
+CREATE INDEX IF NOT EXISTS deals_position ON deals (accountId, positionId, ts);
+CREATE INDEX IF NOT EXISTS deals_symbol ON deals (accountId, symbolId, ts);
+CREATE TABLE IF NOT EXISTS orders (
+    accountId INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    positionId INTEGER NOT NULL,
+    symbolId INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (accountId, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS orders_time ON orders (accountId, ts);
+CREATE INDEX IF NOT EXISTS orders_position ON orders (accountId, positionId, ts);
+CREATE INDEX IF NOT EXISTS orders_symbol ON orders (accountId, symbolId, ts);
+CREATE TABLE IF NOT EXISTS synced (
+    accountId INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    toTs INTEGER NOT NULL,
+    PRIMARY KEY (accountId, kind)
+) WITHOUT ROWID;
+"""
+
+
+def _dealRow(deal):
+    return deal.dealId, deal.positionId, deal.symbolId, deal.executionTimestamp
+
+
+def _orderRow(order):
+    return order.orderId, order.positionId, order.tradeData.symbolId, order.utcLastUpdateTimestamp or order.tradeData.openTimestamp
+
+
+# kind → (model class, list response class, repeated field of the response, (id, positionId, symbolId, ts) of an item)
+KINDS = {
+    DEALS: (ProtoOADeal, ProtoOADealListRes, "deal", _dealRow),
+    ORDERS: (ProtoOAOrder, ProtoOAOrderListRes, "order", _orderRow),
+}
+
+
+class HistoryStore:
+    """On-disk deal and order history per account, synced incrementally from cTrader.
+
+    Each kind keeps a watermark: everything up to it has been downloaded. sync()
+    walks from the watermark to now in windows cTrader accepts, and execution
+    events top the store up in between. Deals are timed by executionTimestamp,
+    orders by utcLastUpdateTimestamp; timestamps are in milliseconds.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")  # HTTP workers read while the broker writes
+        self.db.executescript(SCHEMA)
+        self.syncs = 0
+        self.pages = 0
+        self.queries = 0
+
+    def save(self, accountId, kind, items):
+        """Insert or update deals or orders (ProtoOADeal / ProtoOAOrder); returns how many were not stored before."""
+        row = KINDS[kind][3]
+        rows = [(int(accountId), *row(item), item.SerializeToString()) for item in items]
+        with self.db:
+            inserted = self.db.executemany(f"INSERT OR IGNORE INTO {kind} VALUES (?, ?, ?, ?, ?, ?)", rows).rowcount
+            self.db.executemany(
+                f"UPDATE {kind} SET positionId = ?, symbolId = ?, ts = ?, data = ? WHERE accountId = ? AND id = ? AND data != ?",
+                [(positionId, symbolId, ts, data, accountId, id, data) for accountId, id, positionId, symbolId, ts, data in rows],
+            )
+        return inserted
+
+    def syncedTo(self, accountId, kind):
+        row = self.db.execute("SELECT toTs FROM synced WHERE accountId = ? AND kind = ?", (int(accountId), kind)).fetchone()
+        return row[0] if row else None
+
+    def _markSynced(self, accountId, kind, toTs):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO synced VALUES (?, ?, ?)", (int(accountId), kind, toTs))
+
+    def sync(self, accountId, kind, loader, since):
+        """Download everything after the watermark (or since, on the first sync) up to now.
+
+        loader(fromTs, toTs) must return a Deferred firing with a ProtoMessage, like
+        sendProtoOADealListReq. Windows are requested one after another; a window
+        whose response has hasMore set is split in half and requested again. Fires
+        with the number of new items stored (not those re-read from overlapping or
+        split windows), or with the first upstream error unchanged.
+        """
+        _, responseClass, field, _ = KINDS[kind]
+        watermark = self.syncedTo(accountId, kind)
+        fromTs = max(int(since), watermark - OVERLAP_MS) if watermark is not None else int(since)
+        now = int(time.time() * 1000)
+        windows = [(start, min(start + WINDOW_MS - 1, now)) for start in range(fromTs, now + 1, WINDOW_MS)]
+        windows.reverse()  # a stack: the oldest window is requested first
+        stored = [0]
+        self.syncs += 1
+
+        def nextWindow(_=None):
+            if not windows:
+                return stored[0]
+            start, end = windows[-1]
+            page = loader(start, end)
+            page.addCallback(onPage, start, end)
+            return page
+
+        def onPage(msg, start, end):
+            if msg is None or msg.payloadType != responseClass().payloadType:
+                return msg
+            self.pages += 1
+            pb = Protobuf.extract(msg)
+            items = getattr(pb, field)
+            stored[0] += self.save(accountId, kind, items)
+            windows.pop()
+            if pb.hasMore and end > start:
+                middle = (start + end) // 2
+                windows.extend([(middle + 1, end), (start, middle)])
+            else:
+                self._markSynced(accountId, kind, end)
+            return nextWindow()
+
+        return defer.maybeDeferred(nextWindow)
+
+    def query(self, accountId, kind, fromTs=None, toTs=None, positionId=None, symbolId=None, limit=None):
+        """Stored items of one account, oldest first, as a ProtoMessage wrapping a deal or order list response.
+
+        hasMore is set when limit cut the result short.
+        """
+        modelClass, responseClass, field, _ = KINDS[kind]
+        where, args = ["accountId = ?"], [int(accountId)]
+        for clause, value in (("ts >= ?", fromTs), ("ts <= ?", toTs), ("positionId = ?", positionId), ("symbolId = ?", symbolId)):
+            if value not in (None, ""):
+                where.append(clause)
+                args.append(int(value))
+        sql = f"SELECT data FROM {kind} WHERE {' AND '.join(where)} ORDER BY ts, id"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit) + 1)
+        rows = self.db.execute(sql, args).fetchall()
+        self.queries += 1
+        hasMore = bool(limit) and len(rows) > int(limit)
+        if hasMore:
+            rows = rows[:int(limit)]
+        res = responseClass(ctidTraderAccountId=int(accountId), hasMore=hasMore)
+        getattr(res, field).extend(modelClass.FromString(data) for data, in rows)
+        return ProtoMessage(payloadType=res.payloadType, payload=res.SerializeToString())
+
+    def stats(self):
+        counts = {kind: self.db.execute(f"SELECT COUNT(*) FROM {kind}").fetchone()[0] for kind in KINDS}
+        return {**counts, "syncs": self.syncs, "pages": self.pages, "queries": self.queries}
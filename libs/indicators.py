@@ -0,0 +1,178 @@
+import re
+
+import numpy as np
+
+from libs.trendbars import PERIOD_MINUTES
+
+MONDAY_MINUTES = 4 * 1440  # 1970-01-05 00:00 UTC, the first Monday after the epoch; weekly buckets start there
+
+# Periods cTrader serves directly, largest first; MN1 has no fixed length and is never resampled
+NATIVE_PERIODS = sorted((name for name in PERIOD_MINUTES if name != "MN1"), key=PERIOD_MINUTES.get, reverse=True)
+
+UNIT_MINUTES = {"M": 1, "H": 60, "D": 1440, "W": 10080}
+
+INDICATORS = ("sma", "ema", "atr", "rsi", "vwap")
+
+# block-wise smoothing lets a running sum grow by at most exp() of this before rescaling
+_MAX_EXPONENT = 200
+
+
+def parsePeriod(period):
+    """Parse "M7", "H2", "D3", "W2" (or any cTrader period) into (minutes, source period to request).
+
+    The source is the largest cTrader period the target is a whole multiple of.
+    """
+    if period == "MN1":
+        return PERIOD_MINUTES[period], period
+    match = re.fullmatch(r"([MHDW])(\d+)", period)
+    if not match or int(match.group(2)) < 1:
+        raise ValueError(f"invalid period {period!r}")
+    minutes = UNIT_MINUTES[match.group(1)] * int(match.group(2))
+    source = next(name for name in NATIVE_PERIODS if minutes % PERIOD_MINUTES[name] == 0)
+    return minutes, source
+
+
+def parseIndicators(specs):
+    """Parse ["sma:20", "rsi:14", "vwap", ...] into [(spec, name, length or None)]; spec names the output series."""
+    parsed = []
+    for spec in map(str, specs):
+        name, _, length = spec.lower().partition(":")
+        if name not in INDICATORS:
+            raise ValueError(f"unknown indicator {spec!r}")
+        if name == "vwap":
+            if length:
+                raise ValueError("vwap takes no length")
+            parsed.append((spec, name, None))
+            continue
+        if not length.isdigit() or int(length) < 1:
+            raise ValueError(f"{spec!r} needs a length, e.g. {name}:14")
+        parsed.append((spec, name, int(length)))
+    return parsed
+
+
+def warmupBars(indicators):
+    """Bars to load before the requested window so every indicator has settled by its start."""
+    # smoothed series remember their seed; after five lengths even Wilder's weight on it is under 1%
+    return max([5 * length for _, _, length in indicators if length] + [0])
+
+
+def resample(columns, minutes):
+    """Aggregate timestamp-ordered OHLCV columns into buckets of `minutes`.
+
+    Buckets are aligned to the epoch (to Mondays for whole weeks), and a bucket is
+    stamped with its start. Empty buckets are skipped, like missing trendbars.
+    """
+    timestamps = columns["timestamp"]
+    if len(timestamps) == 0:
+        return dict(columns)
+    size = minutes * 60000
+    origin = MONDAY_MINUTES * 60000 if minutes % UNIT_MINUTES["W"] == 0 else 0
+    bucket = (timestamps - origin) // size
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.concatenate((starts[1:], [len(bucket)])) - 1
+    return {
+        "timestamp": bucket[starts] * size + origin,
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends],
+        "volume": np.add.reduceat(columns["volume"], starts),
+    }
+
+
+def sma(values, length):
+    out = np.full(len(values), np.nan)
+    if len(values) >= length:
+        sums = np.cumsum(np.concatenate(([0.0], values)))
+        out[length - 1:] = (sums[length:] - sums[:-length]) / length
+    return out
+
+
+def smooth(values, alpha, length):
+    """Exponential smoothing seeded with the mean of the first `length` values; NaN before that.
+
+    y[i] = (1 - alpha) * y[i - 1] + alpha * x[i] is evaluated in closed form over
+    blocks short enough that (1 - alpha) ** -block cannot overflow, so the work is
+    whole-array operations with one Python step per block.
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) < length:
+        return out
+    out[length - 1] = previous = values[:length].mean()
+    rest = values[length:]
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[length:] = rest
+        return out
+    block = max(1, int(_MAX_EXPONENT / -np.log(decay))) if decay < 1.0 else len(rest)
+    for start in range(0, len(rest), block):
+        chunk = rest[start:start + block]
+        # with p[i] = decay^(i+1): y[i] = p[i] * y0 + alpha * p[i] * sum(x[k] / p[k] for k <= i)
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        smoothed = powers * (previous + alpha * np.cumsum(chunk / powers))
+        out[length + start:length + start + len(chunk)] = smoothed
+        previous = smoothed[-1]
+    return out
+
+
+def ema(values, length):
+    return smooth(values, 2.0 / (length + 1), length)
+
+
+def atr(high, low, close, length):
+    """Average true range with Wilder's smoothing."""
+    previousClose = np.concatenate(([close[0]], close[:-1])) if len(close) else close
+    trueRange = np.maximum(high, previousClose) - np.minimum(low, previousClose)
+    return smooth(trueRange, 1.0 / length, length)
+
+
+def rsi(close, length):
+    """Relative strength index with Wilder's smoothing; NaN until `length` changes are known."""
+    out = np.full(len(close), np.nan)
+    if len(close) <= length:
+        return out
+    change = np.diff(close)
+    gain = smooth(np.clip(change, 0, None), 1.0 / length, length)
+    loss = smooth(np.clip(-change, 0, None), 1.0 / length, length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[1:] = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+    out[1:][np.isnan(gain)] = np.nan
+    return out
+
+
+def vwap(columns):
+    """Volume-weighted average of the typical price, restarting at each UTC day."""
+    typical = (columns["high"] + columns["low"] + columns["close"]) / 3
+    volume = columns["volume"].astype(np.float64)
+    day = columns["timestamp"] // 86400000
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(day)) + 1)) if len(day) else np.array([], dtype=np.int64)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [len(day)]))))
+
+    def dailyCumsum(values):
+        sums = np.cumsum(values)
+        offsets = np.concatenate(([0.0], sums))[starts]
+        return sums - offsets[group]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return dailyCumsum(typical * volume) / dailyCumsum(volume)
+
+
+def compute(columns, indicators, digits):
+    """Evaluate parsed indicators over OHLCV columns; returns {spec: float64 array} aligned with the bars.
+
+    Price-scale series are rounded to two digits past the symbol's, RSI to two decimals.
+    """
+    results = {}
+    for spec, name, length in indicators:
+        if name == "sma":
+            series = sma(columns["close"], length)
+        elif name == "ema":
+            series = ema(columns["close"], length)
+        elif name == "atr":
+            series = atr(columns["high"], columns["low"], columns["close"], length)
+        elif name == "rsi":
+            series = rsi(columns["close"], length)
+        else:
+            series = vwap(columns)
+        results[spec] = np.round(series, 2 if name == "rsi" else digits + 2)
+    return results
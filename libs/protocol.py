@@ -0,0 +1,36 @@
+from collections import deque
+
+from ctrader_open_api import TcpProtocol
+
+from libs.capture import INBOUND, OUTBOUND
+
+
+class ProxyTcpProtocol(TcpProtocol):
+    """TcpProtocol that writes each message as soon as it is sent.
+
+    The stock protocol batches writes on a one-second timer at a fixed
+    messages-per-second rate; pacing is done by libs.scheduler instead, so here
+    that timer is only left to send heartbeats.
+
+    When capture is set, every frame sent and received is recorded as raw bytes.
+    """
+    capture = None  # libs.capture.Capture, set by main when capturing is enabled
+
+    def connectionMade(self):
+        self._send_queue = deque()  # the base class shares one queue across all instances
+        super().connectionMade()
+
+    def send(self, message, instant=False, clientMsgId=None, isCanceled=None):
+        if isCanceled is not None and isCanceled():
+            return
+        super().send(message, True, clientMsgId)
+
+    def sendString(self, data):
+        if self.capture is not None:
+            self.capture.record(OUTBOUND, self.factory.client, data)
+        super().sendString(data)
+
+    def stringReceived(self, data):
+        if self.capture is not None:
+            self.capture.record(INBOUND, self.factory.client, data)
+        return super().stringReceived(data)
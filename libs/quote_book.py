@@ -0,0 +1,95 @@
+import json
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAErrorRes
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+PRICE_SCALE = 100000  # spot prices arrive as integers in 1/100000 units
+
+
+class QuoteBook:
+    """Reference-counted spot subscriptions and the last bid/ask per symbol.
+
+    subscribe(accountId, symbolId) and unsubscribe(accountId, symbolId) must return
+    Deferreds firing with the upstream ProtoMessage. One upstream subscription is
+    held per (accountId, symbolId) for as long as at least one consumer holds it.
+    """
+
+    def __init__(self, subscribe, unsubscribe):
+        self.subscribe = subscribe
+        self.unsubscribe = unsubscribe
+        self.refCounts = {}
+        self.quotes = {}
+        self.listeners = {}
+        self.events = 0
+
+    def acquire(self, accountId, symbolId):
+        """Take one reference on a symbol, subscribing upstream on the first one."""
+        key = (accountId, int(symbolId))
+        self.refCounts[key] = self.refCounts.get(key, 0) + 1
+        if self.refCounts[key] > 1:
+            return defer.succeed(None)
+        deferred = self.subscribe(*key)
+        deferred.addBoth(self._onSubscribed, key)
+        return deferred
+
+    def _onSubscribed(self, result, key):
+        if result is None or isinstance(result, Failure) or (result.payloadType == ProtoOAErrorRes().payloadType
+                              and Protobuf.extract(result).errorCode != "ALREADY_SUBSCRIBED"):
+            self.refCounts.pop(key, None)
+        return result
+
+    def release(self, accountId, symbolId):
+        """Drop one reference, unsubscribing upstream and forgetting the quote on the last one."""
+        key = (accountId, int(symbolId))
+        count = self.refCounts.get(key, 0) - 1
+        if count > 0:
+            self.refCounts[key] = count
+            return defer.succeed(None)
+        if key not in self.refCounts:
+            return defer.succeed(None)
+        del self.refCounts[key]
+        self.quotes.pop(key, None)
+        return self.unsubscribe(*key)
+
+    def subscribed(self):
+        """Return the (accountId, symbolId) pairs currently subscribed upstream."""
+        return list(self.refCounts)
+
+    def onSpot(self, pb):
+        """Apply one ProtoOASpotEvent. cTrader only sends the side that changed."""
+        self.events += 1
+        key = (pb.ctidTraderAccountId, pb.symbolId)
+        quote = self.quotes.get(key)
+        if quote is None:
+            quote = self.quotes[key] = {"symbolId": pb.symbolId, "bid": None, "ask": None, "timestamp": None}
+        if pb.HasField("bid"):
+            quote["bid"] = pb.bid / PRICE_SCALE
+        if pb.HasField("ask"):
+            quote["ask"] = pb.ask / PRICE_SCALE
+        if pb.HasField("timestamp"):
+            quote["timestamp"] = pb.timestamp
+        listeners = self.listeners.get(key)
+        if listeners:
+            body = json.dumps(quote).encode("utf-8")
+            for listener in list(listeners):
+                listener(body)
+
+    def get(self, accountId, symbolId):
+        return self.quotes.get((accountId, int(symbolId)))
+
+    def listen(self, accountId, symbolId, listener):
+        self.listeners.setdefault((accountId, int(symbolId)), set()).add(listener)
+
+    def unlisten(self, accountId, symbolId, listener):
+        key = (accountId, int(symbolId))
+        listeners = self.listeners.get(key)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self.listeners[key]
+
+    def stats(self):
+        return {"subscriptions": len(self.refCounts), "streams": sum(len(l) for l in self.listeners.values()),
+                "spotEvents": self.events}
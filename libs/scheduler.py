@@ -0,0 +1,126 @@
+import contextvars
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor
+
+from libs.errors import RateLimited
+
+LANE_TRADING = "trading"
+LANE_ACCOUNT = "account"
+LANE_HISTORICAL = "historical"
+
+# Strict priority: a lane is only served while every lane before it is empty
+LANES = (LANE_TRADING, LANE_ACCOUNT, LANE_HISTORICAL)
+
+TRADING_REQUESTS = {
+    "ProtoOANewOrderReq", "ProtoOAClosePositionReq", "ProtoOACancelOrderReq",
+    "ProtoOAAmendOrderReq", "ProtoOAAmendPositionSLTPReq",
+}
+HISTORICAL_REQUESTS = {"ProtoOAGetTrendbarsReq", "ProtoOAGetTickDataReq"}
+
+
+def laneFor(request):
+    """Return the scheduler lane for a protobuf request message."""
+    name = type(request).__name__
+    if name in TRADING_REQUESTS:
+        return LANE_TRADING
+    if name in HISTORICAL_REQUESTS:
+        return LANE_HISTORICAL
+    return LANE_ACCOUNT
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait(self):
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Scheduler:
+    """Token-bucket scheduler in front of the upstream connection.
+
+    Every request draws from the general bucket; historical requests also draw from
+    the historical bucket. Lanes are served in strict priority order, so trading
+    requests never wait behind account or historical traffic. Each lane's queue is
+    bounded; when it is full, submit() fails fast with RateLimited instead of
+    letting cTrader throttle the session. A request is sent in the context it was
+    submitted from, so it sees the caller's X-Request-Timeout however long it queued.
+    """
+
+    def __init__(self, send, generalRate, historicalRate, queueLimit, clock=reactor):
+        self.send = send
+        self.clock = clock
+        self.general = TokenBucket(generalRate, max(1, generalRate // 5))
+        self.historical = TokenBucket(historicalRate, 1)
+        self.queueLimit = queueLimit
+        self.queues = {lane: deque() for lane in LANES}
+        self.sent = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self._timer = None
+
+    def submit(self, request, clientMsgId=None):
+        """Queue a request on its lane; returns a Deferred firing with the upstream response.
+
+        Cancelling the Deferred drops the request if it is still queued, or cancels the upstream call.
+        """
+        lane = laneFor(request)
+        queue = self.queues[lane]
+        if len(queue) >= self.queueLimit:
+            self.rejected[lane] += 1
+            rate = self.historical.rate if lane == LANE_HISTORICAL else self.general.rate
+            return defer.fail(RateLimited(lane, (len(queue) + 1) / rate))
+        upstream = []  # the upstream call's Deferred once sent, so cancelling reaches it
+        deferred = defer.Deferred(lambda _: upstream and upstream[0].cancel())
+        queue.append((request, clientMsgId, deferred, upstream, contextvars.copy_context()))
+        self._pump()
+        return deferred
+
+    def _pump(self):
+        while True:
+            lane = next((lane for lane in LANES if self.queues[lane]), None)
+            if lane is None:
+                return
+            if self.queues[lane][0][2].called:
+                self.queues[lane].popleft()  # cancelled while queued
+                continue
+            buckets = (self.general, self.historical) if lane == LANE_HISTORICAL else (self.general,)
+            if not all(bucket.ready() for bucket in buckets):
+                self._wake(max(bucket.wait() for bucket in buckets))
+                return
+            for bucket in buckets:
+                bucket.take()
+            request, clientMsgId, deferred, upstream, context = self.queues[lane].popleft()
+            self.sent[lane] += 1
+            upstream.append(context.run(self.send, request, clientMsgId))
+            upstream[0].chainDeferred(deferred)
+
+    def _wake(self, delay):
+        if self._timer is None or not self._timer.active():
+            self._timer = self.clock.callLater(delay, self._pump)
+
+    def stats(self):
+        return {
+            lane: {"queued": len(self.queues[lane]), "sent": self.sent[lane], "rejected": self.rejected[lane]}
+            for lane in LANES
+        }
@@ -0,0 +1,146 @@
+import json
+import math
+import base64
+import struct
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from ctrader_open_api import Protobuf
+
+from libs.errors import NotAcceptable
+
+try:
+    import msgpack
+except ImportError:  # optional — application/msgpack is answered 406 without it, unless JSON is also accepted
+    msgpack = None
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_PROTOBUF = "protobuf"
+
+CONTENT_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_MSGPACK: "application/msgpack",
+    FORMAT_PROTOBUF: "application/x-protobuf",
+}
+
+ACCEPT_FORMATS = {
+    b"application/msgpack": FORMAT_MSGPACK,
+    b"application/x-msgpack": FORMAT_MSGPACK,
+    b"application/x-protobuf": FORMAT_PROTOBUF,
+    b"application/protobuf": FORMAT_PROTOBUF,
+}
+
+# Accept types that JSON satisfies
+JSON_ACCEPT = frozenset({b"application/json", b"application/*", b"*/*"})
+
+_INT64_TYPES = (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64)
+
+_plans = {}
+
+
+def negotiate(accept):
+    """Pick a response format from an Accept header value; JSON unless a compact type is asked for.
+
+    Raises NotAcceptable when only MessagePack is asked for and msgpack is not installed.
+    """
+    if not accept:
+        return FORMAT_JSON
+    types = [part.split(b";")[0].strip().lower() for part in accept.split(b",")]
+    for contentType in types:
+        fmt = ACCEPT_FORMATS.get(contentType)
+        if fmt == FORMAT_MSGPACK and msgpack is None:
+            continue
+        if fmt is not None:
+            return fmt
+    if msgpack is None and JSON_ACCEPT.isdisjoint(types) and any(ACCEPT_FORMATS.get(t) == FORMAT_MSGPACK for t in types):
+        raise NotAcceptable(CONTENT_TYPES[FORMAT_MSGPACK], "pip install msgpack, or also accept application/json")
+    return FORMAT_JSON
+
+
+def _double(value):
+    if math.isinf(value):
+        return "-Infinity" if value < 0 else "Infinity"
+    if math.isnan(value):
+        return "NaN"
+    return value
+
+
+def _float(value):
+    if math.isinf(value) or math.isnan(value):
+        return _double(value)
+    return ToShortestFloat(value)
+
+
+def _converter(field):
+    """Return the value converter for one field, or None when the value is used as-is."""
+    if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+        return toDict
+    if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        names = {value.number: value.name for value in field.enum_type.values}
+        return lambda value: names.get(value, value)
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return lambda value: base64.b64encode(value).decode("utf-8")
+    if field.cpp_type in _INT64_TYPES:
+        return str
+    if field.cpp_type == FieldDescriptor.CPPTYPE_DOUBLE:
+        return _double
+    if field.cpp_type == FieldDescriptor.CPPTYPE_FLOAT:
+        return _float
+    return None
+
+
+def _plan(descriptor):
+    """Build (once per message type) the json name, converter and repeated flag of every field."""
+    plan = _plans.get(descriptor)
+    if plan is None:
+        plan = _plans[descriptor] = {
+            field.number: (field.json_name, _converter(field), field.label == FieldDescriptor.LABEL_REPEATED)
+            for field in descriptor.fields
+        }
+    return plan
+
+
+def toDict(message):
+    """Convert a protobuf message to the same plain structure MessageToJson would produce."""
+    plan = _plan(message.DESCRIPTOR)
+    obj = {}
+    for field, value in message.ListFields():
+        name, convert, repeated = plan[field.number]
+        if convert is None:
+            obj[name] = list(value) if repeated else value
+        elif repeated:
+            obj[name] = [convert(item) for item in value]
+        else:
+            obj[name] = convert(value)
+    return obj
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def encodeObject(obj, fmt=FORMAT_JSON):
+    """Encode a plain object as (body, content type); JSON for any format other than msgpack."""
+    if fmt == FORMAT_MSGPACK and msgpack is not None:
+        return msgpack.packb(obj), CONTENT_TYPES[FORMAT_MSGPACK]
+    return dumps(obj), CONTENT_TYPES[FORMAT_JSON]
+
+
+def encode(result, fmt=FORMAT_JSON):
+    """Encode a ProtoMessage (or a str result, or None) as (body, content type) in the requested format.
+
+    Raw protobuf is the ProtoMessage framed like the Open API TCP stream: a 4-byte
+    big-endian length followed by the serialized message. Results that are not a
+    ProtoMessage have no protobuf form and are returned as JSON.
+    """
+    if result is None:
+        obj = {}
+    elif type(result) is str:
+        obj = {"result": result}
+    elif fmt == FORMAT_PROTOBUF:
+        data = result.SerializeToString()
+        return struct.pack(">I", len(data)) + data, CONTENT_TYPES[FORMAT_PROTOBUF]
+    else:
+        obj = toDict(Protobuf.extract(result))
+    return encodeObject(obj, fmt)
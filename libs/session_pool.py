@@ -0,0 +1,308 @@
+import contextvars
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from libs.errors import ProxyError, SessionUnavailable, DeadlineExceeded, CircuitOpen
+from libs.scheduler import laneFor, LANE_HISTORICAL
+
+ROLE_GENERAL = "general"
+ROLE_HISTORICAL = "historical"
+
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_READY = "ready"  # application authorized; accounts can be authorized
+STATE_DISCONNECTED = "disconnected"
+
+
+def accountOf(request):
+    """The ctidTraderAccountId of a request, or None for requests that do not act on an account."""
+    if "ctidTraderAccountId" not in request.DESCRIPTOR.fields_by_name:
+        return None
+    return request.ctidTraderAccountId or None
+
+
+class HeldRequest:
+    """A request waiting for its session to be able to send it."""
+    __slots__ = ("request", "clientMsgId", "deferred", "timer", "submitted", "context")
+
+    def __init__(self, request, clientMsgId):
+        self.request = request
+        self.clientMsgId = clientMsgId
+        self.context = contextvars.copy_context()  # submitted in the caller's context once released
+        self.deferred = None
+        self.timer = None
+        self.submitted = None
+
+
+class Session:
+    """One upstream connection: its Client, its own rate-budget scheduler, the accounts
+    authorized on it, and health counters.
+
+    The session moves connecting → connected → ready (application authorized) and
+    back to disconnected when the socket drops. Requests that cannot be sent yet —
+    the session is not ready, or their account is not authorized on it again — are
+    held in a bounded queue and released as soon as they can be, or fail with
+    SessionUnavailable after holdTimeout seconds. Requests already handed to the
+    scheduler when the socket drops fail with SessionUnavailable, as cTrader will
+    never answer them on the new connection.
+
+    Every request is cancelled with DeadlineExceeded once its deadline passes, and
+    fails fast with CircuitOpen while the session's circuit breaker is open.
+    """
+
+    def __init__(self, name, role, client, scheduler, holdLimit=200, holdTimeout=10,
+                 deadlines=None, breaker=None, clock=reactor):
+        self.name = name
+        self.role = role
+        self.client = client
+        self.scheduler = scheduler
+        self.holdLimit = holdLimit
+        self.holdTimeout = holdTimeout
+        self.deadlines = deadlines
+        self.breaker = breaker
+        self.clock = clock
+        self.accounts = set()
+        self.held = deque()
+        self.inFlight = set()  # Deferreds of requests handed to the scheduler and not answered yet
+        self.lost = set()  # of those, the ones being cancelled because the connection dropped
+        self.state = STATE_CONNECTING
+        self.connects = 0
+        self.disconnects = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.lastError = None
+        self.lastMessageAt = None
+        self.disconnectedAt = None
+        self.recovering = set()
+        self.recoveries = 0
+        self.lastRecovery = None
+
+    def canSend(self, request):
+        if self.state != STATE_READY:
+            return False
+        accountId = accountOf(request)
+        return accountId is None or accountId in self.accounts or type(request).__name__ == "ProtoOAAccountAuthReq"
+
+    def send(self, request, clientMsgId=None):
+        """Queue a request on this session's scheduler, or hold it until the session can send it.
+
+        Returns a Deferred firing with the response. Cancelling it drops the request
+        wherever it is waiting, or cancels the upstream call.
+        """
+        sendable = self.canSend(request)
+        if not sendable and len(self.held) >= self.holdLimit:
+            return defer.fail(SessionUnavailable(self.name, f"{len(self.held)} requests already waiting for it to recover"))
+        if self.breaker is not None and not self.breaker.allow():
+            return defer.fail(CircuitOpen(self.name, self.breaker.retryAfter()))
+        if sendable:
+            deferred = self.scheduler.submit(request, clientMsgId)
+            self.inFlight.add(deferred)
+        else:
+            deferred = self._hold(request, clientMsgId)
+        deferred.addBoth(self._settled, deferred)
+        if self.deadlines is not None:
+            command = type(request).__name__
+            deferred.addTimeout(self.deadlines.forRequest(request), self.clock,
+                                onTimeoutCancel=lambda result, timeout: self._deadlineExceeded(result, timeout, command))
+        deferred.addBoth(self._record)
+        return deferred
+
+    def _hold(self, request, clientMsgId):
+        held = HeldRequest(request, clientMsgId)
+        held.deferred = defer.Deferred(lambda _: self._cancelHeld(held))
+        held.timer = self.clock.callLater(self.holdTimeout, self._expire, held)
+        self.held.append(held)
+        return held.deferred
+
+    def _cancelHeld(self, held):
+        if held.submitted is not None:
+            held.submitted.cancel()
+        else:
+            self.held.remove(held)
+            held.timer.cancel()
+
+    def _expire(self, held):
+        self.held.remove(held)
+        held.deferred.errback(SessionUnavailable(self.name, f"not ready after {self.holdTimeout}s"))
+
+    def release(self):
+        """Submit every held request the session can now send, in arrival order."""
+        waiting = deque()
+        for held in self.held:
+            if not self.canSend(held.request):
+                waiting.append(held)
+                continue
+            held.timer.cancel()
+            held.submitted = held.context.run(self.scheduler.submit, held.request, held.clientMsgId)
+            self.inFlight.add(held.deferred)
+            held.submitted.chainDeferred(held.deferred)
+        self.held = waiting
+
+    def _settled(self, result, deferred):
+        self.inFlight.discard(deferred)
+        if deferred in self.lost:
+            self.lost.discard(deferred)
+            if isinstance(result, Failure) and result.check(defer.CancelledError):
+                raise SessionUnavailable(self.name, "connection lost before cTrader answered")
+        return result
+
+    def _deadlineExceeded(self, result, timeout, command):
+        if isinstance(result, Failure) and result.check(defer.CancelledError):
+            raise DeadlineExceeded(command, timeout)
+        return result
+
+    def _record(self, result):
+        """Count a request's outcome in the health counters and the circuit breaker."""
+        ok = True
+        if isinstance(result, Failure):
+            if result.check(DeadlineExceeded):
+                self.timeouts += 1
+                ok = False
+            elif result.check(ProxyError, defer.CancelledError):
+                ok = None  # refused by the proxy itself, or the caller went away
+            else:
+                self.failures += 1
+                ok = False
+            if ok is False:
+                self.lastError = result.getErrorMessage()
+        if self.breaker is not None:
+            self.breaker.record(ok)
+        return result
+
+    def onConnected(self):
+        self.state = STATE_CONNECTED
+        self.connects += 1
+
+    def onReady(self):
+        """Mark the application authorized; returns True when this completes a recovery.
+
+        A fresh connection starts with a closed circuit breaker.
+        """
+        self.state = STATE_READY
+        if self.breaker is not None:
+            self.breaker.reset()
+        recovered = self._checkRecovered()
+        self.release()
+        return recovered
+
+    def onAccountAuthorized(self, accountId):
+        """Record an account authorization; returns True when this completes a recovery."""
+        self.accounts.add(accountId)
+        recovered = self._checkRecovered()
+        self.release()
+        return recovered
+
+    def onAccountDeauthorized(self, accountId):
+        """Hold an account's requests again until it is re-authorized, e.g. after cTrader rejected its token."""
+        self.accounts.discard(accountId)
+
+    def onDisconnected(self, accounts):
+        """Forget the session's authorizations; recovery completes once accounts are authorized again."""
+        self.state = STATE_DISCONNECTED
+        self.disconnects += 1
+        self.accounts.clear()
+        lost, self.inFlight = self.inFlight, set()
+        self.lost.update(lost)
+        for deferred in lost:
+            deferred.cancel()  # the Client drops its pending responses on disconnect without failing them
+        if self.disconnectedAt is None:
+            self.disconnectedAt = time.monotonic()
+        self.recovering = set(accounts)
+
+    def _checkRecovered(self):
+        if self.disconnectedAt is None or self.state != STATE_READY or not self.recovering <= self.accounts:
+            return False
+        self.lastRecovery = time.monotonic() - self.disconnectedAt
+        self.recoveries += 1
+        self.disconnectedAt = None
+        return True
+
+    def onMessage(self):
+        self.lastMessageAt = time.time()
+
+    def stats(self):
+        return {
+            "role": self.role,
+            "state": self.state,
+            "accounts": sorted(self.accounts),
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "lastError": self.lastError,
+            "lastMessageAt": self.lastMessageAt,
+            "held": len(self.held),
+            "recoveries": self.recoveries,
+            "lastRecoveryMs": round(self.lastRecovery * 1000) if self.lastRecovery is not None else None,
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+            "scheduler": self.scheduler.stats(),
+        }
+
+
+class SessionPool:
+    """Routes requests over several upstream sessions.
+
+    Each account is pinned to one general session, which carries its trading,
+    account and streaming traffic, and to one historical session for trendbar and
+    tick data requests. Without dedicated historical sessions, historical traffic
+    stays on the account's general session. New pins go to the ready session with
+    the fewest accounts pinned to it.
+    """
+
+    def __init__(self, general, historical=()):
+        self.general = list(general)
+        self.historical = list(historical)
+        self.pins = {}
+        self._byClient = {id(session.client): session for session in self.general + self.historical}
+
+    @property
+    def sessions(self):
+        return self.general + self.historical
+
+    def sessionOf(self, client):
+        return self._byClient[id(client)]
+
+    def pin(self, accountId, role=ROLE_GENERAL):
+        """Return the session accountId is pinned to for role, pinning it on first use."""
+        if role == ROLE_HISTORICAL and not self.historical:
+            role = ROLE_GENERAL
+        key = (int(accountId), role)
+        session = self.pins.get(key)
+        if session is None:
+            candidates = self.historical if role == ROLE_HISTORICAL else self.general
+            load = {id(s): 0 for s in candidates}
+            for (_, pinnedRole), pinned in self.pins.items():
+                if pinnedRole == role:
+                    load[id(pinned)] += 1
+            session = self.pins[key] = min(candidates, key=lambda s: (s.state != STATE_READY, load[id(s)]))
+        return session
+
+    def primary(self, accountId):
+        """The general session of an account: where its execution and spot events are taken from."""
+        return self.pin(accountId, ROLE_GENERAL)
+
+    def sessionsFor(self, accountId):
+        """Every session an account must be authorized on, its primary session first."""
+        sessions = [self.pin(accountId, ROLE_GENERAL)]
+        historical = self.pin(accountId, ROLE_HISTORICAL)
+        if historical is not sessions[0]:
+            sessions.append(historical)
+        return sessions
+
+    def accountsOn(self, session):
+        """Accounts pinned to a session, in any role."""
+        return sorted({accountId for (accountId, _), pinned in self.pins.items() if pinned is session})
+
+    def route(self, request):
+        """Pick the session for a request from its account and scheduler lane."""
+        accountId = accountOf(request)
+        if accountId is None:
+            return next((s for s in self.general if s.state == STATE_READY), self.general[0])
+        role = ROLE_HISTORICAL if laneFor(request) == LANE_HISTORICAL else ROLE_GENERAL
+        return self.pin(accountId, role)
+
+    def stats(self):
+        return {session.name: session.stats() for session in self.sessions}
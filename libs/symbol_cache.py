@@ -0,0 +1,116 @@
+import time
+from bisect import bisect_left
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAErrorRes
+from twisted.internet import defer
+
+from libs import serializer
+
+CATALOGUE_COMMANDS = (
+    "ProtoOASymbolsListReq",
+    "ProtoOAAssetListReq",
+    "ProtoOAAssetClassListReq",
+    "ProtoOASymbolCategoryListReq",
+)
+
+
+class CatalogueEntry:
+    """One cached catalogue response: the upstream ProtoMessage plus its encoded bodies, built once per format."""
+    __slots__ = ("result", "bodies", "expires")
+
+    def __init__(self, result, expires):
+        self.result = result
+        self.bodies = {}
+        self.expires = expires
+
+    def encoded(self, fmt=serializer.FORMAT_JSON):
+        """Return (body, content type) for fmt, serializing only on the first request for that format."""
+        encoded = self.bodies.get(fmt)
+        if encoded is None:
+            encoded = self.bodies[fmt] = serializer.encode(self.result, fmt)
+        return encoded
+
+
+class SymbolCatalogue:
+    """TTL cache for the symbol / asset / category lists with a name→id symbol index.
+
+    Entries are keyed per account because symbol IDs are broker-specific.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._indexes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, command, accountId, loader, *args):
+        """Return a Deferred firing with the CatalogueEntry for command, calling loader(accountId, *args) on a miss."""
+        key = (command, accountId, args)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            self.hits += 1
+            return defer.succeed(entry)
+        self.misses += 1
+        deferred = loader(accountId, *args)
+        deferred.addCallback(self._store, key)
+        return deferred
+
+    def _store(self, result, key):
+        if result is None or type(result) is str or result.payloadType == ProtoOAErrorRes().payloadType:
+            return CatalogueEntry(result, 0)
+        entry = CatalogueEntry(result, time.monotonic() + self.ttl)
+        entry.encoded()
+        self._entries[key] = entry
+        command, accountId, args = key
+        if command == "ProtoOASymbolsListReq" and not args:
+            self._indexes[accountId] = SymbolIndex(Protobuf.extract(result).symbol)
+        return entry
+
+    def symbolIndex(self, accountId, loader):
+        """Return a Deferred firing with the SymbolIndex for accountId (None if the list could not be loaded)."""
+        deferred = self.fetch("ProtoOASymbolsListReq", accountId, loader)
+        deferred.addCallback(lambda entry: self._indexes.get(accountId))
+        return deferred
+
+    def invalidate(self, accountId=None):
+        """Drop cached entries for one account, or for every account when accountId is None."""
+        for key in [k for k in self._entries if accountId is None or k[1] == accountId]:
+            del self._entries[key]
+        for key in [k for k in self._indexes if accountId is None or k == accountId]:
+            del self._indexes[key]
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SymbolIndex:
+    """Hashed symbol lookup by name and id, plus sorted names for prefix search."""
+
+    def __init__(self, symbols):
+        self.byId = {}
+        self.byName = {}
+        for symbol in symbols:
+            obj = serializer.toDict(symbol)
+            self.byId[symbol.symbolId] = obj
+            self.byName[symbol.symbolName.upper()] = obj
+        self._names = sorted(self.byName)
+
+    def lookupId(self, symbolId):
+        obj = self.byId.get(int(symbolId))
+        return [obj] if obj else []
+
+    def lookupName(self, name):
+        obj = self.byName.get(name.upper())
+        return [obj] if obj else []
+
+    def lookupPrefix(self, prefix, limit=100):
+        prefix = prefix.upper()
+        start = bisect_left(self._names, prefix)
+        matches = []
+        for name in self._names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            matches.append(self.byName[name])
+        return matches
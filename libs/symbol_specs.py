@@ -0,0 +1,122 @@
+import datetime
+import time
+import zoneinfo
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASymbolByIdRes
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAOrderType, ProtoOATradingMode
+from twisted.internet import defer
+
+from libs.errors import InvalidOrder
+
+RELATIVE_DIGITS = 5  # relativeStopLoss / relativeTakeProfit are in 1/100000 of a price unit
+
+
+class SymbolSpecs:
+    """Full ProtoOASymbol specifications per account, loaded on first use.
+
+    Entries do not expire: cTrader announces changes with ProtoOASymbolChangedEvent,
+    which should call invalidate(). A load that was in flight when its symbol was
+    invalidated is returned to its caller but not cached.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader  # loader(accountId, symbolId) → Deferred firing with a ProtoOASymbolByIdRes ProtoMessage
+        self._specs = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, accountId, symbolId):
+        """Return a Deferred firing with the ProtoOASymbol, an "Unknown symbol" str, or the upstream error unchanged."""
+        key = (int(accountId), int(symbolId))
+        spec = self._specs.get(key)
+        if spec is not None:
+            self.hits += 1
+            return defer.succeed(spec)
+        self.misses += 1
+        deferred = self.loader(*key)
+        deferred.addCallback(self._store, key, self._generation)
+        return deferred
+
+    def _store(self, msg, key, generation):
+        if msg is None or type(msg) is str or msg.payloadType != ProtoOASymbolByIdRes().payloadType:
+            return msg
+        symbols = Protobuf.extract(msg).symbol
+        if not symbols:
+            return f"Unknown symbol: {key[1]}"
+        if generation == self._generation:
+            self._specs[key] = symbols[0]
+        return symbols[0]
+
+    def invalidate(self, accountId, symbolIds=None):
+        """Drop the cached specifications of some symbols of an account, or of all its symbols."""
+        self._generation += 1
+        self.invalidations += 1
+        for key in [k for k in self._specs if k[0] == int(accountId) and (symbolIds is None or k[1] in symbolIds)]:
+            del self._specs[key]
+
+    def stats(self):
+        return {"symbols": len(self._specs), "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+def isOpen(spec, now=None):
+    """Whether now (epoch seconds) falls in one of the symbol's weekly trading sessions.
+
+    Sessions are in seconds from Sunday 00:00 in scheduleTimeZone. Symbols without
+    a schedule, or with a time zone this host does not know, count as open.
+    """
+    if not spec.schedule:
+        return True
+    try:
+        zone = zoneinfo.ZoneInfo(spec.scheduleTimeZone or "UTC")
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return True
+    local = datetime.datetime.fromtimestamp(time.time() if now is None else now, zone)
+    second = (local.isoweekday() % 7) * 86400 + local.hour * 3600 + local.minute * 60 + local.second
+    return any(interval.startSecond <= second < interval.endSecond for interval in spec.schedule)
+
+
+def checkNewOrder(spec, orderType, now=None):
+    """Reject new orders the symbol's trading mode or schedule would refuse."""
+    if spec.tradingMode != ProtoOATradingMode.ENABLED:
+        raise InvalidOrder(spec.symbolId, f"trading mode is {ProtoOATradingMode.Name(spec.tradingMode)}")
+    if orderType == ProtoOAOrderType.MARKET and not isOpen(spec, now):
+        raise InvalidOrder(spec.symbolId, "market is closed")
+
+
+def normalizeVolume(spec, volume):
+    """Return volume as an int, rejecting it outside minVolume..maxVolume or off stepVolume."""
+    volume = int(float(volume))
+    if volume < spec.minVolume:
+        raise InvalidOrder(spec.symbolId, f"volume {volume} is below minVolume {spec.minVolume}")
+    if spec.maxVolume and volume > spec.maxVolume:
+        raise InvalidOrder(spec.symbolId, f"volume {volume} is above maxVolume {spec.maxVolume}")
+    if spec.stepVolume and volume % spec.stepVolume:
+        raise InvalidOrder(spec.symbolId, f"volume {volume} is not a multiple of stepVolume {spec.stepVolume}")
+    return volume
+
+
+def normalizePrice(spec, price):
+    """Round an absolute price to the symbol's digits; None, "" and 0 (which removes a stop loss / take profit) pass through."""
+    if price in (None, ""):
+        return price
+    value = float(price)
+    if value == 0:
+        return price
+    if value < 0:
+        raise InvalidOrder(spec.symbolId, f"price {value} is not positive")
+    return round(value, spec.digits)
+
+
+def normalizeRelative(spec, distance):
+    """Round a relative stop loss / take profit to a whole number of the symbol's smallest price step."""
+    if distance in (None, ""):
+        return distance
+    step = 10 ** max(0, RELATIVE_DIGITS - spec.digits)
+    distance = round(float(distance) / step) * step
+    if distance <= 0:
+        raise InvalidOrder(spec.symbolId, "relative stop loss / take profit must be at least one price step")
+    return distance
+
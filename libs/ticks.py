@@ -0,0 +1,52 @@
+import numpy as np
+
+PRICE_SCALE = 100000  # tick prices arrive as integers in 1/100000 units
+
+
+def decodeTicks(tickData):
+    """Decode one page of ProtoOATickData into (timestamps, prices) arrays, newest first.
+
+    The first tick of a page carries absolute values and every following one the
+    difference to its predecessor, so both columns are a cumulative sum.
+    """
+    raw = np.fromiter((value for tick in tickData for value in (tick.timestamp, tick.tick)),
+                      dtype=np.int64, count=len(tickData) * 2).reshape(len(tickData), 2)
+    absolute = np.cumsum(raw, axis=0)
+    return absolute[:, 0], absolute[:, 1] / PRICE_SCALE
+
+
+class TickPager:
+    """Walks [fromTs, toTs] backwards one ProtoOAGetTickDataRes page at a time.
+
+    cTrader returns the newest ticks of the window first and sets hasMore when it
+    truncated the page; the next page is requested up to the oldest timestamp seen.
+    Ticks sharing that boundary millisecond that were already returned are skipped.
+    """
+
+    def __init__(self, fromTs, toTs):
+        self.fromTs = int(fromTs)
+        self.toTs = int(toTs)
+        self.done = self.fromTs > self.toTs
+        self.pages = 0
+        self.ticks = 0
+        self._skip = 0
+
+    def feed(self, pb):
+        """Decode one page, advance the window and return (timestamps, prices) of the new ticks."""
+        self.pages += 1
+        timestamps, prices = decodeTicks(pb.tickData)
+        skip = min(self._skip, int(np.count_nonzero(timestamps == self.toTs)))
+        timestamps, prices = timestamps[skip:], prices[skip:]
+        self.ticks += len(timestamps)
+        if not pb.hasMore or len(timestamps) == 0:
+            self.done = True
+            return timestamps, prices
+        oldest = int(timestamps[-1])
+        atBoundary = int(np.count_nonzero(timestamps == oldest))
+        if atBoundary == len(timestamps):
+            # a whole page inside one millisecond; step past it rather than asking for it again
+            self.toTs, self._skip = oldest - 1, 0
+        else:
+            self.toTs, self._skip = oldest, atBoundary
+        self.done = self.toTs < self.fromTs
+        return timestamps, prices
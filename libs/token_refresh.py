@@ -0,0 +1,123 @@
+import time
+
+from twisted.internet import defer, reactor, threads
+
+# ProtoOAErrorRes codes that mean the access token is no longer accepted
+TOKEN_ERRORS = frozenset({"CH_ACCESS_TOKEN_INVALID", "INVALID_ACCESS_TOKEN", "ACCESS_TOKEN_EXPIRED"})
+
+
+class TokenRefresher:
+    """Keeps the access token fresh without blocking the reactor.
+
+    fetch(refreshToken) is the blocking call to the token endpoint and
+    persist(accessToken, refreshToken, expiresAt) the blocking write to .env; both
+    run in the reactor's thread pool. Only one refresh runs at a time: callers of
+    refresh() while one is in flight, or within `recent` seconds of a successful
+    one, share its outcome. onRefreshed() is called on the reactor thread after
+    every successful refresh.
+
+    The next refresh is scheduled `margin` seconds before the token expires, or
+    every `fallback` seconds while the expiry is unknown. A failed refresh is
+    retried after `retry` seconds, doubling up to `fallback`.
+    """
+
+    def __init__(self, accessToken, refreshToken, fetch, persist, onRefreshed, expiresAt=None,
+                 margin=86400, fallback=6 * 3600, retry=60, recent=30, clock=reactor):
+        self.accessToken = accessToken
+        self.refreshToken = refreshToken
+        self.fetch = fetch
+        self.persist = persist
+        self.onRefreshed = onRefreshed
+        self.expiresAt = expiresAt or None  # epoch seconds
+        self.margin = margin
+        self.fallback = fallback
+        self.retry = retry
+        self.recent = recent
+        self.clock = clock
+        self._waiters = None
+        self._timer = None
+        self.refreshedAt = None
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutiveFailures = 0
+        self.lastError = None
+
+    @property
+    def refreshing(self):
+        return self._waiters is not None
+
+    def refresh(self):
+        """Return a Deferred firing True once a new access token is in place, or False if the refresh failed."""
+        if not self.refreshToken:
+            return defer.succeed(False)
+        if self.refreshedAt is not None and self.clock.seconds() - self.refreshedAt < self.recent:
+            return defer.succeed(True)
+        waiter = defer.Deferred()
+        if self._waiters is not None:
+            self._waiters.append(waiter)
+            return waiter
+        self._waiters = [waiter]
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        deferred = threads.deferToThread(self.fetch, self.refreshToken)
+        deferred.addCallback(self._received)
+        deferred.addCallbacks(self._succeeded, self._failed)
+        return waiter
+
+    def _received(self, result):
+        if 'accessToken' not in result:
+            raise ValueError(f"token endpoint answered {result}")
+        self.accessToken = result['accessToken']
+        self.refreshToken = result.get('refreshToken') or self.refreshToken
+        expiresIn = result.get('expiresIn')
+        self.expiresAt = int(time.time() + expiresIn) if expiresIn else None
+        return threads.deferToThread(self.persist, self.accessToken, self.refreshToken, self.expiresAt)
+
+    def _succeeded(self, _):
+        self.refreshes += 1
+        self.consecutiveFailures = 0
+        self.lastError = None
+        self.refreshedAt = self.clock.seconds()
+        self.schedule()
+        try:
+            self.onRefreshed()
+        finally:
+            self._fire(True)  # the new token is in place even if re-authorizing with it failed
+
+    def _failed(self, failure):
+        self.failures += 1
+        self.consecutiveFailures += 1
+        self.lastError = failure.getErrorMessage()
+        self._timer = self.clock.callLater(min(self.fallback, self.retry * 2 ** (self.consecutiveFailures - 1)), self.refresh)
+        self._fire(False)
+
+    def _fire(self, ok):
+        waiters, self._waiters = self._waiters, None
+        for waiter in waiters:
+            waiter.callback(ok)
+
+    def nextDelay(self):
+        """Seconds until the next scheduled refresh."""
+        if self.expiresAt is None:
+            return self.fallback
+        return max(0, self.expiresAt - self.margin - time.time())
+
+    def schedule(self):
+        """(Re)arm the proactive refresh timer; returns the delay in seconds, or None without a refresh token."""
+        if not self.refreshToken:
+            return None
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        delay = self.nextDelay()
+        self._timer = self.clock.callLater(delay, self.refresh)
+        return delay
+
+    def stats(self):
+        return {
+            "expiresAt": self.expiresAt,
+            "nextRefreshIn": round(self._timer.getTime() - self.clock.seconds()) if self._timer is not None and self._timer.active() else None,
+            "refreshing": self.refreshing,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "lastError": self.lastError,
+        }
@@ -0,0 +1,124 @@
+import io
+import time
+
+import numpy as np
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAGetTrendbarsRes
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional — only needed for the "arrow" columnar format
+    pyarrow = None
+
+PERIOD_MINUTES = {
+    "M1": 1, "M2": 2, "M3": 3, "M4": 4, "M5": 5, "M10": 10, "M15": 15, "M30": 30,
+    "H1": 60, "H4": 240, "H12": 720, "D1": 1440, "W1": 10080,
+    "MN1": 44640,  # 31 days — upper bound, used only to decide when a bar is closed
+}
+
+PRICE_SCALE = 100000  # trendbar prices arrive as integers in 1/100000 units
+
+COLUMNS = ("timestamp", "open", "high", "low", "close", "volume")
+
+# Columnar output formats for /api/trendbars: JSON/msgpack lists, or binary NumPy / Arrow payloads
+COLUMNAR_FORMATS = ("columnar", "npz") + (("arrow",) if pyarrow is not None else ())
+
+WEEK_MS = 7 * 24 * 60 * 60 * 1000
+
+# Widest window cTrader accepts in one ProtoOAGetTrendbarsReq, by period
+MAX_REQUEST_SPAN_MS = {
+    "M1": 5 * WEEK_MS, "M2": 5 * WEEK_MS, "M3": 5 * WEEK_MS, "M4": 5 * WEEK_MS, "M5": 5 * WEEK_MS,
+    "M10": 35 * WEEK_MS, "M15": 35 * WEEK_MS, "M30": 35 * WEEK_MS, "H1": 35 * WEEK_MS,
+    "H4": 52 * WEEK_MS, "H12": 52 * WEEK_MS, "D1": 52 * WEEK_MS,
+    "W1": 5 * 52 * WEEK_MS, "MN1": 5 * 52 * WEEK_MS,
+}
+
+
+def chunkRange(fromTs, toTs, period, maxBars):
+    """Split [fromTs, toTs] into consecutive inclusive windows small enough for one upstream request.
+
+    Windows hold at most maxBars - 1 bars so a full window is never mistaken for a capped response.
+    """
+    span = min((maxBars - 1) * PERIOD_MINUTES[period] * 60000, MAX_REQUEST_SPAN_MS[period])
+    fromTs, toTs = int(fromTs), int(toTs)
+    chunks = []
+    start = fromTs
+    while start <= toTs:
+        end = min(start + span - 1, toTs)
+        chunks.append((start, end))
+        start = end + 1
+    return chunks
+
+
+def mergeTrendbars(responses):
+    """Merge chunk responses into one ProtoMessage with bars de-duplicated and in time order.
+
+    The first response that is not a ProtoOAGetTrendbarsRes (an error, or None after a
+    swallowed failure) is returned unchanged.
+    """
+    bars = {}
+    merged = None
+    for response in responses:
+        if response is None or response.payloadType != ProtoOAGetTrendbarsRes().payloadType:
+            return response
+        pb = Protobuf.extract(response)
+        if merged is None:
+            merged = ProtoOAGetTrendbarsRes(ctidTraderAccountId=pb.ctidTraderAccountId, period=pb.period,
+                                            symbolId=pb.symbolId, timestamp=int(time.time() * 1000))
+        for bar in pb.trendbar:
+            bars[bar.utcTimestampInMinutes] = bar
+    if merged is None:
+        return None
+    merged.trendbar.extend(bars[ts] for ts in sorted(bars))
+    return ProtoMessage(payloadType=merged.payloadType, payload=merged.SerializeToString())
+
+
+def decodeTrendbars(response, digits):
+    """Decode a ProtoOAGetTrendbarsRes ProtoMessage into columns of real prices.
+
+    The bars are copied out of the message once into an int64 matrix; the delta
+    decoding, scaling and rounding to the symbol's digits then run as whole-array
+    operations. Timestamps are epoch milliseconds.
+    """
+    bars = Protobuf.extract(response).trendbar
+    raw = np.fromiter(
+        (value for bar in bars
+         for value in (bar.utcTimestampInMinutes, bar.low, bar.deltaOpen, bar.deltaHigh, bar.deltaClose, bar.volume)),
+        dtype=np.int64, count=len(bars) * 6,
+    ).reshape(len(bars), 6)
+    low = raw[:, 1]
+    prices = np.round(np.stack((low + raw[:, 2], low + raw[:, 3], low, low + raw[:, 4])) / PRICE_SCALE, digits)
+    return {
+        "timestamp": raw[:, 0] * 60000,
+        "open": prices[0],
+        "high": prices[1],
+        "low": prices[2],
+        "close": prices[3],
+        "volume": raw[:, 5],
+    }
+
+
+def columnList(column):
+    """column.tolist(), with NaN as None so it encodes as JSON null."""
+    if column.dtype.kind == "f" and np.isnan(column).any():
+        return np.where(np.isnan(column), None, column).tolist()
+    return column.tolist()
+
+
+def encodeColumns(columns, fmt):
+    """Encode a dict of equal-length columns as a binary payload; returns (body, content type).
+
+    "npz" is the format written by numpy.savez (read it back with numpy.load);
+    "arrow" is an Arrow IPC stream holding one record batch.
+    """
+    if fmt == "arrow":
+        table = pyarrow.table(columns)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), "application/vnd.apache.arrow.stream"
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    return buffer.getvalue(), "application/x-npz"
@@ -1,36 +1,58 @@
 #!/usr/bin/env python
 
 from klein import Klein
-from ctrader_open_api import Client, Protobuf, TcpProtocol, Auth, EndPoints
+from ctrader_open_api import Client, Protobuf, Auth
 from ctrader_open_api.endpoints import EndPoints
 from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import *
 from ctrader_open_api.messages.OpenApiMessages_pb2 import *
 from ctrader_open_api.messages.OpenApiModelMessages_pb2 import *
+from ctrader_open_api.messages.OpenApiCommonModelMessages_pb2 import ProtoPayloadType
 import json
 import os
-from twisted.internet import endpoints, reactor
+import time
+from twisted.internet import endpoints, reactor, defer, task
+from twisted.internet.error import ProcessDone
+from twisted.application.internet import backoffPolicy
 from twisted.web.server import Site
+from twisted.python.failure import Failure
 import sys
-from twisted.web.static import File
 import datetime
-from google.protobuf.json_format import MessageToJson
 import calendar
 from dotenv import load_dotenv
 from twisted.web.server import NOT_DONE_YET
-from libs.config import CTRADER_TOKEN, CTRADER_REFRESH_TOKEN, CTRADER_CLIENT_ID, CTRADER_CLIENT_SECRET, CTRADER_HOST, CTRADER_ACCOUNTID
+from libs.config import CTRADER_TOKEN, CTRADER_REFRESH_TOKEN, CTRADER_CLIENT_ID, CTRADER_CLIENT_SECRET, CTRADER_HOST, CTRADER_TOKEN_EXPIRES_AT, CTRADER_ACCOUNTIDS, CATALOGUE_CACHE_TTL, BAR_STORE_PATH, HISTORY_STORE_PATH, HISTORY_BACKFILL_DAYS, HISTORY_SYNC_INTERVAL, TRENDBAR_MAX_BARS, TRENDBAR_CONCURRENCY, RECONCILE_INTERVAL, RATE_LIMIT_GENERAL, RATE_LIMIT_HISTORICAL, SCHEDULER_QUEUE_LIMIT, UPSTREAM_SESSIONS, UPSTREAM_HISTORICAL_SESSIONS, SESSION_HOLD_LIMIT, SESSION_HOLD_TIMEOUT, REQUEST_TIMEOUT, HISTORICAL_REQUEST_TIMEOUT, REQUEST_TIMEOUTS, REQUEST_TIMEOUT_MAX, BREAKER_FAILURE_RATE, BREAKER_MIN_REQUESTS, BREAKER_WINDOW, BREAKER_COOLDOWN, CAPTURE_RING_BYTES, CAPTURE_HTTP, CAPTURE_PATH, CAPTURE_FILE_BYTES, CAPTURE_BACKUPS, TOKEN_REFRESH_MARGIN, HTTP_WORKERS, BROKER_SOCKET, PROXY_WORKER
 from libs.logging_config import logger
+from libs.symbol_cache import SymbolCatalogue, CatalogueEntry, CATALOGUE_COMMANDS
+from libs import serializer
+from libs.bar_store import BarStore
+from libs.history_store import HistoryStore, DEALS, ORDERS
+from libs.ticks import TickPager
+from libs.trendbars import chunkRange, mergeTrendbars, decodeTrendbars, encodeColumns, columnList, COLUMNAR_FORMATS
+from libs.indicators import parsePeriod, parseIndicators, warmupBars, resample, compute as computeIndicators
+from libs.quote_book import QuoteBook
+from libs.execution_state import ExecutionState
+from libs.coalesce import SingleFlight
+from libs.errors import ProxyError, AccountNotAuthorized, AccountRequired, BrokerError, unwrapFirstError
+from libs.symbol_specs import SymbolSpecs, checkNewOrder, normalizeVolume, normalizePrice, normalizeRelative
+from libs.scheduler import Scheduler
+from libs.protocol import ProxyTcpProtocol
+from libs.session_pool import Session, SessionPool, ROLE_GENERAL, ROLE_HISTORICAL, accountOf
+from libs.deadlines import Deadlines, DeadlineRequest, carryDeadline
+from libs.breaker import CircuitBreaker
+from libs.metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE, GAP_BUCKETS
+from libs.capture import Capture
+from libs.token_refresh import TokenRefresher, TOKEN_ERRORS
+from libs.dispatch import Dispatcher
+from libs.broker import BrokerServer, BrokerClient, Workers, listenShared, protoMessage, ADMIN
 import re
 
 
 load_dotenv(".env")
 
-token = CTRADER_TOKEN
-refreshToken = CTRADER_REFRESH_TOKEN
-
 host = "localhost"
 port = 9009
 
-if not token:
+if not CTRADER_TOKEN:
     logger.error("Error: No token found in environment variables")
     sys.exit(1)
 currentAccountId = None
@@ -39,72 +61,224 @@ auth = Auth(CTRADER_CLIENT_ID, CTRADER_CLIENT_SECRET, f"http://{host}:{port}/red
 authUri = auth.getAuthUri()
 app = Klein()
 
-TOKEN_REFRESH_INTERVAL = 6 * 60 * 60  # 6 hours in seconds
+TOKEN_REFRESH_INTERVAL = 6 * 60 * 60  # 6 hours in seconds; used while the token's expiry is unknown
+RECONNECT_INITIAL_DELAY = 0.1  # seconds before the first reconnect attempt; backs off up to RECONNECT_MAX_DELAY
+RECONNECT_MAX_DELAY = 30
+
+def updateEnvFile(newAccessToken, newRefreshToken, expiresAt=None):
+    """Update .env file with new token values so they persist across restarts.
 
-def updateEnvFile(newAccessToken, newRefreshToken):
-    """Update .env file with new token values so they persist across restarts."""
+    Runs in the reactor's thread pool (see TokenRefresher).
+    """
     envPath = os.path.join(os.path.dirname(__file__), '.env')
     try:
         with open(envPath, 'r') as f:
             content = f.read()
-        content = re.sub(r'^CTRADER_TOKEN=.*$', f'CTRADER_TOKEN={newAccessToken}', content, flags=re.MULTILINE)
-        content = re.sub(r'^CTRADER_REFRESH_TOKEN=.*$', f'CTRADER_REFRESH_TOKEN={newRefreshToken}', content, flags=re.MULTILINE)
-        if 'CTRADER_REFRESH_TOKEN=' not in content:
-            content = re.sub(r'^(CTRADER_TOKEN=.*)$', f'\\1\nCTRADER_REFRESH_TOKEN={newRefreshToken}', content, flags=re.MULTILINE)
+        values = {'CTRADER_TOKEN': newAccessToken, 'CTRADER_REFRESH_TOKEN': newRefreshToken,
+                  'CTRADER_TOKEN_EXPIRES_AT': expiresAt or ''}
+        for key, value in values.items():
+            if re.search(rf'^{key}=', content, flags=re.MULTILINE):
+                content = re.sub(rf'^{key}=.*$', lambda _: f'{key}={value}', content, flags=re.MULTILINE)
+            else:
+                content = content.rstrip('\n') + f'\n{key}={value}\n'
         with open(envPath, 'w') as f:
             f.write(content)
         logger.info("Updated .env file with new tokens")
     except Exception as e:
         logger.error(f"Failed to update .env file: {e}")
 
+def onTokenRefreshed():
+    expiry = datetime.datetime.fromtimestamp(tokens.expiresAt).isoformat() if tokens.expiresAt else "unknown"
+    logger.info(f"Access token refreshed successfully (expires {expiry})")
+    reAuthAccount()
+
+tokens = TokenRefresher(CTRADER_TOKEN, CTRADER_REFRESH_TOKEN, auth.refreshToken, updateEnvFile, onTokenRefreshed,
+                        expiresAt=CTRADER_TOKEN_EXPIRES_AT, margin=TOKEN_REFRESH_MARGIN, fallback=TOKEN_REFRESH_INTERVAL)
+
 def doTokenRefresh():
-    """Refresh the access token using the refresh token."""
-    global token, refreshToken
-    if not refreshToken:
+    """Refresh the access token using the refresh token; returns a Deferred firing True or False.
+
+    The token endpoint is called off the reactor thread, and concurrent callers share one refresh.
+    An HTTP worker asks the broker, which owns the refresh token.
+    """
+    if PROXY_WORKER:
+        return refreshThroughBroker()
+    if not tokens.refreshToken:
         logger.warning("No refresh token available — cannot refresh access token")
-        return False
-    try:
+        return defer.succeed(False)
+    if not tokens.refreshing:
         logger.info("Refreshing access token...")
-        result = auth.refreshToken(refreshToken)
-        if 'accessToken' in result:
-            token = result['accessToken']
-            refreshToken = result.get('refreshToken', refreshToken)
-            updateEnvFile(token, refreshToken)
-            logger.info("Access token refreshed successfully")
-            if currentAccountId:
-                reAuthAccount()
-            return True
-        else:
-            logger.error(f"Token refresh failed: {result}")
+    deferred = tokens.refresh()
+    deferred.addCallback(logRefreshResult)
+    return deferred
+
+def refreshThroughBroker():
+    request = ProtoOARefreshTokenReq()
+    request.refreshToken = ""  # the broker refreshes with its own
+    deferred = sendRequest(request)
+    def received(msg):
+        if msg is None or msg.payloadType != ProtoOARefreshTokenRes().payloadType:
+            logger.error(f"Token refresh through the broker failed: {msg}")
             return False
-    except Exception as e:
-        logger.error(f"Token refresh error: {e}")
+        tokens.accessToken = Protobuf.extract(msg).accessToken
+        reAuthAccount()
+        return True
+    def failed(failure):
+        logger.error(f"Token refresh through the broker failed: {failure.getErrorMessage()}")
         return False
+    deferred.addCallbacks(received, failed)
+    return deferred
+
+def logRefreshResult(ok):
+    if not ok:
+        logger.error(f"Token refresh failed: {tokens.lastError}")
+    return ok
 
 def reAuthAccount():
-    """Re-authorize the current account with the new token."""
-    if currentAccountId:
-        logger.info(f"Re-authorizing account {currentAccountId} with new token")
-        sendProtoOAAccountAuthReq()
+    """Re-authorize every pinned account on its sessions with the new token."""
+    for session in pool.sessions:
+        for accountId in pool.accountsOn(session):
+            logger.info(f"Re-authorizing account {accountId} on {session.name} with new token")
+            authorizeOn(session, accountId).addErrback(logFailure)
 
 def scheduleTokenRefresh():
-    """Schedule periodic token refresh."""
-    if refreshToken:
-        reactor.callLater(TOKEN_REFRESH_INTERVAL, periodicTokenRefresh)
-        logger.info(f"Token refresh scheduled every {TOKEN_REFRESH_INTERVAL // 3600} hours")
+    """Schedule the next proactive token refresh from the token's expiry."""
+    delay = tokens.schedule()
+    if delay is not None:
+        logger.info(f"Next token refresh in {datetime.timedelta(seconds=round(delay))}"
+                    f"{'' if tokens.expiresAt else ' (expiry unknown until the first refresh)'}")
+
+def invalidateToken(accountIds):
+    """Hold requests of accounts whose token cTrader rejected, and refresh it; they are released once re-authorized.
+
+    A refresh that runs re-authorizes every account (onTokenRefreshed). One skipped because the
+    token was refreshed moments ago does not, so the held accounts are re-authorized here.
+    """
+    held = [(session, accountId) for accountId in (accountIds if tokens.refreshToken else ())
+            for session in pool.sessionsFor(accountId)]
+    for session, accountId in held:
+        session.onAccountDeauthorized(accountId)
+    refreshes = tokens.refreshes
+    deferred = doTokenRefresh()
+    def reauthorize(ok):
+        if ok and not PROXY_WORKER and tokens.refreshes == refreshes:
+            for session, accountId in held:
+                logger.info(f"Re-authorizing account {accountId} on {session.name} with the recently refreshed token")
+                authorizeOn(session, accountId).addErrback(logFailure)
+        return ok
+    deferred.addCallback(reauthorize)
+    return deferred
 
-def periodicTokenRefresh():
-    """Periodically refresh the token."""
-    doTokenRefresh()
-    reactor.callLater(TOKEN_REFRESH_INTERVAL, periodicTokenRefresh)
+def retryOnTokenError(msg, request, clientMsgId):
+    """Send a request rejected for an invalid token once more, after the token has been refreshed."""
+    if msg is None or msg.payloadType != ProtoOAErrorRes().payloadType:
+        return msg
+    pb = Protobuf.extract(msg)
+    if pb.errorCode not in TOKEN_ERRORS or not tokens.refreshToken:
+        return msg
+    accountId = accountOf(request)
+    deferred = invalidateToken([accountId] if accountId else [])
+    def resend(ok):
+        if not ok:
+            return msg
+        if 'accessToken' in request.DESCRIPTOR.fields_by_name:
+            request.accessToken = tokens.accessToken
+        return pool.route(request).send(request, clientMsgId)
+    deferred.addCallback(carryDeadline(resend))
+    return deferred
 
-client = None
+pool = None
+capture = None
+broker = None  # BrokerServer while HTTP_WORKERS serve HTTP for this process
+deadlines = Deadlines(REQUEST_TIMEOUT, HISTORICAL_REQUEST_TIMEOUT, REQUEST_TIMEOUTS, REQUEST_TIMEOUT_MAX)
 
 def onError(failure):
-    logger.error("Error: \n", failure)
+    """Log an upstream failure. Proxy errors (e.g. rate limiting) and cancellations propagate so the HTTP layer can report them."""
+    if failure.check(ProxyError, defer.CancelledError):
+        return failure
+    logger.error(f"Error: {failure.getErrorMessage()}")
+
+def logFailure(failure):
+    """Terminal errback for background requests whose result nobody waits on."""
+    logger.warning(f"Background request failed: {failure.getErrorMessage()}")
+
+metrics = Registry()
+httpLatency = metrics.histogram('ctrader_proxy_http_request_seconds', 'Time from receiving an HTTP request to finishing its response', ('route', 'code'))
+httpInFlight = metrics.gauge('ctrader_proxy_http_requests_in_flight', 'HTTP requests being processed')
+requestLatency = metrics.histogram('ctrader_proxy_request_seconds', 'Time from a command entering the proxy to its upstream result, queueing included', ('command', 'outcome'))
+upstreamLatency = metrics.histogram('ctrader_proxy_upstream_rtt_seconds', 'Round trip of answered upstream requests, from sending to cTrader to the response', ('command',))
+upstreamInFlight = metrics.gauge('ctrader_proxy_upstream_requests_in_flight', 'Requests sent to cTrader and not yet answered', ('session',))
+upstreamMessages = metrics.counter('ctrader_proxy_upstream_messages_total', 'Messages received from cTrader', ('payloadType',))
+upstreamErrors = metrics.counter('ctrader_proxy_upstream_errors_total', 'ProtoOAErrorRes received from cTrader', ('errorCode',))
+messageGap = metrics.histogram('ctrader_proxy_upstream_message_gap_seconds', 'Time between consecutive messages (heartbeats included) on a session', ('session',), GAP_BUCKETS)
+
+PAYLOAD_NAMES = {value: name for enum in (ProtoPayloadType, ProtoOAPayloadType) for name, value in enum.items()}
+
+def observeRequest(result, command, started):
+    if isinstance(result, Failure):
+        outcome = type(result.value).__name__ if result.check(ProxyError, defer.CancelledError) else 'error'
+    else:
+        outcome = 'ok'
+    requestLatency.observe(time.monotonic() - started, command, outcome)
+    return result
+
+def sendRequest(request, clientMsgId=None):
+    """Send a request to cTrader on the session the pool routes it to; every sendProtoOA* helper goes through here."""
+    deferred = pool.route(request).send(request, clientMsgId)
+    deferred.addCallback(retryOnTokenError, request, clientMsgId)
+    deferred.addBoth(observeRequest, type(request).__name__, time.monotonic())
+    return deferred
+
+def sendUpstream(name, client, request, clientMsgId):
+    """Hand a request the scheduler released to the Client, timing its round trip."""
+    upstreamInFlight.inc(name)
+    # the session enforces each request's deadline; the library's own 5s timeout must not cut it short.
+    # A worker passes the deadline on, so the broker's session enforces the same one.
+    timeout = deadlines.forRequest(request) if PROXY_WORKER else REQUEST_TIMEOUT_MAX
+    deferred = client.send(request, clientMsgId=clientMsgId, responseTimeoutInSeconds=timeout)
+    deferred.addBoth(observeUpstream, name, type(request).__name__, time.monotonic())
+    return deferred
+
+def observeUpstream(result, name, command, started):
+    upstreamInFlight.dec(name)
+    if not isinstance(result, Failure):
+        upstreamLatency.observe(time.monotonic() - started, command)
+    return result
+
+def upstreamAddress():
+    """(host, port) of the Open API server named by CTRADER_HOST: "demo", "live" or host:port."""
+    if CTRADER_HOST.lower() == "live":
+        return EndPoints.PROTOBUF_LIVE_HOST, EndPoints.PROTOBUF_PORT
+    if ":" in CTRADER_HOST:
+        host, port = CTRADER_HOST.rsplit(":", 1)
+        return host, int(port)
+    return EndPoints.PROTOBUF_DEMO_HOST, EndPoints.PROTOBUF_PORT
+
+def openSession(name, role, client=None):
+    """Create one upstream connection with its own rate-budget scheduler.
+
+    client replaces the cTrader Client, e.g. with the recorded traffic of tools/replay.py.
+    """
+    if client is None:
+        client = Client(
+            *upstreamAddress(),
+            ProxyTcpProtocol,
+            retryPolicy=backoffPolicy(initialDelay=RECONNECT_INITIAL_DELAY, maxDelay=RECONNECT_MAX_DELAY),
+        )
+        client.setConnectedCallback(connected)
+        client.setDisconnectedCallback(disconnected)
+        client.setMessageReceivedCallback(onMessageReceived)
+    scheduler = Scheduler(
+        lambda request, clientMsgId: sendUpstream(name, client, request, clientMsgId),
+        RATE_LIMIT_GENERAL, RATE_LIMIT_HISTORICAL, SCHEDULER_QUEUE_LIMIT,
+    )
+    breaker = CircuitBreaker(BREAKER_FAILURE_RATE, BREAKER_MIN_REQUESTS, BREAKER_WINDOW, BREAKER_COOLDOWN)
+    return Session(name, role, client, scheduler, SESSION_HOLD_LIMIT, SESSION_HOLD_TIMEOUT, deadlines, breaker)
 
 def connected(client):
-    logger.info("Client Connected")
+    session = pool.sessionOf(client)
+    session.onConnected()
+    logger.info(f"Client Connected ({session.name})")
     request = ProtoOAApplicationAuthReq()
     request.clientId = CTRADER_CLIENT_ID
     request.clientSecret = CTRADER_CLIENT_SECRET
@@ -112,147 +286,347 @@ def connected(client):
     deferred.addErrback(onError)
 
 def disconnected(client, reason):
-    logger.info("Client Disconnected, reason: \n", reason)
+    session = pool.sessionOf(client)
+    logger.info(f"Client Disconnected ({session.name}), reason: \n", reason)
+    session.onDisconnected(pool.accountsOn(session))
+
+dispatcher = Dispatcher(onError=lambda failure: logger.error(f"Message handler failed:\n{failure.getTraceback()}"))
+STREAMING_PAYLOADS = frozenset({ProtoHeartbeatEvent().payloadType, ProtoOASpotEvent().payloadType})  # too frequent to log
+# unsolicited messages the broker passes on to every HTTP worker
+BROADCAST_PAYLOADS = frozenset(value for value, name in PAYLOAD_NAMES.items() if name.endswith('_EVENT')) - {ProtoHeartbeatEvent().payloadType}
 
 def onMessageReceived(client, message):
-    if message.payloadType == ProtoHeartbeatEvent().payloadType:
+    session = pool.sessionOf(client)
+    if session.lastMessageAt is not None:
+        messageGap.observe(time.time() - session.lastMessageAt, session.name)
+    session.onMessage()
+    upstreamMessages.inc(PAYLOAD_NAMES.get(message.payloadType, str(message.payloadType)))
+    if message.payloadType not in STREAMING_PAYLOADS:
+        logger.debug("Received Message: \n {}", message)  # formatted only when DEBUG is on
+    if broker is not None and session.role == ROLE_GENERAL and message.payloadType in BROADCAST_PAYLOADS:
+        broker.broadcast(message)  # historical sessions repeat some events; the general ones see them all
+    dispatcher.dispatch(session, message)
+
+dispatcher.ignore(ProtoHeartbeatEvent)
+
+@dispatcher.on(ProtoOAApplicationAuthRes, decode=False)
+def onApplicationAuthorized(session, _, message):
+    logger.info(f"App auth successful ({session.name}).")
+    if session.onReady():
+        logRecovery(session)
+    for accountId in pool.accountsOn(session):
+        logger.info(f"Authorizing account {accountId} on {session.name}")
+        authorizeOn(session, accountId).addErrback(logFailure)
+    if not CTRADER_ACCOUNTIDS:
+        logger.warning("CTRADER_ACCOUNTID not set in .env — call /api/set-account manually")
+
+@dispatcher.on(ProtoOAAccountAuthRes)
+def onAccountAuthorized(session, pb, message):
+    acct_id = pb.ctidTraderAccountId
+    logger.info(f"Account {acct_id} authorized successfully on {session.name}.")
+    if session.onAccountAuthorized(acct_id):
+        logRecovery(session)
+    if pool.primary(acct_id) is session:
+        authorizedAccounts.add(acct_id)
+        seedExecutionState(acct_id).addErrback(logFailure)
+        if historyStore is not None and not PROXY_WORKER:
+            syncHistory(acct_id).addErrback(logFailure)
+        if session.connects > 1:
+            resubscribeSpots(acct_id)
+
+@dispatcher.on(ProtoOAErrorRes)
+def onErrorRes(session, pb, message):
+    logger.error(f"API error: {pb.errorCode} — {pb.description}")
+    upstreamErrors.inc(pb.errorCode)
+    if pb.errorCode in TOKEN_ERRORS:
+        logger.info("Token expired or invalid — attempting refresh...")
+        invalidateToken([pb.ctidTraderAccountId] if pb.ctidTraderAccountId else [])
+
+@dispatcher.on(ProtoOAAccountsTokenInvalidatedEvent)
+def onTokenInvalidated(session, pb, message):
+    logger.warning(f"Token invalidated for accounts {list(pb.ctidTraderAccountIds)}: {pb.reason} — attempting refresh...")
+    invalidateToken(pb.ctidTraderAccountIds)
+
+@dispatcher.otherwise
+def onOtherMessage(session, _, message):
+    logger.info(f"Message received: payloadType={message.payloadType}")
+
+def logRecovery(session):
+    logger.info(f"Session {session.name} recovered in {session.lastRecovery * 1000:.0f} ms "
+                f"({len(session.accounts)} accounts re-authorized)")
+
+def resubscribeSpots(accountId):
+    """Re-establish an account's spot subscriptions on its reconnected session with one request."""
+    symbolIds = [symbolId for acct, symbolId in quoteBook.subscribed() if acct == accountId]
+    if not symbolIds:
         return
-    logger.debug(f"Received Message: \n {message}")
-    if message.payloadType == ProtoOAApplicationAuthRes().payloadType:
-        logger.info("App auth successful.")
-        if CTRADER_ACCOUNTID:
-            logger.info(f"Auto-setting account {CTRADER_ACCOUNTID} from .env")
-            setAccount(CTRADER_ACCOUNTID)
-        else:
-            logger.warning("CTRADER_ACCOUNTID not set in .env — call /api/set-account manually")
-    elif message.payloadType == ProtoOAAccountAuthRes().payloadType:
-        pb = Protobuf.extract(message)
-        acct_id = str(pb.ctidTraderAccountId)
-        authorizedAccounts.append(acct_id)
-        logger.info(f"Account {acct_id} authorized successfully.")
-    elif message.payloadType == ProtoOAErrorRes().payloadType:
-        pb = Protobuf.extract(message)
-        logger.error(f"API error: {pb.errorCode} — {pb.description}")
-        if pb.errorCode in ("CH_ACCESS_TOKEN_INVALID", "INVALID_ACCESS_TOKEN", "ACCESS_TOKEN_EXPIRED"):
-            logger.info("Token expired or invalid — attempting refresh...")
-            doTokenRefresh()
-    else:
-        logger.info(f"Message received: payloadType={message.payloadType}")
+    logger.info(f"Resubscribing account {accountId} to {len(symbolIds)} symbols")
+    request = ProtoOASubscribeSpotsReq()
+    request.ctidTraderAccountId = accountId
+    request.symbolId.extend(symbolIds)
+    sendRequest(request).addErrback(logFailure)
+
+# Accounts authorized at least once; a reconnecting session holds their requests until it re-authorizes them
+authorizedAccounts = set()
+executionState = ExecutionState()
+
+@dispatcher.on(ProtoOAExecutionEvent)
+def onExecutionEvent(session, pb, message):
+    if pool.primary(pb.ctidTraderAccountId) is not session:
+        return  # the same event also arrives on the account's historical session
+    logger.info(f"Execution event: {ProtoOAExecutionType.Name(pb.executionType)} account={pb.ctidTraderAccountId}")
+    executionState.onExecution(pb)
+
+def seedExecutionState(accountId):
+    """Load an account's open positions and pending orders with one reconcile; execution events keep them current afterwards."""
+    def seed(msg):
+        if msg is not None and msg.payloadType == ProtoOAReconcileRes().payloadType:
+            executionState.seed(Protobuf.extract(msg))
+        return msg
+    deferred = sendProtoOAReconcileReq(accountId)
+    deferred.addCallback(seed)
+    return deferred
 
-authorizedAccounts = []
+def checkExecutionDrift():
+    """Reconcile every seeded account against cTrader and log any difference from the event-sourced state."""
+    def compare(msg):
+        if msg is None or msg.payloadType != ProtoOAReconcileRes().payloadType:
+            return
+        pb = Protobuf.extract(msg)
+        drift = executionState.diff(pb)
+        if any(drift.values()):
+            logger.warning(f"Positions/orders of account {pb.ctidTraderAccountId} drifted from cTrader, reseeded: {drift}")
+    for accountId in list(executionState.accounts):
+        if executionState.isSeeded(accountId):
+            sendProtoOAReconcileReq(accountId).addCallback(compare).addErrback(logFailure)
+
+# Bulk closes/cancels never fill more than half a trading lane, so they cannot push other orders into 429s
+bulkLimiter = defer.DeferredSemaphore(max(1, SCHEDULER_QUEUE_LIMIT // 2))
+
+def bulkOutcome(result, item):
+    """One target's entry in a bulk response: the item plus what cTrader answered for it."""
+    if isinstance(result, Failure):
+        return {**item, 'ok': False, 'error': result.getErrorMessage()}
+    if result is None:
+        return {**item, 'ok': False, 'error': 'no response from cTrader'}
+    pb = Protobuf.extract(result)
+    if result.payloadType in (ProtoOAErrorRes().payloadType, ProtoOAOrderErrorEvent().payloadType):
+        return {**item, 'ok': False, 'errorCode': pb.errorCode, 'description': pb.description}
+    if result.payloadType == ProtoOAExecutionEvent().payloadType:
+        return {**item, 'ok': True, 'executionType': ProtoOAExecutionType.Name(pb.executionType)}
+    return {**item, 'ok': True}
+
+def bulkExecute(accountId, kind, symbolId=None, side=None):
+    """Close every open position (kind 'position') or cancel every pending order (kind 'order') matching the filters.
+
+    Targets come from a fresh reconcile. The close/cancel requests are sent
+    concurrently on the trading lane, and the result lists every target with its
+    outcome; one target failing does not stop the others. The work is not
+    cancelled when the caller goes away.
+    """
+    tradeSide = ProtoOATradeSide.Value(side.upper()) if side else None
+
+    def fanOut(msg):
+        if msg is None or msg.payloadType != ProtoOAReconcileRes().payloadType:
+            return msg
+        pb = Protobuf.extract(msg)
+        deferreds = []
+        for target in (pb.position if kind == 'position' else pb.order):
+            if symbolId is not None and target.tradeData.symbolId != symbolId:
+                continue
+            if tradeSide is not None and target.tradeData.tradeSide != tradeSide:
+                continue
+            item = {'symbolId': target.tradeData.symbolId, 'tradeSide': ProtoOATradeSide.Name(target.tradeData.tradeSide),
+                    'volume': target.tradeData.volume}
+            if kind == 'position':
+                item['positionId'] = target.positionId
+                deferred = bulkLimiter.run(carryDeadline(sendProtoOAClosePositionReq), accountId, target.positionId, target.tradeData.volume)
+            else:
+                item['orderId'] = target.orderId
+                deferred = bulkLimiter.run(carryDeadline(sendProtoOACancelOrderReq), accountId, target.orderId)
+            deferred.addBoth(bulkOutcome, item)
+            deferreds.append(deferred)
+        logger.warning(f"Bulk {'close' if kind == 'position' else 'cancel'} of {len(deferreds)} {kind}s on account {accountId}")
+        result = defer.gatherResults(deferreds)
+        result.addCallback(lambda outcomes: {
+            'accountId': accountId,
+            'requested': len(outcomes),
+            'succeeded': sum(outcome['ok'] for outcome in outcomes),
+            'results': outcomes,
+        })
+        return result
+
+    result = sendProtoOAReconcileReq(accountId)
+    result.addCallback(carryDeadline(fanOut))
+    shielded = defer.Deferred()  # no canceller: an HTTP disconnect must not abort a flatten half-way
+    result.chainDeferred(shielded)
+    return shielded
+
+def accountFor(value, required=True):
+    """Resolve the accountId a request names (body field or query arg); the default account when it names none.
+
+    Raises AccountRequired when there is no default either, unless required is False,
+    in which case None is returned for the caller to check per command.
+    """
+    if value in (None, "", b""):
+        if currentAccountId is None and required:
+            raise AccountRequired()
+        return currentAccountId
+    accountId = int(value)
+    if accountId not in authorizedAccounts:
+        raise AccountNotAuthorized(accountId)
+    return accountId
+
+def queryAccount(request, required=True):
+    return accountFor(request.args.get(b"accountId", [b""])[0], required)
 
 def setAccount(accountId):
+    """Make accountId the default account, authorizing it on the session first if needed."""
     global currentAccountId
     currentAccountId = int(accountId)
-    if accountId not in authorizedAccounts:
-        return sendProtoOAAccountAuthReq(accountId)
+    if currentAccountId not in authorizedAccounts:
+        return sendProtoOAAccountAuthReq(currentAccountId)
     logger.info("Account already authorized")
     return "Account changed successfully"
 
 def sendProtoOAVersionReq(clientMsgId=None):
     request = ProtoOAVersionReq()
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
 def sendProtoOAGetAccountListByAccessTokenReq(clientMsgId=None):
     request = ProtoOAGetAccountListByAccessTokenReq()
-    request.accessToken = token
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.accessToken = tokens.accessToken
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAccountLogoutReq(clientMsgId=None):
+def sendProtoOAAccountLogoutReq(accountId, clientMsgId=None):
     request = ProtoOAAccountLogoutReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAccountAuthReq(clientMsgId=None):
+def authorizeOn(session, accountId, clientMsgId=None):
     request = ProtoOAAccountAuthReq()
-    request.ctidTraderAccountId = currentAccountId
-    request.accessToken = token
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    request.accessToken = tokens.accessToken
+    return session.send(request, clientMsgId)
+
+def sendProtoOAAccountAuthReq(accountId, clientMsgId=None):
+    """Authorize an account on every session it is pinned to; fires with the primary session's response."""
+    primary, *others = pool.sessionsFor(accountId)
+    for session in others:
+        authorizeOn(session, accountId).addErrback(logFailure)
+    deferred = authorizeOn(primary, accountId, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAssetListReq(clientMsgId=None):
+def sendProtoOAAssetListReq(accountId, clientMsgId=None):
     request = ProtoOAAssetListReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAssetClassListReq(clientMsgId=None):
+def sendProtoOAAssetClassListReq(accountId, clientMsgId=None):
     request = ProtoOAAssetClassListReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOASymbolCategoryListReq(clientMsgId=None):
+def sendProtoOASymbolCategoryListReq(accountId, clientMsgId=None):
     request = ProtoOASymbolCategoryListReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOASymbolsListReq(includeArchivedSymbols=False, clientMsgId=None):
+def sendProtoOASymbolsListReq(accountId, includeArchivedSymbols=False, clientMsgId=None):
     request = ProtoOASymbolsListReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.includeArchivedSymbols = includeArchivedSymbols if type(includeArchivedSymbols) is bool else bool(includeArchivedSymbols)
-    deferred = client.send(request)
+    deferred = sendRequest(request, clientMsgId)
+    deferred.addErrback(onError)
+    return deferred
+
+def sendProtoOASymbolByIdReq(accountId, symbolId, clientMsgId=None):
+    request = ProtoOASymbolByIdReq()
+    request.ctidTraderAccountId = int(accountId)
+    request.symbolId.append(int(symbolId))
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOATraderReq(clientMsgId=None):
+def sendProtoOATraderReq(accountId, clientMsgId=None):
     request = ProtoOATraderReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAUnsubscribeSpotsReq(symbolId, clientMsgId=None):
+def sendProtoOASubscribeSpotsReq(accountId, symbolId, clientMsgId=None):
+    request = ProtoOASubscribeSpotsReq()
+    request.ctidTraderAccountId = int(accountId)
+    request.symbolId.append(int(symbolId))
+    deferred = sendRequest(request, clientMsgId)
+    deferred.addErrback(onError)
+    return deferred
+
+def sendProtoOAUnsubscribeSpotsReq(accountId, symbolId, clientMsgId=None):
     request = ProtoOAUnsubscribeSpotsReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.symbolId.append(int(symbolId))
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAReconcileReq(clientMsgId=None):
+def sendProtoOAReconcileReq(accountId, clientMsgId=None):
     request = ProtoOAReconcileReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAGetTrendbarsReq(fromTimestamp, toTimestamp, period, symbolId, clientMsgId=None):
+def sendProtoOAGetTrendbarsReq(accountId, fromTimestamp, toTimestamp, period, symbolId, clientMsgId=None):
     request = ProtoOAGetTrendbarsReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.period = ProtoOATrendbarPeriod.Value(period)
     request.fromTimestamp = int(fromTimestamp)
     request.toTimestamp = int(toTimestamp)
     request.symbolId = int(symbolId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAGetTickDataReq(seconds, quoteType, symbolId, clientMsgId=None):
+def sendProtoOAGetTickDataReq(accountId, seconds, quoteType, symbolId, clientMsgId=None):
     request = ProtoOAGetTickDataReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.type = ProtoOAQuoteType.Value(quoteType.upper())
     request.fromTimestamp = int(calendar.timegm((datetime.datetime.utcnow() - datetime.timedelta(seconds=int(seconds))).utctimetuple())) * 1000
     request.toTimestamp = int(calendar.timegm(datetime.datetime.utcnow().utctimetuple())) * 1000
     request.symbolId = int(symbolId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
+    deferred.addErrback(onError)
+    return deferred
+
+def sendProtoOAGetTickDataRangeReq(accountId, fromTimestamp, toTimestamp, quoteType, symbolId, clientMsgId=None):
+    request = ProtoOAGetTickDataReq()
+    request.ctidTraderAccountId = int(accountId)
+    request.type = ProtoOAQuoteType.Value(quoteType.upper())
+    request.fromTimestamp = int(fromTimestamp)
+    request.toTimestamp = int(toTimestamp)
+    request.symbolId = int(symbolId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOANewOrderReq(symbolId, orderType, tradeSide, volume, price=None, comment=None, relativeStopLoss=None, relativeTakeProfit=None, clientMsgId=None):
+def sendProtoOANewOrderReq(accountId, symbolId, orderType, tradeSide, volume, price=None, comment=None, relativeStopLoss=None, relativeTakeProfit=None, clientMsgId=None):
     request = ProtoOANewOrderReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.symbolId = int(symbolId)
     request.orderType = ProtoOAOrderType.Value(orderType.upper())
     request.tradeSide = ProtoOATradeSide.Value(tradeSide.upper())
@@ -267,100 +641,100 @@ def sendProtoOANewOrderReq(symbolId, orderType, tradeSide, volume, price=None, c
             request.relativeStopLoss = int(relativeStopLoss)
         if relativeTakeProfit not in (None, ""):
             request.relativeTakeProfit = int(relativeTakeProfit)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendNewMarketOrder(symbolId, tradeSide, volume, comment, relativeStopLoss=None, relativeTakeProfit=None, clientMsgId=None):
-    return sendProtoOANewOrderReq(symbolId, "MARKET", tradeSide, volume, None, comment, relativeStopLoss, relativeTakeProfit, clientMsgId)
+def sendNewMarketOrder(accountId, symbolId, tradeSide, volume, comment, relativeStopLoss=None, relativeTakeProfit=None, clientMsgId=None):
+    return sendProtoOANewOrderReq(accountId, symbolId, "MARKET", tradeSide, volume, None, comment, relativeStopLoss, relativeTakeProfit, clientMsgId)
 
-def sendNewLimitOrder(symbolId, tradeSide, volume, price, clientMsgId=None):
-    return sendProtoOANewOrderReq(symbolId, "LIMIT", tradeSide, volume, price, None, None, None, clientMsgId)
+def sendNewLimitOrder(accountId, symbolId, tradeSide, volume, price, clientMsgId=None):
+    return sendProtoOANewOrderReq(accountId, symbolId, "LIMIT", tradeSide, volume, price, None, None, None, clientMsgId)
 
-def sendNewStopOrder(symbolId, tradeSide, volume, price, clientMsgId=None):
-    return sendProtoOANewOrderReq(symbolId, "STOP", tradeSide, volume, price, None, None, None, clientMsgId)
+def sendNewStopOrder(accountId, symbolId, tradeSide, volume, price, clientMsgId=None):
+    return sendProtoOANewOrderReq(accountId, symbolId, "STOP", tradeSide, volume, price, None, None, None, clientMsgId)
 
-def sendProtoOAClosePositionReq(positionId, volume, clientMsgId=None):
+def sendProtoOAClosePositionReq(accountId, positionId, volume, clientMsgId=None):
     request = ProtoOAClosePositionReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.positionId = int(positionId)
     request.volume = int(float(volume))  # volume in units
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOACancelOrderReq(orderId, clientMsgId=None):
+def sendProtoOACancelOrderReq(accountId, orderId, clientMsgId=None):
     request = ProtoOACancelOrderReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.orderId = int(orderId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOADealOffsetListReq(dealId, clientMsgId=None):
+def sendProtoOADealOffsetListReq(accountId, dealId, clientMsgId=None):
     request = ProtoOADealOffsetListReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.dealId = int(dealId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAGetPositionUnrealizedPnLReq(clientMsgId=None):
+def sendProtoOAGetPositionUnrealizedPnLReq(accountId, clientMsgId=None):
     request = ProtoOAGetPositionUnrealizedPnLReq()
-    request.ctidTraderAccountId = currentAccountId
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    request.ctidTraderAccountId = int(accountId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAOrderDetailsReq(orderId, clientMsgId=None):
+def sendProtoOAOrderDetailsReq(accountId, orderId, clientMsgId=None):
     request = ProtoOAOrderDetailsReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.orderId = int(orderId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAOrderListByPositionIdReq(positionId, fromTimestamp=None, toTimestamp=None, clientMsgId=None):
+def sendProtoOAOrderListByPositionIdReq(accountId, positionId, fromTimestamp=None, toTimestamp=None, clientMsgId=None):
     request = ProtoOAOrderListByPositionIdReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.positionId = int(positionId)
     if fromTimestamp is not None:
         request.fromTimestamp = int(fromTimestamp)
     if toTimestamp is not None:
         request.toTimestamp = int(toTimestamp)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOADealListReq(fromTimestamp, toTimestamp, clientMsgId=None):
+def sendProtoOADealListReq(accountId, fromTimestamp, toTimestamp, clientMsgId=None):
     request = ProtoOADealListReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.fromTimestamp = int(fromTimestamp)
     request.toTimestamp = int(toTimestamp)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOADealListByPositionIdReq(positionId, clientMsgId=None):
+def sendProtoOADealListByPositionIdReq(accountId, positionId, clientMsgId=None):
     request = ProtoOADealListByPositionIdReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.positionId = int(positionId)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAOrderListReq(fromTimestamp, toTimestamp, clientMsgId=None):
+def sendProtoOAOrderListReq(accountId, fromTimestamp, toTimestamp, clientMsgId=None):
     request = ProtoOAOrderListReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.fromTimestamp = int(fromTimestamp)
     request.toTimestamp = int(toTimestamp)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAmendPositionSLTPReq(positionId, stopLoss=None, takeProfit=None, trailingStopLoss=None, clientMsgId=None):
+def sendProtoOAAmendPositionSLTPReq(accountId, positionId, stopLoss=None, takeProfit=None, trailingStopLoss=None, clientMsgId=None):
     request = ProtoOAAmendPositionSLTPReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.positionId = int(positionId)
     if stopLoss not in (None, ""):
         request.stopLoss = float(stopLoss)
@@ -368,13 +742,13 @@ def sendProtoOAAmendPositionSLTPReq(positionId, stopLoss=None, takeProfit=None,
         request.takeProfit = float(takeProfit)
     if trailingStopLoss not in (None, ""):
         request.trailingStopLoss = bool(trailingStopLoss)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAAmendOrderReq(orderId, volume=None, limitPrice=None, stopPrice=None, clientMsgId=None):
+def sendProtoOAAmendOrderReq(accountId, orderId, volume=None, limitPrice=None, stopPrice=None, clientMsgId=None):
     request = ProtoOAAmendOrderReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.orderId = int(orderId)
     if volume not in (None, ""):
         request.volume = int(float(volume))
@@ -382,16 +756,16 @@ def sendProtoOAAmendOrderReq(orderId, volume=None, limitPrice=None, stopPrice=No
         request.limitPrice = float(limitPrice)
     if stopPrice not in (None, ""):
         request.stopPrice = float(stopPrice)
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
-def sendProtoOAExpectedMarginReq(symbolId, volume, clientMsgId=None):
+def sendProtoOAExpectedMarginReq(accountId, symbolId, volume, clientMsgId=None):
     request = ProtoOAExpectedMarginReq()
-    request.ctidTraderAccountId = currentAccountId
+    request.ctidTraderAccountId = int(accountId)
     request.symbolId = int(symbolId)
     request.volume.append(int(volume))
-    deferred = client.send(request, clientMsgId=clientMsgId)
+    deferred = sendRequest(request, clientMsgId)
     deferred.addErrback(onError)
     return deferred
 
@@ -422,13 +796,301 @@ commands = {
     "ProtoOAExpectedMarginReq": sendProtoOAExpectedMarginReq,
 }
 
+# Commands that do not act on an account; every other command is called with the accountId first
+ACCOUNTLESS_COMMANDS = {"setAccount", "ProtoOAVersionReq", "ProtoOAGetAccountListByAccessTokenReq"}
+
+# Commands with no side effects; identical concurrent calls of these share one upstream request
+READ_ONLY_COMMANDS = {
+    "ProtoOAVersionReq", "ProtoOAGetAccountListByAccessTokenReq", "ProtoOAAssetListReq",
+    "ProtoOAAssetClassListReq", "ProtoOASymbolCategoryListReq", "ProtoOASymbolsListReq",
+    "ProtoOATraderReq", "ProtoOAReconcileReq", "ProtoOAGetTrendbarsReq", "ProtoOAGetTickDataReq",
+    "DealOffsetList", "GetPositionUnrealizedPnL", "OrderDetails", "OrderListByPositionId",
+    "ProtoOADealListReq", "DealListByPositionId", "ProtoOAOrderListReq", "ProtoOAExpectedMarginReq",
+}
+
+singleFlight = SingleFlight()
+
+def coalesced(name, fn):
+    """Wrap fn so identical concurrent calls (same name and arguments, accountId included) share one upstream request."""
+    def call(*args):
+        key = (name, tuple(str(arg).strip() for arg in args))
+        return singleFlight.run(key, fn, *args)
+    return call
+
+def encodeResponse(result, fmt=serializer.FORMAT_JSON):
+    """Encode a ProtoMessage, str, None or cached CatalogueEntry as (body, content type)."""
+    if isinstance(result, CatalogueEntry):
+        return result.encoded(fmt)
+    return serializer.encode(result, fmt)
+
 def encodeResult(result):
-    if result is None:
-        return b'{}'
-    if type(result) is str:
-        return f'{{"result": "{result}"}}'.encode(encoding='UTF-8')
+    return encodeResponse(result)[0]
+
+def responseEncoder(request):
+    """Return a callback encoding results in the format asked for by the request's Accept header."""
+    fmt = serializer.negotiate(request.getHeader(b'accept'))
+
+    def encode(result):
+        body, contentType = encodeResponse(result, fmt)
+        request.setHeader('Content-Type', contentType)
+        return body
+    return encode
+
+catalogue = SymbolCatalogue(CATALOGUE_CACHE_TTL)
+symbolSpecs = SymbolSpecs(coalesced("ProtoOASymbolByIdReq", sendProtoOASymbolByIdReq))
+
+@dispatcher.on(ProtoOASymbolChangedEvent)
+def onSymbolChanged(session, pb, message):
+    if pool.primary(pb.ctidTraderAccountId) is not session:
+        return  # the same event also arrives on the account's historical session
+    logger.info(f"Symbols {list(pb.symbolId)} changed on account {pb.ctidTraderAccountId}")
+    symbolSpecs.invalidate(pb.ctidTraderAccountId, set(pb.symbolId))
+    catalogue.invalidate(pb.ctidTraderAccountId)
+
+def withSymbolSpec(accountId, symbolId, send):
+    """Call send(spec) with the symbol's cached specification; fires with its result, or with the error loading the spec.
+
+    send validates and normalizes before anything goes upstream, so an InvalidOrder it
+    raises is answered without a round trip to cTrader.
+    """
+    def proceed(spec):
+        if not isinstance(spec, ProtoOASymbol):
+            return spec
+        return send(spec)
+    result = symbolSpecs.get(accountId, symbolId)
+    result.addCallback(carryDeadline(proceed))
+    return result
+
+barStore = BarStore(BAR_STORE_PATH, TRENDBAR_MAX_BARS) if BAR_STORE_PATH else None
+historyStore = HistoryStore(HISTORY_STORE_PATH) if HISTORY_STORE_PATH else None
+
+HISTORY_LOADERS = {DEALS: sendProtoOADealListReq, ORDERS: sendProtoOAOrderListReq}
+
+def syncHistory(accountId):
+    """Bring an account's stored deals and orders up to date; fires with {kind: items stored}.
+
+    Concurrent calls for the same account share one sync.
+    """
+    def run(accountId):
+        since = int(time.time() * 1000) - HISTORY_BACKFILL_DAYS * 86400000
+        syncs = [historyStore.sync(accountId, kind, carryDeadline(lambda start, end, load=load: load(accountId, start, end)), since)
+                 for kind, load in HISTORY_LOADERS.items()]
+        result = defer.gatherResults(syncs, consumeErrors=True)
+        result.addCallbacks(summarize, unwrapFirstError)
+        return result
+
+    def summarize(results):
+        for result in results:
+            if not isinstance(result, int):
+                return result  # the upstream error of the first kind that failed
+        counts = dict(zip(HISTORY_LOADERS, results))
+        logger.info(f"History of account {accountId} synced: {counts['deals']} new deals, {counts['orders']} new orders")
+        return counts
+
+    return singleFlight.run(('syncHistory', int(accountId)), run, int(accountId))
+
+def syncAllHistory():
+    for accountId in sorted(authorizedAccounts):
+        syncHistory(accountId).addErrback(logFailure)
+
+def recordHistory(session, pb, message):
+    """Top the history store up from execution events between syncs."""
+    if pool.primary(pb.ctidTraderAccountId) is not session:
+        return
+    if pb.HasField('deal'):
+        historyStore.save(pb.ctidTraderAccountId, DEALS, [pb.deal])
+    if pb.HasField('order'):
+        historyStore.save(pb.ctidTraderAccountId, ORDERS, [pb.order])
+
+if historyStore is not None and not PROXY_WORKER:  # the broker keeps the shared store up to date
+    dispatcher.on(ProtoOAExecutionEvent, recordHistory)
+
+trendbarLimiter = defer.DeferredSemaphore(TRENDBAR_CONCURRENCY)
+
+quoteBook = QuoteBook(sendProtoOASubscribeSpotsReq, sendProtoOAUnsubscribeSpotsReq)
+dispatcher.on(ProtoOASpotEvent, lambda session, spot, message: quoteBook.onSpot(spot))
+
+SSE_KEEPALIVE_INTERVAL = 15  # seconds between comment lines on idle quote streams
+
+def fetchTrendbarChunk(accountId, fromTimestamp, toTimestamp, period, symbolId):
+    """Get one request-sized window of trendbars through the local bar store when enabled."""
+    loader = lambda start, end: trendbarLimiter.run(carryDeadline(sendProtoOAGetTrendbarsReq), accountId, start, end, period, symbolId)
+    if barStore is None:
+        return loader(fromTimestamp, toTimestamp)
+    return barStore.fetch(fromTimestamp, toTimestamp, period, symbolId, accountId, loader)
+
+def fetchTrendbarChunks(accountId, fromTimestamp, toTimestamp, period, symbolId):
+    """Split a window into request-sized chunks and start them all; returns one Deferred per chunk, in time order."""
+    chunks = chunkRange(fromTimestamp, toTimestamp, period, TRENDBAR_MAX_BARS)
+    return [fetchTrendbarChunk(accountId, start, end, period, symbolId) for start, end in chunks]
+
+def fetchTrendbars(accountId, fromTimestamp, toTimestamp, period, symbolId):
+    """Get trendbars for any window as one merged, ordered ProtoOAGetTrendbarsRes."""
+    result = defer.gatherResults(fetchTrendbarChunks(accountId, fromTimestamp, toTimestamp, period, symbolId), consumeErrors=True)
+    result.addCallbacks(mergeTrendbars, unwrapFirstError)
+    return result
+
+def fetchColumnarTrendbars(accountId, fromTimestamp, toTimestamp, period, symbolId):
+    """Get trendbars for any window decoded into real-price columns, plus the symbol's digits.
+
+    Fires with (digits, columns), or with the upstream error response when either the
+    symbol or the bars could not be loaded.
+    """
+    spec = symbolSpecs.get(accountId, symbolId)
+    bars = coalesced('trendbars', fetchTrendbars)(accountId, fromTimestamp, toTimestamp, period, symbolId)
+
+    def decode(results):
+        spec, response = results
+        if not isinstance(spec, ProtoOASymbol):
+            return spec
+        if response is None or response.payloadType == ProtoOAErrorRes().payloadType:
+            return response
+        return spec.digits, decodeTrendbars(response, spec.digits)
+
+    result = defer.gatherResults([spec, bars], consumeErrors=True)
+    result.addCallbacks(decode, unwrapFirstError)
+    return result
+
+def columnarEncoder(request, fmt):
+    """Return a callback encoding (digits, columns) as columnar JSON/msgpack or a binary payload."""
+    encode = responseEncoder(request)
+
+    def encodeBars(result):
+        if type(result) is not tuple:
+            return encode(result)
+        digits, columns = result
+        if fmt == "columnar":
+            obj = {name: columnList(column) for name, column in columns.items()}
+            obj["digits"] = digits
+            body, contentType = serializer.encodeObject(obj, serializer.negotiate(request.getHeader(b'accept')))
+        else:
+            body, contentType = encodeColumns(columns, fmt)
+        request.setHeader('Content-Type', contentType)
+        return body
+    return encodeBars
+
+def fetchIndicators(accountId, fromTimestamp, toTimestamp, period, symbolId, indicators, bars=False):
+    """Get indicator series over bars of any period, resampled from the nearest cTrader period.
+
+    Bars before fromTimestamp are loaded as warm-up so the series are settled at the
+    start of the window. Fires with (digits, columns) holding the timestamps, the
+    series named as requested and, with bars, the resampled OHLCV; or with the
+    upstream error.
+    """
+    minutes, source = parsePeriod(period)
+    # weekends and holidays have no bars, so reach back further than the bare warm-up span
+    warmupFrom = int(fromTimestamp) - 2 * warmupBars(indicators) * minutes * 60000
+
+    def derive(result):
+        if type(result) is not tuple:
+            return result
+        digits, columns = result
+        if source != period:
+            columns = resample(columns, minutes)
+        series = computeIndicators(columns, indicators, digits)
+        keep = columns["timestamp"] >= int(fromTimestamp)
+        derived = {"timestamp": columns["timestamp"][keep]}
+        if bars:
+            derived.update((name, column[keep]) for name, column in columns.items() if name != "timestamp")
+        derived.update((name, column[keep]) for name, column in series.items())
+        return digits, derived
+
+    result = fetchColumnarTrendbars(accountId, str(max(0, warmupFrom)), str(toTimestamp), source, symbolId)
+    result.addCallback(derive)
+    return result
+
+def streamTrendbars(request, deferreds):
+    """Write each chunk's response as one JSON line, in time order, as soon as it and its predecessors are ready.
+
+    Returns a Deferred firing once the last chunk is written, after which Klein finishes the request.
+    """
+    request.setHeader('Content-Type', 'application/x-ndjson')
+
+    def writeChunk(msg):
+        if msg is not None:
+            request.write(serializer.dumps(serializer.toDict(Protobuf.extract(msg))) + b'\n')
+
+    def on_error(failure):
+        request.write(json.dumps({'error': str(failure)}).encode('utf-8') + b'\n')
+
+    chain = defer.succeed(None)
+    for deferred in deferreds:
+        chain.addCallback(lambda _, d=deferred: d)
+        chain.addCallback(writeChunk)
+    chain.addErrback(on_error)
+    return chain
+
+def streamTickHistory(request, accountId, fromTimestamp, toTimestamp, quoteType, symbolId):
+    """Follow hasMore pages through the window, writing each decoded page as one JSON line, newest first.
+
+    Pages are requested one after another through the historical lane, so only one
+    page is held in memory at a time. Paging stops when the client disconnects.
+    """
+    pager = TickPager(fromTimestamp, toTimestamp)
+    request.setHeader('Content-Type', 'application/x-ndjson')
+
+    def nextPage(_=None):
+        if pager.done:
+            logger.info(f"Tick history {symbolId}: {pager.ticks} ticks in {pager.pages} pages")
+            return None
+        page = sendProtoOAGetTickDataRangeReq(accountId, pager.fromTs, pager.toTs, quoteType, symbolId)
+        page.addCallback(carryDeadline(writePage))
+        return page
+
+    def writePage(msg):
+        if result.called:
+            return None  # cancelled by a client disconnect
+        if msg is None or msg.payloadType != ProtoOAGetTickDataRes().payloadType:
+            request.write(encodeResult(msg) + b'\n')
+            return None
+        timestamps, prices = pager.feed(Protobuf.extract(msg))
+        if len(timestamps):
+            request.write(serializer.dumps({'timestamp': timestamps.tolist(), 'price': prices.tolist()}) + b'\n')
+        return nextPage()
+
+    def on_error(failure):
+        if not failure.check(defer.CancelledError):
+            request.write(json.dumps({'error': str(failure.value)}).encode('utf-8') + b'\n')
+
+    result = defer.Deferred()
+    defer.maybeDeferred(nextPage).chainDeferred(result)
+    result.addErrback(on_error)
+    return result
+
+@app.handle_errors(ProxyError)
+def proxyErrorResponse(request, failure):
+    """Turn a ProxyError raised anywhere in a route into its HTTP status, headers and a JSON error body."""
+    error = failure.value
+    request.setResponseCode(error.status)
+    for name, value in error.headers().items():
+        request.setHeader(name, value)
+    request.setHeader('Content-Type', 'application/json')
+    return json.dumps({'error': str(error)}).encode('utf-8')
+
+def runCommand(commandSplit, accountId, encode=encodeResult):
+    """Dispatch one split /get-data command for accountId; returns the encoded body or a Deferred firing with it."""
+    if (commandSplit[0] not in commands):
+        return encode(f"Invalid Command: {commandSplit[0]}")
+    parameters = commandSplit[1:]
+    if accountId is None and commandSplit[0] not in ACCOUNTLESS_COMMANDS:
+        raise AccountRequired()
+    if commandSplit[0] == "ProtoOAReconcileReq" and executionState.isSeeded(accountId):
+        return encode(executionState.snapshot(accountId))
+    if commandSplit[0] in CATALOGUE_COMMANDS:
+        loader = coalesced(commandSplit[0], commands[commandSplit[0]])
+        result = catalogue.fetch(commandSplit[0], accountId, loader, *parameters)
+        result.addCallback(encode)
+        return result
+    if commandSplit[0] not in ACCOUNTLESS_COMMANDS:
+        parameters = [accountId] + parameters
+    if commandSplit[0] in READ_ONLY_COMMANDS:
+        result = coalesced(commandSplit[0], commands[commandSplit[0]])(*parameters)
     else:
-        return MessageToJson(Protobuf.extract(result)).encode(encoding='UTF-8')
+        result = commands[commandSplit[0]](*parameters)
+    if type(result) is str:
+        return encode(result)
+    result.addCallback(encode)
+    return result
 
 @app.route('/get-data')
 def getData(request):
@@ -437,12 +1099,56 @@ def getData(request):
     if (command is None or command == b""):
         return encodeResult(f"Invalid Command: {command}")
     commandSplit = command.decode('UTF-8').split(" ")
+    try:
+        accountId = queryAccount(request, required=False)  # accountless commands run without one
+    except ValueError:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'accountId must be an integer'}).encode('utf-8')
     logger.info(f"Command: {commandSplit}")
-    if (commandSplit[0] not in commands):
-        return encodeResult(f"Invalid Command: {commandSplit[0]}")
-    parameters = commandSplit[1:]
-    result = commands[commandSplit[0]](*parameters)
-    result.addCallback(encodeResult)
+    return runCommand(commandSplit, accountId, responseEncoder(request))
+
+BATCH_MAX_COMMANDS = 50
+
+@app.route('/api/batch', methods=['POST'])
+def http_batch(request):
+    """Run many /get-data commands concurrently and return every result in one response."""
+    body = request.content.read().decode('utf-8')
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    try:
+        data = json.loads(body)
+        commandList = data['commands']
+        if type(commandList) is not list or not all(type(c) is str and c for c in commandList):
+            raise ValueError
+        accountId = accountFor(data.get('accountId'), required=False)  # checked per command
+    except (ValueError, KeyError, TypeError):
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected { commands: ["COMMAND arg1 arg2", ...], accountId?, stream? }'}).encode('utf-8')
+    if len(commandList) > BATCH_MAX_COMMANDS:
+        request.setResponseCode(400)
+        return json.dumps({'error': f'at most {BATCH_MAX_COMMANDS} commands per batch'}).encode('utf-8')
+    logger.info(f"Batch: {commandList}")
+
+    def item(result, index, command):
+        head = f'{{"index": {index}, "command": {json.dumps(command)}, '.encode('utf-8')
+        if isinstance(result, bytes):
+            return head + b'"result": ' + result + b'}'
+        error = result.value
+        status = error.status if isinstance(error, ProxyError) else 500
+        return head + f'"status": {status}, "error": {json.dumps(result.getErrorMessage())}}}'.encode('utf-8')
+
+    deferreds = []
+    for index, command in enumerate(commandList):
+        deferred = defer.maybeDeferred(runCommand, command.split(" "), accountId)
+        deferred.addBoth(item, index, command)
+        deferreds.append(deferred)
+
+    if data.get('stream'):
+        request.setHeader('Content-Type', 'application/x-ndjson')
+        for deferred in deferreds:
+            deferred.addCallback(lambda line: request.write(line.replace(b'\n', b'') + b'\n'))
+        return defer.gatherResults(deferreds).addCallback(lambda _: None)
+    result = defer.gatherResults(deferreds)
+    result.addCallback(lambda items: b'{"results": [' + b', '.join(items) + b']}')
     return result
 
 def respond(request, deferred, wrap_key=None):
@@ -453,7 +1159,7 @@ def respond(request, deferred, wrap_key=None):
                 payload = {'result': msg}
             else:
                 pb = Protobuf.extract(msg)
-                obj = json.loads(MessageToJson(pb))
+                obj = serializer.toDict(pb)
                 payload = {wrap_key: obj} if wrap_key else obj
             request.write(json.dumps(payload).encode('utf-8'))
             request.finish()
@@ -468,6 +1174,139 @@ def respond(request, deferred, wrap_key=None):
         return NOT_DONE_YET
     return json.dumps({'result': deferred}).encode('utf-8')
 
+@app.route('/api/symbols')
+def http_symbols(request):
+    """Resolve symbols from the cached catalogue by ?name=, ?id= or ?prefix=."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    name = request.args.get(b"name", [b""])[0].decode('utf-8')
+    symbolId = request.args.get(b"id", [b""])[0].decode('utf-8')
+    prefix = request.args.get(b"prefix", [b""])[0].decode('utf-8')
+    if not (name or symbolId or prefix):
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected one of ?name=, ?id= or ?prefix='}).encode('utf-8')
+
+    def lookup(index):
+        if index is None:
+            request.setResponseCode(502)
+            return json.dumps({'error': 'symbol list unavailable'}).encode('utf-8')
+        if symbolId:
+            matches = index.lookupId(symbolId)
+        elif name:
+            matches = index.lookupName(name)
+        else:
+            matches = index.lookupPrefix(prefix)
+        return json.dumps({'symbol': matches}).encode('utf-8')
+
+    try:
+        int(symbolId or 0)
+        accountId = queryAccount(request)
+    except ValueError:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'id and accountId must be integers'}).encode('utf-8')
+    result = catalogue.symbolIndex(accountId, coalesced("ProtoOASymbolsListReq", sendProtoOASymbolsListReq))
+    result.addCallback(lookup)
+    return result
+
+sessionUp = metrics.gauge('ctrader_proxy_session_up', '1 while a session is connected and application-authorized', ('session', 'role'))
+sessionConnects = metrics.counter('ctrader_proxy_session_connects_total', 'Upstream connections made, reconnects included', ('session',))
+sessionDisconnects = metrics.counter('ctrader_proxy_session_disconnects_total', 'Upstream connections lost', ('session',))
+sessionRecoveries = metrics.counter('ctrader_proxy_session_recoveries_total', 'Reconnects completed with every account re-authorized', ('session',))
+sessionLastRecovery = metrics.gauge('ctrader_proxy_session_last_recovery_seconds', 'Duration of the latest reconnect recovery', ('session',))
+sessionSilence = metrics.gauge('ctrader_proxy_session_seconds_since_message', 'Seconds since the last message from cTrader on a session', ('session',))
+sessionHeld = metrics.gauge('ctrader_proxy_session_held_requests', 'Requests held while a session reconnects', ('session',))
+sessionTimeouts = metrics.counter('ctrader_proxy_session_timeouts_total', 'Requests cancelled at their deadline', ('session',))
+sessionBreakerOpen = metrics.gauge('ctrader_proxy_session_breaker_open', '1 while a session\'s circuit breaker is not closed', ('session',))
+schedulerQueued = metrics.gauge('ctrader_proxy_scheduler_queued', 'Requests waiting for rate budget', ('session', 'lane'))
+schedulerRejected = metrics.counter('ctrader_proxy_scheduler_rejected_total', 'Requests answered 429 because a lane queue was full', ('session', 'lane'))
+
+@metrics.collector
+def collectSessionMetrics():
+    now = time.time()
+    for session in pool.sessions:
+        stats = session.stats()
+        sessionUp.set(int(session.state == 'ready'), session.name, session.role)
+        sessionConnects.set(session.connects, session.name)
+        sessionDisconnects.set(session.disconnects, session.name)
+        sessionRecoveries.set(session.recoveries, session.name)
+        if session.lastRecovery is not None:
+            sessionLastRecovery.set(session.lastRecovery, session.name)
+        if session.lastMessageAt is not None:
+            sessionSilence.set(now - session.lastMessageAt, session.name)
+        sessionHeld.set(stats['held'], session.name)
+        sessionTimeouts.set(session.timeouts, session.name)
+        if session.breaker is not None:
+            sessionBreakerOpen.set(int(session.breaker.state != 'closed'), session.name)
+        for lane, counts in stats['scheduler'].items():
+            schedulerQueued.set(counts['queued'], session.name, lane)
+            schedulerRejected.set(counts['rejected'], session.name, lane)
+
+def proxyRequest(channel, *args):
+    """Site request factory: X-Request-Timeout handling plus HTTP latency and in-flight metrics."""
+    request = DeadlineRequest(channel, *args)
+    httpInFlight.inc()
+    request.notifyFinish().addBoth(observeHttp, request, time.monotonic())
+    return request
+
+def observeHttp(_, request, started):
+    httpInFlight.dec()
+    path = request.path.decode('utf-8', 'replace') if request.path else ''
+    route = path if path in ROUTES else 'other'  # unknown paths share one label to keep the series bounded
+    httpLatency.observe(time.monotonic() - started, route, str(request.code))
+
+def fromBroker(path):
+    """In an HTTP worker, fetch the body the broker serves for an observability route.
+
+    Workers share the port, so each request reaches an arbitrary one; the broker
+    holds the upstream sessions and answers these the same way every time.
+    """
+    return pool.sessions[0].client.fetch(path).addCallback(lambda message: message.payload)
+
+@app.route('/metrics')
+def http_metrics(request):
+    """Latency histograms, in-flight gauges and upstream counters in the Prometheus text format."""
+    request.setHeader('Content-Type', METRICS_CONTENT_TYPE)
+    return fromBroker('/metrics') if PROXY_WORKER else metrics.render()
+
+LOOPBACK_HOSTS = frozenset({'127.0.0.1', '::1', '::ffff:127.0.0.1'})
+
+@app.route('/api/capture')
+def http_capture(request):
+    """Download the in-memory ring of raw upstream traffic as a capture file for tools/replay.py.
+
+    Off unless CAPTURE_HTTP=1, and only answered to clients on the loopback interface.
+    """
+    if not CAPTURE_RING_BYTES or not CAPTURE_HTTP:
+        request.setResponseCode(404)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps({'error': 'capture is off — set CAPTURE_RING_BYTES and CAPTURE_HTTP=1'}).encode('utf-8')
+    if request.getClientAddress().host not in LOOPBACK_HOSTS:
+        request.setResponseCode(403)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps({'error': 'capture is only served to loopback clients'}).encode('utf-8')
+    request.setHeader('Content-Type', 'application/octet-stream')
+    request.setHeader('Content-Disposition', 'attachment; filename="upstream.ctcap"')
+    return fromBroker('/api/capture') if PROXY_WORKER else capture.dump()
+
+@app.route('/api/stats')
+def http_stats(request):
+    """Counters of the proxy's caches and local state."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    return fromBroker('/api/stats') if PROXY_WORKER else statsBody()
+
+def statsBody():
+    return json.dumps({
+        'catalogue': catalogue.stats(),
+        'symbolSpecs': symbolSpecs.stats(),
+        'barStore': barStore.stats() if barStore is not None else None,
+        'historyStore': historyStore.stats() if historyStore is not None else None,
+        'quoteBook': quoteBook.stats(),
+        'executionState': executionState.stats(),
+        'coalescing': singleFlight.stats(),
+        'sessions': pool.stats(),
+        'capture': capture.stats() if capture is not None else None,
+        'token': tokens.stats(),
+    }).encode('utf-8')
+
 @app.route('/api/set-account', methods=['POST'])
 def http_set_account(request):
     body = request.content.read().decode('utf-8')
@@ -476,7 +1315,7 @@ def http_set_account(request):
         data = json.loads(body) if body.strip() else {}
     except ValueError:
         data = {}
-    acct = str(data.get('accountId') or CTRADER_ACCOUNTID or '')
+    acct = str(data.get('accountId') or (CTRADER_ACCOUNTIDS[0] if CTRADER_ACCOUNTIDS else ''))
     if not acct:
         request.setResponseCode(400)
         return json.dumps({'error': 'No accountId in request body and CTRADER_ACCOUNTID not set in .env'}).encode('utf-8')
@@ -495,14 +1334,47 @@ def http_trendbars(request):
         toTimestamp = str(data['toTimestamp'])
         period = str(data['period'])
         symbolId = str(data['symbolId'])
-        result = sendProtoOAGetTrendbarsReq(fromTimestamp, toTimestamp, period, symbolId)
-        result.addCallback(encodeResult)
+        accountId = accountFor(data.get('accountId'))
+        fmt = data.get('format')
+        if fmt is not None:
+            if fmt not in COLUMNAR_FORMATS:
+                raise ValueError(fmt)
+            result = fetchColumnarTrendbars(accountId, fromTimestamp, toTimestamp, period, symbolId)
+            result.addCallback(columnarEncoder(request, fmt))
+            return result
+        if data.get('stream'):
+            return streamTrendbars(request, fetchTrendbarChunks(accountId, fromTimestamp, toTimestamp, period, symbolId))
+        result = coalesced('trendbars', fetchTrendbars)(accountId, fromTimestamp, toTimestamp, period, symbolId)
+        result.addCallback(responseEncoder(request))
         if type(result) is str:
             result = encodeResult(result)
         return result
     except (ValueError, KeyError):
         request.setResponseCode(400)
-        return json.dumps({'error': 'expected { fromTimestamp, toTimestamp, period, symbolId }'}).encode('utf-8')
+        return json.dumps({'error': 'expected { fromTimestamp, toTimestamp, period, symbolId, accountId?, format? }',
+                           'formats': list(COLUMNAR_FORMATS)}).encode('utf-8')
+
+@app.route('/api/indicators', methods=['POST'])
+def http_indicators(request):
+    body = request.content.read().decode('utf-8')
+    try:
+        data = json.loads(body)
+        fromTimestamp = int(data['fromTimestamp'])
+        toTimestamp = int(data['toTimestamp'])
+        period = str(data['period'])
+        symbolId = str(data['symbolId'])
+        indicators = parseIndicators(data['indicators'])
+        accountId = accountFor(data.get('accountId'))
+        fmt = data.get('format', 'columnar')
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(fmt)
+        result = fetchIndicators(accountId, fromTimestamp, toTimestamp, period, symbolId, indicators, bool(data.get('bars')))
+        result.addCallback(columnarEncoder(request, fmt))
+        return result
+    except (ValueError, KeyError, TypeError) as e:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected { fromTimestamp, toTimestamp, period, symbolId, indicators, bars?, accountId?, format? }',
+                           'detail': str(e), 'formats': list(COLUMNAR_FORMATS)}).encode('utf-8')
 
 @app.route('/api/live-quote', methods=['POST'])
 def http_live_quote(request):
@@ -512,8 +1384,9 @@ def http_live_quote(request):
         quoteType = str(data['quoteType'])
         symbolId = str(data['symbolId'])
         timeDeltaInSeconds = int(data['timeDeltaInSeconds'])
-        result = sendProtoOAGetTickDataReq(timeDeltaInSeconds, quoteType, symbolId)
-        result.addCallback(encodeResult)
+        accountId = accountFor(data.get('accountId'))
+        result = coalesced('ProtoOAGetTickDataReq', sendProtoOAGetTickDataReq)(accountId, timeDeltaInSeconds, quoteType, symbolId)
+        result.addCallback(responseEncoder(request))
         if type(result) is str:
             result = encodeResult(result)
         return result
@@ -521,6 +1394,177 @@ def http_live_quote(request):
         request.setResponseCode(400)
         return json.dumps({'error': 'unexpected input/output'}).encode('utf-8')
 
+@app.route('/api/tick-history', methods=['POST'])
+def http_tick_history(request):
+    """Stream every tick between two timestamps as NDJSON pages of decoded timestamps and prices."""
+    body = request.content.read().decode('utf-8')
+    try:
+        data = json.loads(body)
+        fromTimestamp = int(data['fromTimestamp'])
+        toTimestamp = int(data['toTimestamp'])
+        quoteType = str(data['quoteType'])
+        symbolId = int(data['symbolId'])
+        ProtoOAQuoteType.Value(quoteType.upper())
+        accountId = accountFor(data.get('accountId'))
+    except (ValueError, KeyError):
+        request.setResponseCode(400)
+        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+        return json.dumps({'error': 'expected { fromTimestamp, toTimestamp, quoteType: BID|ASK, symbolId, accountId? }'}).encode('utf-8')
+    return streamTickHistory(request, accountId, fromTimestamp, toTimestamp, quoteType, symbolId)
+
+@app.route('/api/subscribe', methods=['POST'])
+def http_subscribe(request):
+    """Hold a spot subscription so /api/quote can answer from the local quote book."""
+    body = request.content.read().decode('utf-8')
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    try:
+        data = json.loads(body)
+        symbolId = int(data['symbolId'])
+        accountId = accountFor(data.get('accountId'))
+    except (ValueError, KeyError):
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected { symbolId, accountId? }'}).encode('utf-8')
+    result = quoteBook.acquire(accountId, symbolId)
+    result.addCallback(lambda msg: encodeResult(msg if msg is not None else "Already subscribed"))
+    return result
+
+@app.route('/api/unsubscribe', methods=['POST'])
+def http_unsubscribe(request):
+    """Release a spot subscription taken with /api/subscribe."""
+    body = request.content.read().decode('utf-8')
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    try:
+        data = json.loads(body)
+        symbolId = int(data['symbolId'])
+        accountId = accountFor(data.get('accountId'))
+    except (ValueError, KeyError):
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected { symbolId, accountId? }'}).encode('utf-8')
+    result = quoteBook.release(accountId, symbolId)
+    result.addCallback(lambda msg: encodeResult(msg if msg is not None else "Still subscribed by other consumers"))
+    return result
+
+@app.route('/api/quote')
+def http_quote(request):
+    """Return the last bid/ask for a subscribed symbol from the local quote book."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    try:
+        symbolId = int(request.args.get(b"symbolId", [b""])[0])
+        accountId = queryAccount(request)
+    except ValueError:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected ?symbolId=&accountId='}).encode('utf-8')
+    quote = quoteBook.get(accountId, symbolId)
+    if quote is None:
+        request.setResponseCode(404)
+        return json.dumps({'error': f'No quote for symbol {symbolId} — subscribe first via /api/subscribe'}).encode('utf-8')
+    return json.dumps(quote).encode('utf-8')
+
+@app.route('/api/quote-stream')
+def http_quote_stream(request):
+    """Stream quotes for ?symbolId=1,2,... as Server-Sent Events, sharing one upstream subscription per symbol."""
+    try:
+        symbolIds = [int(s) for arg in request.args.get(b"symbolId", []) for s in arg.split(b",") if s]
+        accountId = queryAccount(request)
+    except ValueError:
+        symbolIds = []
+    if not symbolIds:
+        request.setResponseCode(400)
+        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+        return json.dumps({'error': 'expected ?symbolId=1,2,...&accountId='}).encode('utf-8')
+    request.setHeader('Content-Type', 'text/event-stream')
+    request.setHeader('Cache-Control', 'no-cache')
+
+    def send(body):
+        request.write(b"data: " + body + b"\n\n")
+
+    keepalive = task.LoopingCall(request.write, b": keepalive\n\n")
+    for symbolId in symbolIds:
+        quoteBook.acquire(accountId, symbolId).addErrback(logFailure)
+        quoteBook.listen(accountId, symbolId, send)
+        quote = quoteBook.get(accountId, symbolId)
+        if quote is not None:
+            send(json.dumps(quote).encode('utf-8'))
+    keepalive.start(SSE_KEEPALIVE_INTERVAL, now=False)
+
+    def cleanup(_):
+        keepalive.stop()
+        for symbolId in symbolIds:
+            quoteBook.unlisten(accountId, symbolId, send)
+            quoteBook.release(accountId, symbolId).addErrback(logFailure)
+
+    # Never fires on its own; Klein cancels it when the client disconnects
+    return defer.Deferred(cleanup)
+
+def executionQuery(request, kind):
+    """Answer a positions/orders read from the local execution state, seeding it first if needed."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    symbolId = request.args.get(b"symbolId", [b""])[0].decode('utf-8')
+    side = request.args.get(b"side", [b""])[0].decode('utf-8').upper()
+    try:
+        symbolId = int(symbolId) if symbolId else None
+        ProtoOATradeSide.Value(side) if side else None
+        accountId = queryAccount(request)
+    except ValueError:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected ?symbolId=<int>&side=BUY|SELL&accountId=<int> (all optional)'}).encode('utf-8')
+
+    def answer(_=None):
+        if not executionState.isSeeded(accountId):
+            request.setResponseCode(502)
+            return json.dumps({'error': 'could not load positions and orders from cTrader'}).encode('utf-8')
+        return json.dumps({kind: executionState.query(accountId, kind, symbolId, side)}).encode('utf-8')
+
+    if executionState.isSeeded(accountId):
+        return answer()
+    return seedExecutionState(accountId).addCallback(answer)
+
+def historyQuery(request, kind):
+    """Answer a deals/orders read from the local history store; ?sync=true syncs the account with cTrader first."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    if historyStore is None:
+        request.setResponseCode(404)
+        return json.dumps({'error': 'history store is off — set HISTORY_STORE_PATH'}).encode('utf-8')
+    args = {name: request.args.get(name.encode(), [b""])[0].decode('utf-8') for name in ('from', 'to', 'positionId', 'symbolId', 'limit', 'sync')}
+    try:
+        filters = {name: int(args[name]) if args[name] else None for name in ('from', 'to', 'positionId', 'symbolId', 'limit')}
+        accountId = queryAccount(request)
+    except ValueError:
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected ?from=&to=&positionId=&symbolId=&limit=&sync=true&accountId= (all optional, integers, timestamps in ms)'}).encode('utf-8')
+
+    def answer(_=None):
+        return historyStore.query(accountId, kind, filters['from'], filters['to'], filters['positionId'],
+                                  filters['symbolId'], filters['limit'])
+
+    encode = responseEncoder(request)
+    if args['sync'].lower() in ('1', 'true', 'yes'):
+        result = syncHistory(accountId)
+        result.addCallback(lambda synced: answer() if isinstance(synced, dict) else synced)
+        result.addCallback(encode)
+        return result
+    return encode(answer())
+
+@app.route('/api/history/deals')
+def http_history_deals(request):
+    """Stored deals, filtered by ?from=&to= (execution time), ?positionId=, ?symbolId= and ?limit=."""
+    return historyQuery(request, DEALS)
+
+@app.route('/api/history/orders')
+def http_history_orders(request):
+    """Stored orders, filtered by ?from=&to= (last update), ?positionId=, ?symbolId= and ?limit=."""
+    return historyQuery(request, ORDERS)
+
+@app.route('/api/positions')
+def http_positions(request):
+    """Open positions from the local execution state, filtered by ?symbolId= and ?side=."""
+    return executionQuery(request, 'position')
+
+@app.route('/api/orders')
+def http_orders(request):
+    """Pending orders from the local execution state, filtered by ?symbolId= and ?side=."""
+    return executionQuery(request, 'order')
+
 @app.route('/api/amend-position', methods=['POST'])
 def http_amend_position(request):
     """Amend stop loss / take profit on an open position."""
@@ -531,12 +1575,18 @@ def http_amend_position(request):
         stopLoss = data.get('stopLoss')
         takeProfit = data.get('takeProfit')
         trailingStopLoss = data.get('trailingStopLoss')
-        result = sendProtoOAAmendPositionSLTPReq(positionId, stopLoss, takeProfit, trailingStopLoss)
+        accountId = accountFor(data.get('accountId'))
+        position = executionState.find(accountId, 'position', positionId)
+        if position is None:
+            result = sendProtoOAAmendPositionSLTPReq(accountId, positionId, stopLoss, takeProfit, trailingStopLoss)
+        else:
+            result = withSymbolSpec(accountId, position.tradeData.symbolId, lambda spec: sendProtoOAAmendPositionSLTPReq(
+                accountId, positionId, normalizePrice(spec, stopLoss), normalizePrice(spec, takeProfit), trailingStopLoss))
         result.addCallback(encodeResult)
         return result
     except (ValueError, KeyError):
         request.setResponseCode(400)
-        return json.dumps({'error': 'expected { positionId, stopLoss?, takeProfit?, trailingStopLoss? }'}).encode('utf-8')
+        return json.dumps({'error': 'expected { positionId, stopLoss?, takeProfit?, trailingStopLoss?, accountId? }'}).encode('utf-8')
 
 @app.route('/api/amend-order', methods=['POST'])
 def http_amend_order(request):
@@ -548,22 +1598,63 @@ def http_amend_order(request):
         volume = data.get('volume')
         limitPrice = data.get('limitPrice')
         stopPrice = data.get('stopPrice')
-        result = sendProtoOAAmendOrderReq(orderId, volume, limitPrice, stopPrice)
+        accountId = accountFor(data.get('accountId'))
+        order = executionState.find(accountId, 'order', orderId)
+        if order is None:
+            result = sendProtoOAAmendOrderReq(accountId, orderId, volume, limitPrice, stopPrice)
+        else:
+            result = withSymbolSpec(accountId, order.tradeData.symbolId, lambda spec: sendProtoOAAmendOrderReq(
+                accountId, orderId, None if volume in (None, "") else normalizeVolume(spec, volume),
+                normalizePrice(spec, limitPrice), normalizePrice(spec, stopPrice)))
         result.addCallback(encodeResult)
         return result
     except (ValueError, KeyError):
         request.setResponseCode(400)
-        return json.dumps({'error': 'expected { orderId, volume?, limitPrice?, stopPrice? }'}).encode('utf-8')
+        return json.dumps({'error': 'expected { orderId, volume?, limitPrice?, stopPrice?, accountId? }'}).encode('utf-8')
+
+def bulkRoute(request, kind):
+    """Parse { symbolId?, side?, accountId? } and run a bulk close/cancel, answering with every target's outcome."""
+    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+    body = request.content.read().decode('utf-8')
+    try:
+        data = json.loads(body) if body.strip() else {}
+        symbolId = int(data['symbolId']) if data.get('symbolId') not in (None, "") else None
+        side = str(data.get('side') or '').upper()
+        ProtoOATradeSide.Value(side) if side else None
+        accountId = accountFor(data.get('accountId'))
+        if accountId is None:
+            raise ValueError('no account')
+    except (ValueError, TypeError, AttributeError):
+        request.setResponseCode(400)
+        return json.dumps({'error': 'expected { symbolId?, side?: BUY|SELL, accountId? } (all optional)'}).encode('utf-8')
+
+    def answer(result):
+        if type(result) is not dict:
+            request.setResponseCode(502)
+            return encodeResult(result)
+        return json.dumps(result).encode('utf-8')
+    return bulkExecute(accountId, kind, symbolId, side).addCallback(answer)
+
+@app.route('/api/close-positions', methods=['POST'])
+def http_close_positions(request):
+    """Close every open position of the account, or only those of one symbol and/or side."""
+    return bulkRoute(request, 'position')
+
+@app.route('/api/cancel-orders', methods=['POST'])
+def http_cancel_orders(request):
+    """Cancel every pending order of the account, or only those of one symbol and/or side."""
+    return bulkRoute(request, 'order')
 
 @app.route('/api/refresh-token', methods=['POST'])
 def http_refresh_token(request):
     request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-    success = doTokenRefresh()
-    if success:
-        return json.dumps({'result': 'Token refreshed successfully'}).encode('utf-8')
-    else:
-        request.setResponseCode(500)
-        return json.dumps({'error': 'Token refresh failed — check logs and ensure CTRADER_REFRESH_TOKEN is set'}).encode('utf-8')
+    def respond(success):
+        if success:
+            return json.dumps({'result': 'Token refreshed successfully'}).encode('utf-8')
+        else:
+            request.setResponseCode(500)
+            return json.dumps({'error': 'Token refresh failed — check logs and ensure CTRADER_REFRESH_TOKEN is set'}).encode('utf-8')
+    return doTokenRefresh().addCallback(respond)
 
 @app.route('/api/market-order', methods=['POST'])
 def http_market_order(request):
@@ -574,42 +1665,172 @@ def http_market_order(request):
         orderType = data['orderType'].upper()
         tradeSide = data['tradeSide'].upper()
         volume = float(data['volume'])
+        price = data.get('price')
         comment = data.get('comment', '')
         relativeStopLoss = data.get('relativeStopLoss')
         relativeTakeProfit = data.get('relativeTakeProfit')
-        result = sendProtoOANewOrderReq(symbolId, orderType, tradeSide, volume, None, comment, relativeStopLoss, relativeTakeProfit)
+        accountId = accountFor(data.get('accountId'))
+        kind = ProtoOAOrderType.Value(orderType)
+        if tradeSide not in ProtoOATradeSide.keys() or (kind != ProtoOAOrderType.MARKET and price in (None, "")):
+            raise ValueError(tradeSide)
+
+        def send(spec):
+            checkNewOrder(spec, kind)
+            return sendProtoOANewOrderReq(accountId, symbolId, orderType, tradeSide, normalizeVolume(spec, volume),
+                                          normalizePrice(spec, price), comment,
+                                          normalizeRelative(spec, relativeStopLoss), normalizeRelative(spec, relativeTakeProfit))
+        result = withSymbolSpec(accountId, symbolId, send)
         result.addCallback(encodeResult)
-        if type(result) is str:
-            result = encodeResult(result)
         return result
     except (ValueError, KeyError):
         request.setResponseCode(400)
         return json.dumps({'error': 'unexpected input/output'}).encode('utf-8')
 
-def main():
-    global client
-    logger.info("Starting cTrader OpenAPI Proxy...")
-
-    client = Client(
-        EndPoints.PROTOBUF_LIVE_HOST if CTRADER_HOST.lower() == "live"
-        else EndPoints.PROTOBUF_DEMO_HOST,
-        EndPoints.PROTOBUF_PORT,
-        TcpProtocol
-    )
-    client.setConnectedCallback(connected)
-    client.setDisconnectedCallback(disconnected)
-    client.setMessageReceivedCallback(onMessageReceived)
-    client.startService()
-    scheduleTokenRefresh()
-
-    endpoint_description = f"tcp6:port={port}:interface={host}"
-    endpoint = endpoints.serverFromString(reactor, endpoint_description)
-    site = Site(app.resource())
+def brokerRequest(worker, message):
+    """Answer a request an HTTP worker forwarded over BROKER_SOCKET.
+
+    Authorization, spot subscriptions and the token belong to the broker's sessions,
+    so those are answered here; everything else is sent on to cTrader.
+    """
+    if message.payloadType == ADMIN:
+        return ProtoMessage(payloadType=ADMIN, payload=ADMIN_ROUTES[message.payload.decode('utf-8')]())
+    request = Protobuf.extract(message)
+    if isinstance(request, ProtoOAApplicationAuthReq):
+        return protoMessage(ProtoOAApplicationAuthRes())
+    if isinstance(request, ProtoOAAccountAuthReq):
+        if request.ctidTraderAccountId in authorizedAccounts:
+            return protoMessage(ProtoOAAccountAuthRes(ctidTraderAccountId=request.ctidTraderAccountId))
+        return sendProtoOAAccountAuthReq(request.ctidTraderAccountId)
+    if isinstance(request, ProtoOARefreshTokenReq):
+        return doTokenRefresh().addCallback(refreshTokenResponse)
+    if isinstance(request, ProtoOASubscribeSpotsReq):
+        return subscribeWorkerSpots(worker, request)
+    if isinstance(request, ProtoOAUnsubscribeSpotsReq):
+        return unsubscribeWorkerSpots(worker, request)
+    if 'accessToken' in request.DESCRIPTOR.fields_by_name:
+        request.accessToken = tokens.accessToken  # a worker's copy may predate the last refresh
+    return sendRequest(request, worker.upstreamId(message.clientMsgId))
+
+# Observability routes the broker answers for its workers (see fromBroker)
+ADMIN_ROUTES = {
+    '/metrics': lambda: metrics.render(),
+    '/api/stats': lambda: statsBody(),
+    '/api/capture': lambda: capture.dump(),
+}
+
+def refreshTokenResponse(ok):
+    if not ok:
+        raise BrokerError(502, f"Token refresh failed: {tokens.lastError}")
+    expiresIn = max(0, int(tokens.expiresAt - time.time())) if tokens.expiresAt else 0
+    return protoMessage(ProtoOARefreshTokenRes(accessToken=tokens.accessToken, tokenType="bearer",
+                                               expiresIn=expiresIn, refreshToken=""))
+
+def subscribeWorkerSpots(worker, request):
+    """Take one quote book reference per symbol for the worker, so each symbol is subscribed upstream once for all workers."""
+    accountId = request.ctidTraderAccountId
+    def held(result, key):
+        if key in quoteBook.refCounts:
+            worker.subscriptions.add(key)
+        return result
+    keys = [(accountId, symbolId) for symbolId in request.symbolId if (accountId, symbolId) not in worker.subscriptions]
+    results = defer.gatherResults([quoteBook.acquire(*key).addCallback(held, key) for key in keys], consumeErrors=True)
+    def answer(results):
+        for result in results:
+            if result is not None and result.payloadType == ProtoOAErrorRes().payloadType \
+                    and Protobuf.extract(result).errorCode != "ALREADY_SUBSCRIBED":
+                return result
+        return protoMessage(ProtoOASubscribeSpotsRes(ctidTraderAccountId=accountId))
+    results.addCallbacks(answer, unwrapFirstError)
+    return results
+
+def unsubscribeWorkerSpots(worker, request):
+    accountId = request.ctidTraderAccountId
+    for key in [(accountId, symbolId) for symbolId in request.symbolId if (accountId, symbolId) in worker.subscriptions]:
+        worker.subscriptions.discard(key)
+        quoteBook.release(*key).addErrback(logFailure)
+    return protoMessage(ProtoOAUnsubscribeSpotsRes(ctidTraderAccountId=accountId))
+
+def releaseWorkerSpots(worker):
+    """Drop the quote book references of a worker that went away."""
+    logger.info(f"HTTP worker disconnected from the broker ({len(worker.subscriptions)} spot subscriptions released)")
+    for key in worker.subscriptions:
+        quoteBook.release(*key).addErrback(logFailure)
+    worker.subscriptions.clear()
+
+def onWorkerExit(index, reason):
+    log = logger.info if reason.check(ProcessDone) else logger.warning
+    log(f"HTTP worker {index} exited ({reason.getErrorMessage()})")
+
+def startBroker():
+    """Serve the upstream sessions to HTTP_WORKERS worker processes over BROKER_SOCKET, and start the workers."""
+    global broker
+    directory = os.path.dirname(BROKER_SOCKET)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(BROKER_SOCKET):
+        os.remove(BROKER_SOCKET)  # left behind by a broker that did not shut down cleanly
+    broker = BrokerServer(brokerRequest, releaseWorkerSpots)
+    reactor.listenUNIX(BROKER_SOCKET, broker)
+    workers = Workers(HTTP_WORKERS, [sys.executable, os.path.abspath(__file__)],
+                      lambda index: dict(os.environ, PROXY_WORKER=str(index)), onWorkerExit)
+    workers.start()
+    reactor.addSystemEventTrigger('before', 'shutdown', workers.stop)
+    logger.info(f"Broker listening on {BROKER_SOCKET}; started {HTTP_WORKERS} HTTP workers on http://{host}:{port}")
+
+def listenHttp():
+    """Serve the Klein app on host:port; HTTP workers share the port through SO_REUSEPORT."""
+    site = Site(app.resource(), requestFactory=proxyRequest)
     site.displayTracebacks = True
 
-    endpoint.listen(site)
+    if PROXY_WORKER:
+        listenShared(port, host, site)
+    else:
+        endpoint_description = f"tcp6:port={port}:interface={host}"
+        endpoint = endpoints.serverFromString(reactor, endpoint_description)
+        endpoint.listen(site)
     logger.info(f"HTTP proxy listening on http://{host}:{port}")
+
+def main():
+    global pool, currentAccountId, capture
+    if PROXY_WORKER:
+        logger.info(f"Starting HTTP worker {PROXY_WORKER}...")
+        client = BrokerClient(BROKER_SOCKET)
+        client.setConnectedCallback(connected)
+        client.setDisconnectedCallback(disconnected)
+        client.setMessageReceivedCallback(onMessageReceived)
+        pool = SessionPool([openSession(f"worker-{PROXY_WORKER}", ROLE_GENERAL, client)])
+    else:
+        logger.info("Starting cTrader OpenAPI Proxy...")
+        pool = SessionPool(
+            [openSession(f"general-{i}", ROLE_GENERAL) for i in range(max(1, UPSTREAM_SESSIONS))],
+            [openSession(f"historical-{i}", ROLE_HISTORICAL) for i in range(UPSTREAM_HISTORICAL_SESSIONS)],
+        )
+    for accountId in CTRADER_ACCOUNTIDS:
+        pool.sessionsFor(accountId)  # pin up front so each session authorizes its accounts once app auth succeeds
+    if CTRADER_ACCOUNTIDS:
+        logger.info(f"Default account {CTRADER_ACCOUNTIDS[0]} from .env")
+        currentAccountId = int(CTRADER_ACCOUNTIDS[0])
+    if (CAPTURE_RING_BYTES or CAPTURE_PATH) and not PROXY_WORKER:
+        capture = ProxyTcpProtocol.capture = Capture(CAPTURE_RING_BYTES, CAPTURE_PATH or None, CAPTURE_FILE_BYTES, CAPTURE_BACKUPS)
+        for session in pool.sessions:
+            capture.register(session.client)
+        reactor.addSystemEventTrigger('before', 'shutdown', capture.close)
+        logger.info(f"Capturing upstream traffic ({CAPTURE_RING_BYTES} bytes in memory{', file ' + CAPTURE_PATH if CAPTURE_PATH else ''})")
+    for session in pool.sessions:
+        session.client.startService()
+    task.LoopingCall(checkExecutionDrift).start(RECONCILE_INTERVAL, now=False)
+    if not PROXY_WORKER:
+        scheduleTokenRefresh()
+        if historyStore is not None:
+            task.LoopingCall(syncAllHistory).start(HISTORY_SYNC_INTERVAL, now=False)
+
+    if HTTP_WORKERS > 0 and not PROXY_WORKER:
+        startBroker()
+    else:
+        listenHttp()
     reactor.run()
 
+ROUTES = {rule.rule for rule in app.url_map.iter_rules()}
+
 if __name__ == '__main__':
     main()
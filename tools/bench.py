@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+tools/bench.py
+
+Load generator for the proxy. Runs each scenario — an /api/* route or a
+/get-data command — with a fixed number of concurrent clients and reports
+throughput and p50/p99 latency per scenario. Point the proxy at
+tools/fake_ctrader.py for repeatable numbers without a live account:
+
+    python tools/fake_ctrader.py --latency 20 &
+    CTRADER_HOST=localhost:5035 CTRADER_TOKEN=x CTRADER_ACCOUNTID=1001 python main.py &
+    python tools/bench.py --requests 500 --concurrency 20 --json bench.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from twisted.internet import defer, task
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+HOUR_MS = 3600 * 1000
+
+
+def jsonBody(obj):
+    return FileBodyProducer(BytesIO(json.dumps(obj).encode())) if obj is not None else None
+
+
+def scenarios(symbolId):
+    """name → (method, path, JSON body or None); bodies are built once per run."""
+    now = int(time.time() * 1000)
+    return {
+        "get-data ProtoOATraderReq": ("GET", "/get-data?command=ProtoOATraderReq", None),
+        "get-data ProtoOAReconcileReq": ("GET", "/get-data?command=ProtoOAReconcileReq", None),
+        "get-data ProtoOASymbolsListReq": ("GET", "/get-data?command=ProtoOASymbolsListReq", None),
+        "get-data ProtoOAAssetListReq": ("GET", "/get-data?command=ProtoOAAssetListReq", None),
+        "get-data ProtoOAVersionReq": ("GET", "/get-data?command=ProtoOAVersionReq", None),
+        "get-data ProtoOADealListReq": ("GET", f"/get-data?command=ProtoOADealListReq%20{now - 24 * HOUR_MS}%20{now}", None),
+        "api/symbols": ("GET", "/api/symbols?prefix=SYM00", None),
+        "api/positions": ("GET", "/api/positions", None),
+        "api/orders": ("GET", "/api/orders", None),
+        "api/quote": ("GET", f"/api/quote?symbolId={symbolId}", None),
+        "api/trendbars M1 1h": ("POST", "/api/trendbars",
+                                {"fromTimestamp": now - HOUR_MS, "toTimestamp": now, "period": "M1", "symbolId": symbolId}),
+        "api/trendbars M1 1h columnar": ("POST", "/api/trendbars",
+                                         {"fromTimestamp": now - HOUR_MS, "toTimestamp": now, "period": "M1",
+                                          "symbolId": symbolId, "format": "columnar"}),
+        "api/live-quote": ("POST", "/api/live-quote", {"symbolId": symbolId, "quoteType": "BID", "timeDeltaInSeconds": 60}),
+        "api/tick-history 1m": ("POST", "/api/tick-history",
+                                {"fromTimestamp": now - 60000, "toTimestamp": now, "quoteType": "BID", "symbolId": symbolId}),
+        "api/market-order": ("POST", "/api/market-order",
+                             {"symbolId": symbolId, "orderType": "MARKET", "tradeSide": "BUY", "volume": 1000}),
+        "api/batch x10": ("POST", "/api/batch", {"commands": ["ProtoOATraderReq", "ProtoOAReconcileReq"] * 5}),
+        "api/stats": ("GET", "/api/stats", None),
+        "metrics": ("GET", "/metrics", None),
+    }
+
+
+@defer.inlineCallbacks
+def runScenario(agent, base, method, path, body, requests, concurrency, timeout):
+    """Send requests with concurrency clients in flight; returns (latencies in seconds, errors, elapsed seconds)."""
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+    headers = Headers({b"Content-Type": [b"application/json"], b"X-Request-Timeout": [str(timeout).encode()]})
+
+    @defer.inlineCallbacks
+    def client():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                response = yield agent.request(method.encode(), (base + path).encode(), headers, jsonBody(body))
+                yield readBody(response)
+                if response.code >= 400:
+                    errors[0] += 1
+                    continue
+            except Exception:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    yield defer.gatherResults([client() for _ in range(concurrency)])
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def summarize(name, latencies, errors, elapsed):
+    samples = np.array(latencies) * 1000
+    return {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(float(np.percentile(samples, 50)), 2) if len(samples) else None,
+        "p99_ms": round(float(np.percentile(samples, 99)), 2) if len(samples) else None,
+        "max_ms": round(float(samples.max()), 2) if len(samples) else None,
+    }
+
+
+def printTable(rows):
+    print(f"{'scenario':<34} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in rows:
+        cells = [f"{row[key]:>9}" if row[key] is not None else f"{'-':>9}" for key in ("throughput", "p50_ms", "p99_ms", "max_ms")]
+        print(f"{row['scenario']:<34} {row['requests']:>8} {row['errors']:>6} " + " ".join(cells))
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Throughput and latency per proxy route / command")
+    parser.add_argument("--base", default="http://localhost:9009", help="proxy base URL")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight per scenario")
+    parser.add_argument("--timeout", type=float, default=30, help="X-Request-Timeout sent with every request")
+    parser.add_argument("--symbol", type=int, default=1, help="symbolId used by symbol-specific scenarios")
+    parser.add_argument("--only", action="append", default=[], help="run only scenarios containing this text (repeatable)")
+    parser.add_argument("--json", help="also write the results to this file, for comparing runs")
+    return parser.parse_args(argv)
+
+
+@defer.inlineCallbacks
+def main(reactor, argv):
+    options = parseArgs(argv)
+    pool = HTTPConnectionPool(reactor)
+    pool.maxPersistentPerHost = options.concurrency
+    agent = Agent(reactor, pool=pool)
+    selected = {name: spec for name, spec in scenarios(options.symbol).items()
+                if not options.only or any(text in name for text in options.only)}
+    # one subscription so /api/quote answers from the quote book
+    yield agent.request(b"POST", f"{options.base}/api/subscribe".encode(), None,
+                        jsonBody({"symbolId": options.symbol})).addCallback(readBody)
+    rows = []
+    for name, (method, path, body) in selected.items():
+        latencies, errors, elapsed = yield runScenario(agent, options.base, method, path, body,
+                                                       options.requests, options.concurrency, options.timeout)
+        rows.append(summarize(name, latencies, errors, elapsed))
+    printTable(rows)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump({"requests": options.requests, "concurrency": options.concurrency, "results": rows}, f, indent=2)
+    yield pool.closeCachedConnections()
+
+
+if __name__ == "__main__":
+    task.react(main, (sys.argv[1:],))
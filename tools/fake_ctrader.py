@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""
+tools/fake_ctrader.py
+
+A local stand-in for the cTrader Open API server, for benchmarking the proxy
+without credentials or a broker account. It speaks the same framing as the
+library's TcpProtocol (TLS, 4-byte length-prefixed ProtoMessage) and answers
+app/account auth, reconcile, symbols, trendbars, tick data, orders and
+cancels (with execution events), deal and order history and spot
+subscriptions with synthetic data.
+
+    python tools/fake_ctrader.py --port 5035 --latency 20
+    CTRADER_HOST=localhost:5035 CTRADER_TOKEN=x CTRADER_ACCOUNTID=1001 python main.py
+"""
+
+import argparse
+import datetime
+import itertools
+import random
+import sys
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage, ProtoHeartbeatEvent
+from ctrader_open_api.messages.OpenApiMessages_pb2 import *
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import *
+from twisted.internet import reactor, ssl, task
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import Int32StringReceiver
+
+BASE_PRICE = 110000  # 1.10000 in 1/100000 units
+HEARTBEAT_INTERVAL = 10  # seconds, as cTrader
+HISTORY_PAGE = 200  # deals / orders per list response before hasMore is set
+PERIOD_MINUTES = {
+    "M1": 1, "M2": 2, "M3": 3, "M4": 4, "M5": 5, "M10": 10, "M15": 15, "M30": 30,
+    "H1": 60, "H4": 240, "H12": 720, "D1": 1440, "W1": 10080, "MN1": 43200,
+}
+
+
+class FakeState:
+    """Synthetic broker data shared by every connection."""
+
+    def __init__(self, options):
+        self.options = options
+        self.orderIds = itertools.count(1000000)
+        self.positions = {}
+        self.pending = {}  # orderId → accepted limit / stop order
+        self.deals = []
+        self.orders = []
+        now = int(time.time() * 1000)
+        for i in range(options.deals):
+            # filled market orders spread over the last 60 days
+            executed = now - random.randint(0, 60 * 86400000)
+            self.fill(1 + i % options.symbols, 100000, ProtoOATradeSide.BUY, next(self.orderIds), executed)
+        for i in range(options.positions):
+            self.openPosition(1 + i % options.symbols, 100000, ProtoOATradeSide.BUY)
+
+    def symbolName(self, symbolId):
+        return f"SYM{symbolId:04d}"
+
+    def openPosition(self, symbolId, volume, tradeSide):
+        positionId = next(self.orderIds)
+        self.positions[positionId] = ProtoOAPosition(
+            positionId=positionId, positionStatus=ProtoOAPositionStatus.POSITION_STATUS_OPEN, swap=0, price=1.1,
+            tradeData=ProtoOATradeData(symbolId=symbolId, volume=volume, tradeSide=tradeSide,
+                                       openTimestamp=int(time.time() * 1000)),
+        )
+        return self.positions[positionId]
+
+    def fill(self, symbolId, volume, tradeSide, positionId, timestamp=None):
+        """Record a filled market order and its deal; returns (order, deal)."""
+        timestamp = timestamp or int(time.time() * 1000)
+        order = ProtoOAOrder(orderId=next(self.orderIds), orderType=ProtoOAOrderType.MARKET,
+                             orderStatus=ProtoOAOrderStatus.ORDER_STATUS_FILLED, positionId=positionId,
+                             utcLastUpdateTimestamp=timestamp,
+                             tradeData=ProtoOATradeData(symbolId=symbolId, volume=volume, tradeSide=tradeSide,
+                                                        openTimestamp=timestamp))
+        deal = ProtoOADeal(dealId=next(self.orderIds), orderId=order.orderId, positionId=positionId, volume=volume,
+                           filledVolume=volume, symbolId=symbolId, createTimestamp=timestamp,
+                           executionTimestamp=timestamp, utcLastUpdateTimestamp=timestamp, executionPrice=1.1,
+                           tradeSide=tradeSide, dealStatus=ProtoOADealStatus.FILLED)
+        self.orders.append(order)
+        self.deals.append(deal)
+        return order, deal
+
+    def history(self, items, fromTimestamp, toTimestamp, timestamp):
+        """Items inside the window, oldest first, at most HISTORY_PAGE of them, and whether more were left out."""
+        inside = sorted((item for item in items if fromTimestamp <= timestamp(item) <= toTimestamp), key=timestamp)
+        return inside[:HISTORY_PAGE], len(inside) > HISTORY_PAGE
+
+
+class FakeCTraderProtocol(Int32StringReceiver):
+    """One client connection: decodes ProtoMessages and answers them after the configured latency."""
+    MAX_LENGTH = 15000000
+
+    def connectionMade(self):
+        self.state = self.factory.state
+        self.options = self.state.options
+        self.subscriptions = set()
+        self.spots = task.LoopingCall(self.sendSpots)
+        if self.options.spot_rate > 0:
+            self.spots.start(1 / self.options.spot_rate, now=False)
+        self.heartbeats = task.LoopingCall(self.send, ProtoHeartbeatEvent())
+        self.heartbeats.start(HEARTBEAT_INTERVAL, now=False)
+
+    def connectionLost(self, reason):
+        for loop in (self.spots, self.heartbeats):
+            if loop.running:
+                loop.stop()
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        if message.payloadType == ProtoHeartbeatEvent().payloadType:
+            return  # like cTrader: the client answers ours, we never answer theirs
+        requestClass = PAYLOAD_CLASSES.get(message.payloadType)
+        name = requestClass.__name__ if requestClass else str(message.payloadType)
+        handler = requestClass and getattr(self, "on" + name[len("ProtoOA"):], None)
+        if handler is None:
+            replies = [ProtoOAErrorRes(errorCode="NOT_IMPLEMENTED", description=f"fake server does not answer {name}")]
+        else:
+            request = requestClass()
+            request.ParseFromString(message.payload)
+            replies = handler(request)
+        delay = max(0.0, random.gauss(self.options.latency, self.options.jitter) / 1000)
+        reactor.callLater(delay, self.sendAll, replies, message.clientMsgId if message.HasField("clientMsgId") else None)
+
+    def sendAll(self, replies, clientMsgId):
+        if self.transport is None or not self.connected:
+            return
+        for reply in replies:
+            self.send(reply, clientMsgId)
+
+    def send(self, payload, clientMsgId=None):
+        message = ProtoMessage(payloadType=payload.payloadType, payload=payload.SerializeToString())
+        if clientMsgId is not None:
+            message.clientMsgId = clientMsgId
+        self.sendString(message.SerializeToString())
+
+    def sendSpots(self):
+        for accountId, symbolId in self.subscriptions:
+            price = BASE_PRICE + random.randint(-500, 500)
+            self.send(ProtoOASpotEvent(ctidTraderAccountId=accountId, symbolId=symbolId, bid=price, ask=price + 20,
+                                       timestamp=int(time.time() * 1000)))
+
+    # --- handlers: each returns the list of messages to send back ---
+
+    def onApplicationAuthReq(self, request):
+        return [ProtoOAApplicationAuthRes()]
+
+    def onAccountAuthReq(self, request):
+        return [ProtoOAAccountAuthRes(ctidTraderAccountId=request.ctidTraderAccountId)]
+
+    def onVersionReq(self, request):
+        return [ProtoOAVersionRes(version="fake")]
+
+    def onGetAccountListByAccessTokenReq(self, request):
+        return [ProtoOAGetAccountListByAccessTokenRes(accessToken=request.accessToken, ctidTraderAccount=[
+            ProtoOACtidTraderAccount(ctidTraderAccountId=accountId, isLive=False)
+            for accountId in self.options.accounts
+        ])]
+
+    def onAccountLogoutReq(self, request):
+        return [ProtoOAAccountLogoutRes(ctidTraderAccountId=request.ctidTraderAccountId)]
+
+    def onTraderReq(self, request):
+        return [ProtoOATraderRes(ctidTraderAccountId=request.ctidTraderAccountId, trader=ProtoOATrader(
+            ctidTraderAccountId=request.ctidTraderAccountId, balance=1000000, depositAssetId=1, moneyDigits=2))]
+
+    def onAssetListReq(self, request):
+        return [ProtoOAAssetListRes(ctidTraderAccountId=request.ctidTraderAccountId, asset=[
+            ProtoOAAsset(assetId=i, name=f"AS{i}", digits=2) for i in range(1, 51)])]
+
+    def onSymbolsListReq(self, request):
+        return [ProtoOASymbolsListRes(ctidTraderAccountId=request.ctidTraderAccountId, symbol=[
+            ProtoOALightSymbol(symbolId=i, symbolName=self.state.symbolName(i), enabled=True,
+                               baseAssetId=1, quoteAssetId=2, symbolCategoryId=1)
+            for i in range(1, self.options.symbols + 1)])]
+
+    def onSymbolByIdReq(self, request):
+        return [ProtoOASymbolByIdRes(ctidTraderAccountId=request.ctidTraderAccountId, symbol=[
+            ProtoOASymbol(symbolId=symbolId, digits=5, pipPosition=4, lotSize=10000000,
+                          minVolume=100000, maxVolume=10000000000, stepVolume=100000)
+            for symbolId in request.symbolId])]
+
+    def onReconcileReq(self, request):
+        return [ProtoOAReconcileRes(ctidTraderAccountId=request.ctidTraderAccountId,
+                                    position=list(self.state.positions.values()),
+                                    order=list(self.state.pending.values()))]
+
+    def onGetTrendbarsReq(self, request):
+        minutes = PERIOD_MINUTES[ProtoOATrendbarPeriod.Name(request.period)]
+        first = request.fromTimestamp // 60000 // minutes * minutes
+        last = request.toTimestamp // 60000
+        starts = range(first, last + 1, minutes)[-self.options.bars:]
+        bars = [ProtoOATrendbar(volume=random.randint(1, 1000), utcTimestampInMinutes=start,
+                                low=BASE_PRICE + random.randint(-1000, 0), deltaOpen=random.randint(0, 100),
+                                deltaClose=random.randint(0, 100), deltaHigh=random.randint(100, 200))
+                for start in starts]
+        return [ProtoOAGetTrendbarsRes(ctidTraderAccountId=request.ctidTraderAccountId, period=request.period,
+                                       timestamp=int(time.time() * 1000), symbolId=request.symbolId, trendbar=bars)]
+
+    def onGetTickDataReq(self, request):
+        count = min(self.options.ticks, max(0, request.toTimestamp - request.fromTimestamp))
+        ticks = []
+        previous = (0, 0)
+        for i in range(count):  # newest first: the first tick is absolute, the rest deltas to the one before
+            current = (request.toTimestamp - i, BASE_PRICE + random.randint(-50, 50))
+            ticks.append(ProtoOATickData(timestamp=current[0] - previous[0], tick=current[1] - previous[1]))
+            previous = current
+        hasMore = count == self.options.ticks and request.toTimestamp - count > request.fromTimestamp
+        return [ProtoOAGetTickDataRes(ctidTraderAccountId=request.ctidTraderAccountId, tickData=ticks, hasMore=hasMore)]
+
+    def onSubscribeSpotsReq(self, request):
+        self.subscriptions.update((request.ctidTraderAccountId, symbolId) for symbolId in request.symbolId)
+        return [ProtoOASubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId)]
+
+    def onUnsubscribeSpotsReq(self, request):
+        self.subscriptions.difference_update((request.ctidTraderAccountId, symbolId) for symbolId in request.symbolId)
+        return [ProtoOAUnsubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId)]
+
+    def onNewOrderReq(self, request):
+        accountId = request.ctidTraderAccountId
+        tradeData = ProtoOATradeData(symbolId=request.symbolId, volume=request.volume, tradeSide=request.tradeSide,
+                                     openTimestamp=int(time.time() * 1000))
+        order = ProtoOAOrder(orderId=next(self.state.orderIds), tradeData=tradeData, orderType=request.orderType,
+                             orderStatus=ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED)
+        if request.orderType != ProtoOAOrderType.MARKET:
+            self.state.pending[order.orderId] = order
+            return [ProtoOAExecutionEvent(ctidTraderAccountId=accountId, order=order,
+                                          executionType=ProtoOAExecutionType.ORDER_ACCEPTED)]
+        position = self.state.openPosition(request.symbolId, request.volume, request.tradeSide)
+        order, deal = self.state.fill(request.symbolId, request.volume, request.tradeSide, position.positionId)
+        return [
+            ProtoOAExecutionEvent(ctidTraderAccountId=accountId, order=order, position=position, deal=deal,
+                                  executionType=ProtoOAExecutionType.ORDER_FILLED),
+        ]
+
+    def onClosePositionReq(self, request):
+        position = self.state.positions.pop(request.positionId, None)
+        if position is None:
+            return [ProtoOAErrorRes(ctidTraderAccountId=request.ctidTraderAccountId, errorCode="POSITION_NOT_FOUND")]
+        position.positionStatus = ProtoOAPositionStatus.POSITION_STATUS_CLOSED
+        closing = ProtoOATradeSide.SELL if position.tradeData.tradeSide == ProtoOATradeSide.BUY else ProtoOATradeSide.BUY
+        order, deal = self.state.fill(position.tradeData.symbolId, position.tradeData.volume, closing, position.positionId)
+        return [ProtoOAExecutionEvent(ctidTraderAccountId=request.ctidTraderAccountId, position=position, order=order,
+                                      deal=deal, executionType=ProtoOAExecutionType.ORDER_FILLED)]
+
+    def onCancelOrderReq(self, request):
+        order = self.state.pending.pop(request.orderId, None)
+        if order is None:
+            return [ProtoOAErrorRes(ctidTraderAccountId=request.ctidTraderAccountId, errorCode="ORDER_NOT_FOUND")]
+        order.orderStatus = ProtoOAOrderStatus.ORDER_STATUS_CANCELLED
+        return [ProtoOAExecutionEvent(ctidTraderAccountId=request.ctidTraderAccountId, order=order,
+                                      executionType=ProtoOAExecutionType.ORDER_CANCELLED)]
+
+    def onDealListReq(self, request):
+        deals, hasMore = self.state.history(self.state.deals, request.fromTimestamp, request.toTimestamp,
+                                            lambda deal: deal.executionTimestamp)
+        return [ProtoOADealListRes(ctidTraderAccountId=request.ctidTraderAccountId, deal=deals, hasMore=hasMore)]
+
+    def onOrderListReq(self, request):
+        orders, hasMore = self.state.history(self.state.orders, request.fromTimestamp, request.toTimestamp,
+                                             lambda order: order.utcLastUpdateTimestamp)
+        return [ProtoOAOrderListRes(ctidTraderAccountId=request.ctidTraderAccountId, order=orders, hasMore=hasMore)]
+
+    def onGetPositionUnrealizedPnLReq(self, request):
+        return [ProtoOAGetPositionUnrealizedPnLRes(ctidTraderAccountId=request.ctidTraderAccountId, moneyDigits=2)]
+
+
+# payloadType → request message class, for every ProtoOA*Req
+PAYLOAD_CLASSES = {
+    cls().payloadType: cls
+    for name, cls in list(globals().items())
+    if name.startswith("ProtoOA") and name.endswith("Req") and hasattr(cls, "DESCRIPTOR")
+}
+
+
+def selfSignedCertificate():
+    """A throwaway TLS certificate; the proxy's client does not verify the server certificate."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(x509.random_serial_number()).not_valid_before(now)
+                   .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    keyPem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return ssl.PrivateCertificate.loadPEM(certificate.public_bytes(serialization.Encoding.PEM) + keyPem)
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Local fake cTrader Open API server for benchmarks")
+    parser.add_argument("--port", type=int, default=5035)
+    parser.add_argument("--latency", type=float, default=20, help="mean reply delay in milliseconds")
+    parser.add_argument("--jitter", type=float, default=5, help="standard deviation of the reply delay in milliseconds")
+    parser.add_argument("--symbols", type=int, default=1000, help="symbols in ProtoOASymbolsListRes")
+    parser.add_argument("--positions", type=int, default=20, help="open positions in ProtoOAReconcileRes")
+    parser.add_argument("--deals", type=int, default=2000, help="past deals (and their orders) over the last 60 days")
+    parser.add_argument("--bars", type=int, default=5000, help="trendbars per response at most")
+    parser.add_argument("--ticks", type=int, default=5000, help="ticks per tick data page at most")
+    parser.add_argument("--spot-rate", type=float, default=5, help="spot events per second per subscribed symbol (0 disables)")
+    parser.add_argument("--accounts", type=lambda value: [int(a) for a in value.split(",")], default=[1001],
+                        help="comma-separated account ids returned by the account list")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parseArgs(argv if argv is not None else sys.argv[1:])
+    factory = Factory.forProtocol(FakeCTraderProtocol)
+    factory.state = FakeState(options)
+    reactor.listenSSL(options.port, factory, selfSignedCertificate().options())
+    print(f"Fake cTrader listening on localhost:{options.port} (latency {options.latency:g}±{options.jitter:g} ms)")
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+tools/replay.py
+
+Feeds a capture of upstream traffic (CAPTURE_PATH, or GET /api/capture) back
+through the proxy's own onMessageReceived and HTTP layer, without cTrader.
+
+Unsolicited messages (spots, execution events, heartbeats) are replayed at the
+recorded pace divided by --speed (0 = as fast as possible). Requests sent by
+the proxy are answered with the responses recorded for the same request type,
+after the recorded round trip (also divided by --speed). Run tools/bench.py
+against it for load tests on realistic traffic:
+
+    python tools/replay.py data/upstream.ctcap --speed 10 --loop
+"""
+
+import argparse
+import os
+import sys
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("CTRADER_TOKEN", "replay")
+
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+    ProtoOAAccountAuthReq, ProtoOAAccountAuthRes, ProtoOAApplicationAuthReq, ProtoOAApplicationAuthRes, ProtoOAErrorRes,
+)
+from twisted.internet import defer, reactor
+
+import main
+from libs.capture import INBOUND, OUTBOUND, readCapture
+from libs.session_pool import ROLE_GENERAL
+
+
+class Recording:
+    """One channel of a capture: recorded responses per request payloadType and the unsolicited messages."""
+
+    def __init__(self):
+        self.responses = defaultdict(deque)  # request payloadType → (response ProtoMessage, round trip ns)
+        self.events = []  # (timestamp ns, ProtoMessage)
+        self.accounts = []
+
+
+def loadCapture(path):
+    """Split a capture file into one Recording per channel."""
+    recordings = defaultdict(Recording)
+    pending = {}
+    with open(path, "rb") as f:
+        for timestamp, direction, channel, data in readCapture(f):
+            message = ProtoMessage()
+            message.ParseFromString(data)
+            recording = recordings[channel]
+            key = (channel, message.clientMsgId)
+            if direction == OUTBOUND:
+                if message.HasField("clientMsgId"):
+                    pending[key] = (message.payloadType, timestamp)
+                if message.payloadType == ProtoOAAccountAuthReq().payloadType:
+                    recording.accounts.append(Protobuf.extract(message).ctidTraderAccountId)
+            elif direction == INBOUND and message.HasField("clientMsgId") and key in pending:
+                requestType, sentAt = pending.pop(key)
+                recording.responses[requestType].append((message, timestamp - sentAt))
+            else:
+                recording.events.append((timestamp, message))
+    return [recordings[channel] for channel in sorted(recordings)]
+
+
+class ReplayClient:
+    """Stands in for ctrader_open_api.Client: answers each request with the next recorded response of its type."""
+
+    def __init__(self, recording, speed):
+        self.recording = recording
+        self.speed = speed
+        self.isConnected = True
+
+    def send(self, request, clientMsgId=None, responseTimeoutInSeconds=None, **params):
+        recorded = self.recording.responses.get(request.payloadType)
+        if recorded:
+            response, roundTrip = recorded[0]
+            recorded.rotate(-1)
+            message = ProtoMessage()
+            message.CopyFrom(response)
+            delay = roundTrip / 1e9 / self.speed if self.speed else 0
+        else:
+            message = ProtoMessage(**self._fallback(request))
+            delay = 0
+        message.clientMsgId = clientMsgId or str(id(message))
+        deferred = defer.Deferred()
+        reactor.callLater(delay, self._deliver, message, deferred)
+        return deferred
+
+    def _fallback(self, request):
+        """Answer auth requests the capture does not contain, so sessions still become ready."""
+        if isinstance(request, ProtoOAApplicationAuthReq):
+            response = ProtoOAApplicationAuthRes()
+        elif isinstance(request, ProtoOAAccountAuthReq):
+            response = ProtoOAAccountAuthRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        else:
+            response = ProtoOAErrorRes(errorCode="NOT_IN_CAPTURE",
+                                       description=f"no recorded response to {type(request).__name__}")
+        return {"payloadType": response.payloadType, "payload": response.SerializeToString()}
+
+    def _deliver(self, message, deferred):
+        main.onMessageReceived(self, message)
+        if not deferred.called:
+            deferred.callback(message)
+
+
+def playEvents(client, events, speed, loop):
+    """Replay unsolicited messages one after another at the recorded spacing divided by speed."""
+    if not events:
+        return
+
+    def step(index):
+        timestamp, message = events[index]
+        main.onMessageReceived(client, message)
+        index += 1
+        if index == len(events):
+            if not loop:
+                return
+            index = 0
+            gap = 0
+        else:
+            gap = events[index][0] - timestamp
+        reactor.callLater(gap / 1e9 / speed if speed else 0, step, index)
+
+    step(0)
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Replay captured cTrader traffic through the proxy")
+    parser.add_argument("capture", help="capture file written by CAPTURE_PATH or downloaded from /api/capture")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed multiplier; 0 replays as fast as possible")
+    parser.add_argument("--loop", action="store_true", help="start over after the last unsolicited message")
+    parser.add_argument("--port", type=int, default=main.port, help="HTTP port to serve on")
+    return parser.parse_args(argv)
+
+
+def run(argv):
+    options = parseArgs(argv)
+    recordings = loadCapture(options.capture)
+    if not recordings:
+        sys.exit(f"{options.capture}: capture is empty")
+    clients = [ReplayClient(recording, options.speed) for recording in recordings]
+    main.pool = main.SessionPool([main.openSession(f"replay-{i}", ROLE_GENERAL, client) for i, client in enumerate(clients)])
+    accounts = [int(a) for a in main.CTRADER_ACCOUNTIDS] or [a for recording in recordings for a in recording.accounts]
+    for accountId in dict.fromkeys(accounts):
+        main.pool.sessionsFor(accountId)
+    main.currentAccountId = accounts[0] if accounts else None
+    for client in clients:
+        main.connected(client)
+    for client, recording in zip(clients, recordings):
+        playEvents(client, recording.events, options.speed, options.loop)
+    main.port = options.port
+    main.listenHttp()
+    reactor.run()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])